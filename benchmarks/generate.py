@@ -0,0 +1,446 @@
+'''
+Deterministic generators of synthetic bulk WHOIS dumps, in the formats and
+layout each RIR publishes them in, for benchmarking without downloads.
+
+The same style, size and seed always produce the same bytes. The records
+have what makes real dumps slow or awkward to parse: values continued over
+several lines (indented, "+" and colon-less lines), RIPE's personal data
+notices, dummy values, comments, rate limit notices and latin-1 names.
+'''
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import zipfile
+
+STYLES = ["ripe", "apnic", "afrinic", "lacnic", "arin"]
+
+# The key the single db file of an RIR is published under
+DB = "db"
+
+MANIFEST = "manifest.json"
+
+NAMES = ["Telecomunicações", "Réseau", "Señal", "Müller", "Kåre", "Société", "Niño",
+         "Ærø", "Grün", "Coração", "Net", "Data", "Transit", "Cloud", "Fibra"]
+WORDS = ["backbone", "customer", "peering", "transit", "hosting", "access", "mobile",
+         "regional", "network", "services", "university", "exchange"]
+COUNTRIES = ["NL", "DE", "FR", "BR", "AR", "ZA", "KE", "AU", "JP", "IN", "US", "CA"]
+
+RIPE_CRUFT = ["****************************",
+              "* THIS OBJECT IS MODIFIED",
+              "* Please note that all data that is generally regarded as personal",
+              "* data has been removed from this object.",
+              "* To view the original object, please query the RIPE Database at:",
+              "* http://www.ripe.net/whois",
+              "****************************"]
+
+
+def attr(key, value):
+    # RPSL pads keys to a column of 16
+    return "%-16s%s" % (key + ":", value)
+
+
+class RPSLGenerator(object):
+    '''
+    Generates the records of an RPSL style dump. Subclasses set the source,
+    the handle suffix and which object types appear how often.
+    '''
+
+    SOURCE = "RIPE"
+    SUFFIX = "RIPE"
+    # (type, relative frequency)
+    WEIGHTS = [("aut-num", 2), ("organisation", 2), ("person", 4), ("role", 1)]
+    # Whether personal data is replaced with dummy values, as in RIPE's split files
+    DUMMIFIED = False
+
+    def __init__(self, seed):
+        self.rng = random.Random("%s-%d" % (type(self).__name__, seed))
+        self.counts = dict((t, 0) for t, _ in self.WEIGHTS)
+
+    def header(self):
+        return ["# Synthetic %s database dump for benchmarking" % self.SOURCE,
+                "# It contains no real data", ""]
+
+    def name(self):
+        return "%s %s" % (self.rng.choice(NAMES), self.rng.choice(WORDS).title())
+
+    def date(self):
+        return "%04d-%02d-%02dT%02d:%02d:%02dZ" % (
+            self.rng.randint(1995, 2024), self.rng.randint(1, 12), self.rng.randint(1, 28),
+            self.rng.randint(0, 23), self.rng.randint(0, 59), self.rng.randint(0, 59))
+
+    def number(self, t):
+        # The number of an object of type t to refer to, which mostly exists
+        # already
+        return self.rng.randrange(self.counts.get(t, 0) + 10)
+
+    def ref(self, prefix, t):
+        return "%s%d-%s" % (prefix, self.number(t), self.SUFFIX)
+
+    def org_ref(self):
+        return "ORG-%s" % self.ref("X", "organisation")
+
+    def contact_ref(self):
+        if self.DUMMIFIED and self.rng.random() < 0.5:
+            return "DUMY-RIPE"
+        return self.ref("P", "person")
+
+    def address(self, key="address"):
+        lines = [attr(key, "%d %s Street" % (self.rng.randint(1, 999), self.rng.choice(NAMES)))]
+        for _ in range(self.rng.randint(0, 2)):
+            # continuation lines
+            lines.append(" " * 16 + self.rng.choice(NAMES) + " " + str(self.rng.randint(1000, 99999)))
+        if self.rng.random() < 0.2:
+            lines.append("+")
+            lines.append(" " * 16 + self.rng.choice(COUNTRIES))
+        return lines
+
+    def remarks(self):
+        lines = []
+        for _ in range(self.rng.randint(0, 3)):
+            lines.append(attr("remarks", " ".join(self.rng.choice(WORDS) for _ in range(6))))
+        if self.DUMMIFIED and self.rng.random() < 0.3:
+            lines.append(attr("remarks", RIPE_CRUFT[0]))
+            lines.extend(" " * 16 + l for l in RIPE_CRUFT[1:])
+        return lines
+
+    def common(self):
+        return [attr("mnt-by", "MNT-%d" % self.rng.randrange(1000)),
+                attr("created", self.date()),
+                attr("last-modified", self.date()),
+                attr("source", self.SOURCE)]
+
+    def aut_num(self, i):
+        lines = [attr("aut-num", "AS%d" % (i + 1)),
+                 attr("as-name", "%s-AS" % self.rng.choice(WORDS).upper()),
+                 attr("descr", self.name()),
+                 attr("org", self.org_ref())]
+        for _ in range(self.rng.randint(0, 6)):
+            peer = self.rng.randint(1, 400000)
+            lines.append(attr("import", "from AS%d accept ANY" % peer))
+            lines.append(attr("export", "to AS%d announce AS%d" % (peer, i + 1)))
+        lines.append(attr("admin-c", self.contact_ref()))
+        lines.append(attr("tech-c", self.contact_ref()))
+        if self.rng.random() < 0.3:
+            lines.append(attr("abuse-c", self.ref("AR", "role")))
+        lines.append(attr("status", "ASSIGNED"))
+        return lines + self.remarks() + self.common()
+
+    def organisation(self, i):
+        lines = [attr("organisation", "ORG-X%d-%s" % (i, self.SUFFIX)),
+                 attr("org-name", self.name()),
+                 attr("org-type", self.rng.choice(["LIR", "OTHER", "RIR"])),
+                 attr("country", self.rng.choice(COUNTRIES))]
+        lines += self.address()
+        lines.append(attr("e-mail", "noc@%s.example" % self.rng.choice(WORDS)))
+        lines.append(attr("admin-c", self.contact_ref()))
+        lines.append(attr("abuse-c", self.ref("AR", "role")))
+        lines.append(attr("mnt-ref", "MNT-%d" % self.rng.randrange(1000)))
+        return lines + self.remarks() + self.common()
+
+    def person(self, i):
+        if self.DUMMIFIED:
+            lines = [attr("person", "Name Removed"), attr("address", "DUMY-RIPE"),
+                     attr("phone", "+31205354444"), attr("nic-hdl", "P%d-%s" % (i, self.SUFFIX))]
+            return lines + self.remarks() + self.common()
+        lines = [attr("person", self.name())]
+        lines += self.address()
+        lines.append(attr("phone", "+%d %d" % (self.rng.randint(1, 99), self.rng.randint(10 ** 6, 10 ** 9))))
+        lines.append(attr("e-mail", "p%d@%s.example" % (i, self.rng.choice(WORDS))))
+        lines.append(attr("nic-hdl", "P%d-%s" % (i, self.SUFFIX)))
+        return lines + self.remarks() + self.common()
+
+    def role(self, i):
+        lines = [attr("role", "%s Abuse" % self.name())]
+        lines += self.address()
+        lines.append(attr("e-mail", "abuse@%s.example" % self.rng.choice(WORDS)))
+        lines.append(attr("abuse-mailbox", "abuse@%s.example" % self.rng.choice(WORDS)))
+        lines.append(attr("admin-c", self.contact_ref()))
+        lines.append(attr("tech-c", self.contact_ref()))
+        lines.append(attr("nic-hdl", "AR%d-%s" % (i, self.SUFFIX)))
+        return lines + self.remarks() + self.common()
+
+    def inetnum(self, i):
+        first = self.rng.randrange(1 << 24) << 8
+        lines = [attr("inetnum", "%d.%d.%d.0 - %d.%d.%d.255" % (
+                     first >> 24, first >> 16 & 255, first >> 8 & 255, first >> 24, first >> 16 & 255,
+                     first >> 8 & 255)),
+                 attr("netname", "NET-%d" % i),
+                 attr("country", self.rng.choice(COUNTRIES)),
+                 attr("org", self.org_ref()),
+                 attr("admin-c", self.contact_ref()),
+                 attr("status", "ASSIGNED PA")]
+        return lines + self.remarks() + self.common()
+
+    def domain(self, i):
+        return [attr("domain", "%d.%d.in-addr.arpa" % (i % 256, i // 256 % 256)),
+                attr("nserver", "ns1.%s.example" % self.rng.choice(WORDS)),
+                attr("nserver", "ns2.%s.example" % self.rng.choice(WORDS))] + self.common()
+
+    def mntner(self, i):
+        return [attr("mntner", "MNT-%d" % i),
+                attr("auth", "PGPKEY-%08X" % self.rng.randrange(1 << 32)),
+                attr("upd-to", "noc@%s.example" % self.rng.choice(WORDS))] + self.common()
+
+    def record(self, t):
+        i = self.counts[t]
+        self.counts[t] += 1
+        lines = getattr(self, t.replace("-", "_"))(i)
+        if self.rng.random() < 0.02:
+            lines.insert(1, "% comment inside an object")
+        return lines
+
+    def records(self):
+        '''
+        Generate (type, lines) forever.
+        '''
+        types = [t for t, _ in self.WEIGHTS]
+        weights = [w for _, w in self.WEIGHTS]
+        while True:
+            t = self.rng.choices(types, weights)[0]
+            yield t, self.record(t)
+            if self.rng.random() < 0.001:
+                yield None, ["% Query rate limit exceeded"]
+
+
+class RIPEGenerator(RPSLGenerator):
+    DUMMIFIED = True
+
+
+class APNICGenerator(RPSLGenerator):
+    SOURCE = "APNIC"
+    SUFFIX = "AP"
+
+
+class AFRINICGenerator(RPSLGenerator):
+    SOURCE = "AFRINIC"
+    SUFFIX = "AFRINIC"
+    WEIGHTS = RPSLGenerator.WEIGHTS + [("inetnum", 6), ("domain", 2), ("mntner", 1)]
+
+
+class LACNICGenerator(RPSLGenerator):
+    '''
+    LACNIC's dump has its own keys (owner, ownerid, ...), abbreviated
+    prefixes and values continued on lines without a key.
+    '''
+    SOURCE = "LACNIC"
+    SUFFIX = "LAC"
+    WEIGHTS = [("aut-num", 2), ("person", 4), ("inetnum", 6)]
+
+    def common(self):
+        return [attr("created", self.date()[:10].replace("-", "")),
+                attr("changed", self.date()[:10].replace("-", "")),
+                attr("source", self.SOURCE)]
+
+    def owner(self):
+        lines = [attr("owner", self.name()),
+                 attr("ownerid", "%s-%s-LACNIC" % (self.rng.choice(COUNTRIES), self.rng.randrange(10 ** 6))),
+                 attr("responsible", self.name())]
+        lines += self.address()
+        if self.rng.random() < 0.1:
+            # continued without a key, onto the previous value
+            lines.append(self.rng.choice(NAMES))
+        lines.append(attr("country", self.rng.choice(COUNTRIES)))
+        lines.append(attr("owner-c", self.contact_ref()))
+        lines.append(attr("tech-c", self.contact_ref()))
+        return lines
+
+    def aut_num(self, i):
+        return [attr("aut-num", "AS%d" % (i + 1))] + self.owner() + self.common()
+
+    def person(self, i):
+        return [attr("nic-hdl", "P%d-%s" % (i, self.SUFFIX)),
+                attr("person", self.name()),
+                attr("e-mail", "p%d@%s.example" % (i, self.rng.choice(WORDS)))] + \
+            self.address() + self.common()
+
+    def inetnum(self, i):
+        length = self.rng.choice([16, 19, 20, 22, 23, 24])
+        network = "%d.%d" % (self.rng.choice([177, 179, 181, 186, 187, 189, 200, 201]), self.rng.randrange(256))
+        if length > 16:
+            network += ".%d" % (self.rng.randrange(256) >> (24 - length) << (24 - length))
+        return [attr("inetnum", "%s/%d" % (network, length))] + self.owner() + self.common()
+
+
+class ARINGenerator(RPSLGenerator):
+    '''
+    ARIN's records: ASHandle, OrgID and POCHandle objects with ARIN's keys.
+    Some ASes are blocks (ASNumber "first - last") and some are marked as
+    belonging to another RIR.
+    '''
+    SOURCE = "ARIN"
+    SUFFIX = "ARIN"
+    WEIGHTS = [("aut-num", 3), ("organisation", 2), ("person", 4)]
+
+    def header(self):
+        return []
+
+    def aut_num(self, i):
+        number = 1000000 + 8 * i
+        if self.rng.random() < 0.05:
+            asnumber = "%d - %d" % (number, number + self.rng.randint(1, 7))
+        else:
+            asnumber = str(number)
+        lines = [attr("ASHandle", "AS%d" % number),
+                 attr("OrgID", "O-%d" % self.number("organisation")),
+                 attr("ASName", "%s-%d" % (self.rng.choice(WORDS).upper(), i)),
+                 attr("ASNumber", asnumber),
+                 attr("RegDate", self.date()[:10]),
+                 attr("Updated", self.date()[:10])]
+        if self.rng.random() < 0.03:
+            lines.append(attr("Comment", "This AS is under LACNIC responsibility"))
+        for _ in range(self.rng.randint(0, 3)):
+            lines.append(attr("Comment", " ".join(self.rng.choice(WORDS) for _ in range(8))))
+        for key in ("TechHandle", "AbuseHandle", "NOCHandle"):
+            if self.rng.random() < 0.7:
+                lines.append(attr(key, self.ref("P-", "person")))
+        lines.append(attr("Source", "ARIN"))
+        return lines
+
+    def organisation(self, i):
+        lines = [attr("OrgID", "O-%d" % i),
+                 attr("OrgName", self.name()),
+                 attr("CanAllocate", ""),
+                 attr("Street", "%d %s Street" % (self.rng.randint(1, 999), self.rng.choice(NAMES))),
+                 attr("City", self.rng.choice(NAMES)),
+                 attr("Country", self.rng.choice(COUNTRIES)),
+                 attr("RegDate", self.date()[:10])]
+        for key in ("OrgAdminHandle", "OrgTechHandle", "OrgAbuseHandle", "OrgNOCHandle"):
+            if self.rng.random() < 0.6:
+                lines.append(attr(key, self.ref("P-", "person")))
+        lines.append(attr("Source", "ARIN"))
+        return lines
+
+    def person(self, i):
+        first = self.rng.choice(NAMES)
+        return [attr("POCHandle", "P-%d-ARIN" % i),
+                attr("IsRole", self.rng.choice(["Y", "N"])),
+                attr("LastName", self.rng.choice(NAMES)),
+                attr("FirstName", first),
+                attr("Street", "%d %s Street" % (self.rng.randint(1, 999), self.rng.choice(NAMES))),
+                attr("Mailbox", "%s@%s.example" % (first.lower(), self.rng.choice(WORDS))),
+                attr("OfficePhone", "+1-%03d-555-%04d" % (self.rng.randrange(1000), self.rng.randrange(10000))),
+                attr("Source", "ARIN")]
+
+
+GENERATORS = {
+    "ripe": RIPEGenerator,
+    "apnic": APNICGenerator,
+    "afrinic": AFRINICGenerator,
+    "lacnic": LACNICGenerator,
+    "arin": ARINGenerator,
+}
+
+# The types that RIPE and APNIC publish in a split file of their own
+SPLIT_STYLES = {"ripe": "ripe.db.%s", "apnic": "apnic.db.%s"}
+
+# The archive and record name of each type in ARIN's per type downloads
+ARIN_RECORDS = {"aut-num": "asns", "organisation": "orgs", "person": "pocs"}
+
+
+def write_records(style, files, size, seed):
+    '''
+    Write records of style until size bytes are written, each to
+    files[type] (or files[None]), all of which are open binary files.
+    '''
+    gen = GENERATORS[style](seed)
+    header = "".join(l + "\n" for l in gen.header()).encode('latin-1')
+    for f in files.values():
+        f.write(header)
+    written = 0
+    for t, lines in gen.records():
+        data = ("\n".join(lines) + "\n" + "\n" * gen.rng.choice([1, 1, 1, 2])).encode('latin-1')
+        f = files.get(t, files.get(None))
+        if f is None:
+            continue
+        f.write(data)
+        written += len(data)
+        if written >= size:
+            break
+    return gen.counts
+
+
+def write_zip(path, member, paths):
+    # A fixed timestamp, so the archive is the same every time
+    info = zipfile.ZipInfo(member, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(path, "w") as z, z.open(info, "w") as out:
+        for p in paths:
+            with open(p, 'rb') as f:
+                shutil.copyfileobj(f, out)
+
+
+def generate(style, out_dir, size, seed=1):
+    '''
+    Write a synthetic dump of about size bytes (uncompressed) for an RIR in
+    its style to out_dir, in both the form it's published in (gzipped split
+    files, a single gzipped db, a plain db or zips) and uncompressed. Returns
+    the manifest: the published path for every name the RIR downloads (DB
+    for the single file ones), the uncompressed files and the object counts.
+    An existing dump for the same arguments is reused.
+    '''
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    params = {"style": style, "size": size, "seed": seed}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["params"] == params:
+            return manifest
+    os.makedirs(out_dir, exist_ok=True)
+
+    if style in SPLIT_STYLES:
+        types = [t for t, _ in GENERATORS[style].WEIGHTS]
+        plain = dict((t, os.path.join(out_dir, SPLIT_STYLES[style] % t)) for t in types)
+    elif style == "arin":
+        plain = dict((t, os.path.join(out_dir, "arin_db_%s.txt" % r)) for t, r in ARIN_RECORDS.items())
+    else:
+        plain = {None: os.path.join(out_dir, "%s.db" % style)}
+
+    files = dict((t, open(p, 'wb')) for t, p in plain.items())
+    try:
+        counts = write_records(style, files, size, seed)
+    finally:
+        for f in files.values():
+            f.close()
+
+    published = {}
+    if style == "arin":
+        for t, path in plain.items():
+            published[t] = os.path.join(out_dir, "%s.zip" % ARIN_RECORDS[t])
+            write_zip(published[t], "arin_db.txt", [path])
+        # and the combined archive, with every type in one file
+        published[DB] = os.path.join(out_dir, "bulkwhois.zip")
+        write_zip(published[DB], "arin_db_full.txt", [plain[t] for t in ARIN_RECORDS])
+    elif style == "lacnic":
+        # LACNIC's dump isn't compressed
+        published[DB] = plain[None]
+    else:
+        for t, path in plain.items():
+            published[t or DB] = path + ".gz"
+            with open(path, 'rb') as f, gzip.GzipFile(path + ".gz", "wb", compresslevel=6, mtime=0) as out:
+                shutil.copyfileobj(f, out)
+
+    manifest = {
+        "params": params,
+        "published": published,
+        "files": sorted(plain.values()),
+        "bytes": sum(os.path.getsize(p) for p in plain.values()),
+        "counts": counts,
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.generate")
+    parser.add_argument("out_dir", help="directory to write the dumps to, one subdirectory per style")
+    parser.add_argument("--styles", default=",".join(STYLES), help="comma separated (default: %(default)s)")
+    parser.add_argument("--size-mb", type=float, default=8, help="uncompressed size per style (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for style in args.styles.split(","):
+        manifest = generate(style, os.path.join(args.out_dir, style), int(args.size_mb * 1024 * 1024), args.seed)
+        print(style, manifest["bytes"], manifest["counts"])
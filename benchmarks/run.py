@@ -0,0 +1,317 @@
+'''
+Times each stage of the pipeline on synthetic dumps (see generate.py), fully
+offline, and writes the results as json so that runs can be compared.
+
+    python -m benchmarks.run [--rirs ripe,arin] [--size-mb 8] [--out results.json]
+    python -m benchmarks.run --compare old.json new.json
+
+Every stage of every RIR runs in a fresh process, so that its peak RSS is its
+own. Whatever a stage needs (e.g. the parsed entries, or the intermediate
+files for the join) is set up in that process before the clock starts.
+'''
+import argparse
+import concurrent.futures
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pybulkwhois.file import BulkWHOISFile
+from pybulkwhois.metrics import peak_rss
+from pybulkwhois.rirs.afrinic import AFRINIC
+from pybulkwhois.rirs.apnic import APNIC
+from pybulkwhois.rirs.arin import ARIN
+from pybulkwhois.rirs.lacnic import LACNIC
+from pybulkwhois.rirs.ripe import RIPE
+from pybulkwhois.serialize import Serializer
+
+from .generate import DB, STYLES, generate
+
+# The types makeases processes for each RIR
+TYPES = ['aut-num', 'organisation', 'person', 'role']
+ARIN_TYPES = ['aut-num', 'organisation', 'person']
+
+STAGES = ["iterate", "parse", "normalize", "standard", "intermediate", "join", "stream"]
+
+MB = 1024 * 1024
+
+
+class OfflineMixin(object):
+    '''
+    Serves an RIR's downloads from a generated dump instead of the network.
+    '''
+    published = {}
+
+    def download(self, name=None):
+        return self.published[name or DB]
+
+    def get_stream(self, name=None):
+        path = self.download(name)
+        if path.endswith(".zip"):
+            return super(OfflineMixin, self).get_stream(name)
+        if path.endswith(".gz"):
+            return gzip.open(path)
+        return open(path, 'rb')
+
+
+class OfflineRIPE(OfflineMixin, RIPE):
+    pass
+
+
+class OfflineAPNIC(OfflineMixin, APNIC):
+    pass
+
+
+class OfflineAFRINIC(OfflineMixin, AFRINIC):
+    pass
+
+
+class OfflineLACNIC(OfflineMixin, LACNIC):
+    pass
+
+
+class OfflineARIN(OfflineMixin, ARIN):
+    pass
+
+
+# Defined up front rather than made on the fly so that they can be pickled,
+# for parse_workers
+OFFLINE_CLASSES = {"ripe": OfflineRIPE, "apnic": OfflineAPNIC, "afrinic": OfflineAFRINIC,
+                   "lacnic": OfflineLACNIC, "arin": OfflineARIN}
+
+
+def offline_rir(style, manifest, options):
+    '''
+    An RIR object of style that reads the dump in manifest, with the RIR
+    option attributes in options (e.g. chunked, join_mode) set. The
+    serializer option holds the arguments of its Serializer, e.g.
+    {"backend": "json"}.
+    '''
+    rir = OFFLINE_CLASSES[style]()
+    rir.published = manifest["published"]
+    for k, v in options.items():
+        if k == "serializer":
+            v = Serializer(**v)
+        setattr(rir, k, v)
+    return rir
+
+
+def rir_types(style):
+    return ARIN_TYPES if style == "arin" else TYPES
+
+
+def read_entries(rir, manifest):
+    for path in manifest["files"]:
+        with open(path, 'rb') as f:
+            for entry in BulkWHOISFile(f, rir.IGNORED_KEYS, rir.IGNORED_VALUES,
+                                       chunked=rir.chunked, encoding=rir.FILE_ENCODING):
+                yield entry
+
+
+def intermediate_counts(rir, work, types):
+    '''
+    The number of records and bytes in the intermediate files of types.
+    '''
+    records = 0
+    size = 0
+    for t in types:
+        size += os.path.getsize(rir.intm_path(work, t))
+        records += sum(1 for _ in rir.read_intermediate(work, t))
+    return records, size
+
+
+def run_stage(stage, style, manifest, work, options):
+    '''
+    Set up and time one stage. Returns its result; meant to be run in a
+    process of its own.
+    '''
+    tempfile.tempdir = os.path.join(work, "tmp")
+    os.makedirs(tempfile.tempdir, exist_ok=True)
+    os.makedirs(os.path.join(work, "intm"), exist_ok=True)
+    rir = offline_rir(style, manifest, options)
+    types = rir_types(style)
+    size = manifest["bytes"]
+
+    if stage == "iterate":
+        start = time.perf_counter()
+        records = sum(1 for _ in read_entries(rir, manifest))
+        seconds = time.perf_counter() - start
+    elif stage == "parse":
+        entries = list(read_entries(rir, manifest))
+        start = time.perf_counter()
+        for entry in entries:
+            entry.labeled
+        seconds = time.perf_counter() - start
+        records = len(entries)
+    elif stage == "normalize":
+        wanted = rir.wanted_types(types)
+        labeled = [e.labeled for e in read_entries(rir, manifest) if e.type in wanted]
+        convert = rir.convert_to_standard_form
+        start = time.perf_counter()
+        for in_json in labeled:
+            convert(in_json)
+        seconds = time.perf_counter() - start
+        records = len(labeled)
+    elif stage == "standard":
+        # parse and normalize together, the way write_entries does it (so
+        # fused with --set fused_parse=true)
+        wanted = rir.wanted_types(types)
+        entries = [e for e in read_entries(rir, manifest) if e.type in wanted]
+        keys = rir.key_table() if rir.fused_parse else None
+        convert = rir.convert_to_standard_form
+        start = time.perf_counter()
+        for entry in entries:
+            if keys is not None:
+                entry.standard(keys)
+            else:
+                convert(entry.labeled)
+        seconds = time.perf_counter() - start
+        records = len(entries)
+    elif stage == "intermediate":
+        start = time.perf_counter()
+        rir.construct_intermediate_jsons(work, types)
+        seconds = time.perf_counter() - start
+        records, _ = intermediate_counts(rir, work, types)
+    elif stage == "join":
+        rir.construct_intermediate_jsons(work, types)
+        records, size = intermediate_counts(rir, work, types)
+        full_db = "full_db.json"
+        open(os.path.join(work, full_db), 'w').close()
+        start = time.perf_counter()
+        rir.add_to_full_db(work, full_db, types)
+        seconds = time.perf_counter() - start
+    elif stage == "stream":
+        # intermediate and join in one pass (RIR.stream_to_full_db), counting
+        # the ASes written
+        full_db = "full_db.json"
+        open(os.path.join(work, full_db), 'w').close()
+        start = time.perf_counter()
+        rir.stream_to_full_db(work, full_db, types)
+        seconds = time.perf_counter() - start
+        with open(os.path.join(work, full_db), 'rb') as f:
+            records = sum(1 for _ in f)
+    else:
+        raise Exception("unknown stage %s" % stage)
+
+    return {
+        "rir": style,
+        "stage": stage,
+        "seconds": seconds,
+        "records": records,
+        "bytes": size,
+        "records_per_sec": records / seconds if seconds else None,
+        "mb_per_sec": size / MB / seconds if seconds else None,
+        "peak_rss_mb": peak_rss() / MB,
+    }
+
+
+def run_isolated(stage, style, manifest, work, options):
+    # A fresh interpreter (spawn, not fork) doesn't inherit the peak RSS of
+    # the parent
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_stage, stage, style, manifest, work, options).result()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(styles, stages, size, seed, data_dir, options, repeat=1):
+    '''
+    Benchmark stages for each of styles on dumps of size bytes. Each stage is
+    run repeat times and the fastest run kept. Returns the report.
+    '''
+    results = []
+    for style in styles:
+        manifest = generate(style, os.path.join(data_dir, style), size, seed)
+        for stage in stages:
+            best = None
+            for _ in range(repeat):
+                work = tempfile.mkdtemp(prefix="pybulkwhois-bench-")
+                try:
+                    result = run_isolated(stage, style, manifest, work, options)
+                finally:
+                    shutil.rmtree(work, ignore_errors=True)
+                if best is None or result["seconds"] < best["seconds"]:
+                    best = result
+            print("%-8s %-13s %8.3fs %10.0f records/s %8.2f MB/s %8.1f MB peak" % (
+                style, stage, best["seconds"], best["records_per_sec"] or 0, best["mb_per_sec"] or 0,
+                best["peak_rss_mb"]), file=sys.stderr)
+            results.append(best)
+    return {
+        "meta": {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "size": size,
+            "seed": seed,
+            "repeat": repeat,
+            "options": options,
+        },
+        "results": results,
+    }
+
+
+def compare(old, new):
+    '''
+    Print the change in throughput of every stage between two reports.
+    '''
+    before = dict(((r["rir"], r["stage"]), r) for r in old["results"])
+    for r in new["results"]:
+        o = before.get((r["rir"], r["stage"]))
+        if o is None or not o["records_per_sec"] or not r["records_per_sec"]:
+            continue
+        print("%-8s %-13s %10.0f -> %10.0f records/s (%+.1f%%)  %8.1f -> %8.1f MB peak" % (
+            r["rir"], r["stage"], o["records_per_sec"], r["records_per_sec"],
+            100 * (r["records_per_sec"] / o["records_per_sec"] - 1), o["peak_rss_mb"], r["peak_rss_mb"]))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--rirs", default=",".join(STYLES), help="comma separated (default: %(default)s)")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated (default: %(default)s)")
+    parser.add_argument("--size-mb", type=float, default=8,
+                        help="uncompressed size of each RIR's dump (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is kept")
+    parser.add_argument("--data", default=os.path.join(tempfile.gettempdir(), "pybulkwhois-bench-data"),
+                        help="where the generated dumps are kept between runs (default: %(default)s)")
+    parser.add_argument("--out", help="write the json report here (default: stdout)")
+    parser.add_argument("--set", action="append", default=[], metavar="ATTR=JSON",
+                        help="set an RIR option for the run, e.g. --set chunked=true --set join_mode='\"sqlite\"'")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two reports instead of running")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        sys.exit()
+    options = {}
+    for s in args.set:
+        k, v = s.split("=", 1)
+        options[k] = json.loads(v)
+    report = run(args.rirs.split(","), args.stages.split(","), int(args.size_mb * MB), args.seed, args.data,
+                 options, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
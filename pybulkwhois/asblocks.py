@@ -0,0 +1,128 @@
+import bisect
+import heapq
+
+# Blocks bigger than this probably aren't real blocks of ASes, and are never
+# expanded
+MAX_BLOCK_SIZE = 10000
+
+
+def block_range(obj):
+    '''
+    Return the (first, last) AS numbers of the block an AS object represents,
+    or None if it isn't one that gets expanded.
+    '''
+    if 'asblock' not in obj:
+        return None
+    parts = obj['asblock'].split('-')
+    if len(parts) != 2:
+        return None
+    first, last = int(parts[0]), int(parts[1])
+    if last - first + 1 > MAX_BLOCK_SIZE:
+        return None
+    return first, last
+
+
+def disjoint_intervals(intervals):
+    '''
+    Split possibly overlapping (first, last, owner) intervals, given in order
+    of precedence, into sorted, disjoint ones: returns the lists of their
+    starts, ends and owners, where each point is owned by the first interval
+    that covers it. Adjacent pieces with the same owner are merged.
+    '''
+    intervals = [i for i in intervals if i[0] <= i[1]]
+    starts = []
+    ends = []
+    owners = []
+
+    # Sweep over the points where some interval starts or ends, keeping the
+    # intervals that cover the current point in a heap by precedence
+    points = sorted(set([i[0] for i in intervals] + [i[1] + 1 for i in intervals]))
+    by_start = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+    covering = []
+    j = 0
+    for start, end in zip(points, points[1:]):
+        while j < len(by_start) and intervals[by_start[j]][0] <= start:
+            heapq.heappush(covering, by_start[j])
+            j += 1
+        while covering and intervals[covering[0]][1] < start:
+            heapq.heappop(covering)
+        if not covering:
+            continue
+        owner = intervals[covering[0]][2]
+        if owners and owners[-1] == owner and ends[-1] == start - 1:
+            ends[-1] = end - 1
+        else:
+            starts.append(start)
+            ends.append(end - 1)
+            owners.append(owner)
+    return starts, ends, owners
+
+
+class ASBlockIndex(object):
+    '''
+    Sorted, disjoint AS number intervals, each pointing at the asn of the block
+    object that covers it. Where blocks overlap, the one listed first wins, as
+    it does when the blocks are expanded one after another. Takes O(blocks)
+    memory however many ASes the blocks cover; get() is a binary search.
+    '''
+
+    def __init__(self, blocks):
+        '''
+        blocks is a list of (first, last, asn), in order of precedence.
+        '''
+        self.blocks = [b for b in blocks if b[0] <= b[1]]
+        self.starts, self.ends, self.owners = disjoint_intervals(self.blocks)
+
+    @classmethod
+    def from_asn_objs(cls, asn_objs):
+        '''
+        Index the blocks among a map from asns to their objects.
+        '''
+        blocks = []
+        for asn, obj in asn_objs.items():
+            r = block_range(obj)
+            if r is not None:
+                blocks.append((r[0], r[1], asn))
+        return cls(blocks)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get(self, number):
+        '''
+        Return the asn of the block covering AS number number, or None.
+        '''
+        i = bisect.bisect_right(self.starts, number) - 1
+        if i >= 0 and number <= self.ends[i]:
+            return self.owners[i]
+        return None
+
+    def lookup(self, asn_objs, asn):
+        '''
+        Return the object for asn ("AS123"): its own if it has one, otherwise
+        the (shared, uncopied) object of the block it falls in, or None.
+        '''
+        if asn in asn_objs:
+            return asn_objs[asn]
+        try:
+            owner = self.get(int(asn[2:]))
+        except ValueError:
+            return None
+        if owner is None:
+            return None
+        return asn_objs[owner]
+
+    def expand(self, asn_objs):
+        '''
+        Generate the copies of the block objects for every asn they cover that
+        doesn't have an object of its own, block by block. Only one copy
+        exists at a time.
+        '''
+        for first, last, asn in self.blocks:
+            obj = asn_objs[asn]
+            for i in range(first, last + 1):
+                new_asn = "AS" + str(i)
+                if new_asn not in asn_objs and self.get(i) == asn:
+                    copy = obj.copy()
+                    copy["asn"] = new_asn
+                    yield copy
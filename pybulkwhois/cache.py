@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+
+
+class DownloadCache(object):
+    '''
+    Keeps the last download of every RIR file in folder, along with the
+    validators it was served with (ETag / Last-Modified) and the sha256 of its
+    content. The validators are sent back as a conditional request so unchanged
+    files aren't downloaded again, and the hash (along with the settings it
+    was written with) tells us whether the intermediate file built from a
+    file is still current.
+
+    Everything about a file lives in its own <key>.meta.json, so RIRs running in
+    different processes never write to the same metadata file.
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def key(self, rir_name, name):
+        '''
+        Return the cache key for a file of an RIR. name is the type, or None
+        for the RIRs that publish a single file.
+        '''
+        return "%s_%s" % (rir_name, name or "all")
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def partial_path(self, key):
+        '''
+        Where a new download for key should be written before it's stored.
+        '''
+        return self.path(key) + ".download"
+
+    def _meta_path(self, key):
+        return self.path(key) + ".meta.json"
+
+    def meta(self, key):
+        try:
+            with open(self._meta_path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, key, meta):
+        tmp_path = self._meta_path(key) + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(key))
+
+    def conditional_headers(self, key):
+        '''
+        Headers to send so that the server only returns the file if it changed
+        since we last stored it.
+        '''
+        headers = {}
+        if not os.path.exists(self.path(key)):
+            return headers
+        meta = self.meta(key)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last-modified"):
+            headers["If-Modified-Since"] = meta["last-modified"]
+        return headers
+
+    def store(self, key, downloaded, headers):
+        '''
+        Move a completed download into the cache and remember its validators
+        and hash. Returns the cached path.
+        '''
+        sha = hashlib.sha256()
+        with open(downloaded, 'rb') as f:
+            while True:
+                buf = f.read(1024 * 1024)
+                if not buf:
+                    break
+                sha.update(buf)
+        os.replace(downloaded, self.path(key))
+        meta = self.meta(key)
+        meta["etag"] = headers.get("ETag")
+        meta["last-modified"] = headers.get("Last-Modified")
+        meta["sha256"] = sha.hexdigest()
+        self._save_meta(key, meta)
+        logging.debug("stored %s in download cache (sha256 %s)", key, meta["sha256"])
+        return self.path(key)
+
+    def is_parsed(self, key, out_path, settings=None, sidecars=()):
+        '''
+        True if out_path (and each of its sidecars, the files next to it
+        named out_path + suffix) exists and was built with settings from the
+        file currently cached for key.
+        '''
+        meta = self.meta(key)
+        if "sha256" not in meta:
+            return False
+        if not all(os.path.exists(out_path + suffix) for suffix in ("",) + tuple(sidecars)):
+            return False
+        return meta.get("parsed", {}).get(out_path) == {"sha256": meta["sha256"], "settings": settings}
+
+    def mark_parsed(self, key, out_path, settings=None):
+        '''
+        Record that out_path was built with settings from the file currently
+        cached for key.
+        '''
+        meta = self.meta(key)
+        if "sha256" not in meta:
+            return
+        meta.setdefault("parsed", {})[out_path] = {"sha256": meta["sha256"], "settings": settings}
+        self._save_meta(key, meta)
@@ -0,0 +1,232 @@
+import argparse
+import array
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from .asblocks import ASBlockIndex, block_range
+
+ENCODING = 'utf-8'
+
+# Header of an index file: magic, then the byte order the arrays were written
+# in, the size of the db file it was built from and the length of each section
+INDEX_MAGIC = b"PBWX\x01" + (b"l" if sys.byteorder == "little" else b"b")
+INDEX_HEADER = struct.Struct("=6s2xQQQQQ")
+
+
+def index_path(full_db_path):
+    return full_db_path + ".idx"
+
+
+def asn_number(asn):
+    '''
+    The AS number of an asn like "AS123" (or 123), or None if it hasn't got one
+    that fits in 32 bits.
+    '''
+    if isinstance(asn, int):
+        number = asn
+    else:
+        if asn[:2].upper() == "AS":
+            asn = asn[2:]
+        try:
+            number = int(asn)
+        except ValueError:
+            return None
+    if 0 <= number < 1 << 32:
+        return number
+    return None
+
+
+def _write_array(out, a):
+    a.tofile(out)
+    # keep every section 8 byte aligned
+    pad = -(len(a) * a.itemsize) % 8
+    out.write(b"\0" * pad)
+
+
+def build_index(full_db_path, out_path=None):
+    '''
+    Write the index of a full db file next to it (<full_db>.idx): the sorted
+    AS numbers with the byte offsets of their records, the sorted handles
+    with the offsets of every record they're attached to, and the intervals
+    of the AS blocks with the offsets of the block records, for dbs written
+    with compact blocks. Returns the path of the index.
+    '''
+    out_path = out_path or index_path(full_db_path)
+    asns = []
+    handles = []
+    blocks = []
+    offset = 0
+    with open(full_db_path, 'rb') as f:
+        for l in f:
+            record = json.loads(l)
+            number = asn_number(record.get('asn', ''))
+            if number is not None:
+                asns.append((number, offset))
+            for handle in record.get('handles', {}):
+                handles.append((handle.encode(ENCODING), offset))
+            r = block_range(record)
+            if r is not None:
+                blocks.append((r[0], r[1], offset))
+            offset += len(l)
+    size = offset
+    asns.sort()
+    handles.sort()
+    blocks = ASBlockIndex(blocks)
+
+    key_ends = array.array('Q')
+    blob = bytearray()
+    for handle, _ in handles:
+        blob += handle
+        key_ends.append(len(blob))
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as out:
+        out.write(INDEX_HEADER.pack(INDEX_MAGIC, size, len(asns), len(handles), len(blocks), len(blob)))
+        _write_array(out, array.array('I', [a for a, _ in asns]))
+        _write_array(out, array.array('Q', [o for _, o in asns]))
+        _write_array(out, key_ends)
+        _write_array(out, array.array('Q', [o for _, o in handles]))
+        _write_array(out, array.array('I', blocks.starts))
+        _write_array(out, array.array('I', blocks.ends))
+        _write_array(out, array.array('Q', blocks.owners))
+        out.write(blob)
+    os.replace(tmp_path, out_path)
+    logging.debug("Indexed %d asns, %d handles and %d block intervals of %s.",
+                  len(asns), len(handles), len(blocks), full_db_path)
+    return out_path
+
+
+class DBReader(object):
+    '''
+    Looks records up in a full db file through its index, with both files
+    memory mapped: opening one costs next to nothing however big the db is,
+    the pages are shared with every other process reading the same files,
+    and a lookup is a binary search that decodes just the matching record.
+    '''
+
+    def __init__(self, full_db_path, idx_path=None):
+        self.path = full_db_path
+        self.index_path = idx_path or index_path(full_db_path)
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.db = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        with open(self.index_path, 'rb') as f:
+            self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, built_size, n_asns, n_handles, n_blocks, blob_len = INDEX_HEADER.unpack_from(self.idx)
+        if magic != INDEX_MAGIC:
+            raise Exception("%s isn't an index for this machine" % self.index_path)
+        if built_size != size:
+            raise Exception("%s is out of date, rebuild it" % self.index_path)
+
+        view = self._view = memoryview(self.idx)
+        pos = INDEX_HEADER.size
+
+        def section(fmt, n):
+            nonlocal pos
+            itemsize = struct.calcsize(fmt)
+            a = view[pos:pos + n * itemsize].cast(fmt)
+            pos += n * itemsize + (-(n * itemsize) % 8)
+            return a
+
+        self.asns = section('I', n_asns)
+        self.asn_offsets = section('Q', n_asns)
+        self.key_ends = section('Q', n_handles)
+        self.handle_offsets = section('Q', n_handles)
+        self.block_starts = section('I', n_blocks)
+        self.block_ends = section('I', n_blocks)
+        self.block_offsets = section('Q', n_blocks)
+        self.blob = view[pos:pos + blob_len]
+
+    def __len__(self):
+        return len(self.asns)
+
+    def read_at(self, offset):
+        '''
+        Decode the record whose line starts at offset.
+        '''
+        end = self.db.find(b"\n", offset)
+        if end == -1:
+            end = len(self.db)
+        return json.loads(self.db[offset:end])
+
+    def asn_offsets_of(self, asn):
+        number = asn_number(asn)
+        if number is None:
+            return []
+        lo = bisect.bisect_left(self.asns, number)
+        hi = bisect.bisect_right(self.asns, number, lo)
+        return [self.asn_offsets[i] for i in range(lo, hi)]
+
+    def get_all(self, asn):
+        '''
+        Return every record for asn (e.g. when more than one RIR has it).
+        '''
+        return [self.read_at(o) for o in self.asn_offsets_of(asn)]
+
+    def get(self, asn):
+        '''
+        Return the first record for asn ("AS123" or 123), the record of the
+        block it's in if it has none of its own, or None.
+        '''
+        offsets = self.asn_offsets_of(asn)
+        if offsets:
+            return self.read_at(offsets[0])
+        number = asn_number(asn)
+        if number is None:
+            return None
+        i = bisect.bisect_right(self.block_starts, number) - 1
+        if i >= 0 and number <= self.block_ends[i]:
+            record = self.read_at(self.block_offsets[i])
+            record['asn'] = "AS" + str(number)
+            return record
+        return None
+
+    def _key(self, i):
+        return bytes(self.blob[self.key_ends[i - 1] if i else 0:self.key_ends[i]])
+
+    def _handle_bound(self, key, right):
+        lo, hi = 0, len(self.key_ends)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._key(mid)
+            if k < key or (right and k == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def by_handle(self, handle):
+        '''
+        Return the records of every AS that has handle among its handles.
+        '''
+        key = handle.encode(ENCODING)
+        lo = self._handle_bound(key, False)
+        hi = self._handle_bound(key, True)
+        return [self.read_at(self.handle_offsets[i]) for i in range(lo, hi)]
+
+    def close(self):
+        for a in (self.asns, self.asn_offsets, self.key_ends, self.handle_offsets,
+                  self.block_starts, self.block_ends, self.block_offsets, self.blob, self._view):
+            a.release()
+        self.idx.close()
+        if isinstance(self.db, mmap.mmap):
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m pybulkwhois.dbindex")
+    parser.add_argument("full_db", help="full db file to index")
+    args = parser.parse_args()
+    print(build_index(args.full_db))
@@ -1,71 +1,220 @@
-import copy
-import json
+import functools
+import re
 import sys
 # from future.utils import iteritems
 
-class BulkWHOISEntry(object):
+class CruftFilter(object):
+    """The ignored keys and values of an RIR, compiled once so that every
+    entry doesn't have to loop over them again."""
 
-    def __init__(self, lines, ignored_keys, ignored_values):
-        self._type = None
-        self.ignored_keys   = ignored_keys
-        self.ignored_values = ignored_values
-        self._type, self.labeled = self._make_labeled(lines)
-
-    def _remove_cruft(self, retv):
-        """RIPE likes to add verbose comments as well dummy values. This strips
-        an ASN record of these superfluous values. Additionally, removes any values with keys
-        that we don't care about."""
-
-        # python doesn't let you modify a dict you're iterating over
-        for k, v in copy.copy(retv).items():
-            if k in self.ignored_keys or v in self.ignored_values:
-                del retv[k]
-            # if one of the ignored values is inside the actual value (happens a lot for remarks),
-            # splice out only the part we want to ignore
-            else:
-                for iv in self.ignored_values:
-                    if iv in v:
-                        iv_start = v.index(iv)
-                        spliced = v[0:iv_start] + v[iv_start + len(iv):]
-                        retv[k] = spliced.strip()
+    def __init__(self, ignored_keys, ignored_values):
+        self.ignored_keys   = frozenset(ignored_keys)
+        self.ignored_values = list(ignored_values)
+        self._exact_values  = frozenset(ignored_values)
+        self._matcher = None
+        if ignored_values:
+            self._matcher = re.compile("|".join(re.escape(iv) for iv in ignored_values))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get(ignored_keys, ignored_values):
+        """Returns the (shared) filter for a tuple of keys and values."""
+        return CruftFilter(ignored_keys, ignored_values)
+
+    def clean(self, v):
+        """RIPE likes to add verbose comments as well dummy values. Returns v with
+        these superfluous values stripped out, or None if the whole value should
+        be dropped."""
+        if v in self._exact_values:
+            return None
+        # Almost nothing matches, so only fall back to the loop below when the
+        # compiled matcher finds something
+        if self._matcher is None or self._matcher.search(v) is None:
+            return v
+        # if one of the ignored values is inside the actual value (happens a lot for remarks),
+        # splice out only the part we want to ignore. Each splice starts from the
+        # original value, so the last ignored value found wins.
+        retv = v
+        for iv in self.ignored_values:
+            if iv in v:
+                iv_start = v.index(iv)
+                spliced = v[0:iv_start] + v[iv_start + len(iv):]
+                retv = spliced.strip()
         return retv
 
-    def _make_labeled(self, lines):
+
+class KeyTable(object):
+    """An RIR's translation of its keys into the standard ones, compiled once:
+    the same rules as RIR.convert_to_standard_form (drop the ignored keys,
+    map through the key map or else lowercase, then fix up some values), but
+    worked out the first time each key is seen and then just looked up."""
+
+    def __init__(self, ignored_keys, key_map, fixups):
+        self.ignored_keys = frozenset(ignored_keys)
+        self.key_map = dict(key_map)
+        self.fixups = dict(fixups)
+        # key -> (standard key, value fixup or None), or None if ignored
+        self._keys = {}
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get(ignored_keys, key_map, fixups):
+        """Returns the (shared) table for tuples of ignored keys and of the
+        items of the key map and fixups."""
+        return KeyTable(ignored_keys, key_map, fixups)
+
+    def lookup(self, k):
+        """Returns (standard key, fixup) for k, or None if k is ignored. The
+        standard keys are interned, so every record shares the same strings."""
+        try:
+            return self._keys[k]
+        except KeyError:
+            pass
+        if k in self.ignored_keys:
+            translated = None
+        else:
+            new_k = sys.intern(self.key_map.get(k, k.lower()))
+            translated = (new_k, self.fixups.get(new_k))
+        self._keys[k] = translated
+        return translated
+
+
+class BulkWHOISEntry(object):
+
+    # There can be millions of these in flight at once, so keep them small
+    __slots__ = ("_type", "_lines", "_labeled", "_cruft")
+
+    def __init__(self, lines, ignored_keys, ignored_values, cruft=None):
+        # cruft is the compiled filter for ignored_keys/ignored_values. Callers
+        # creating lots of entries (e.g. BulkWHOISFile) should pass it in.
+        if cruft is None:
+            cruft = CruftFilter.get(tuple(ignored_keys), tuple(ignored_values))
+        self._cruft = cruft
+        # Only the type is read up front. Most records get thrown away by type,
+        # so the full dict is only built when someone asks for it.
+        self._type = self._read_type(lines)
+        self._lines = lines
+        self._labeled = None
+
+    @property
+    def ignored_keys(self):
+        return self._cruft.ignored_keys
+
+    @property
+    def ignored_values(self):
+        return self._cruft.ignored_values
+
+    @staticmethod
+    def _read_type(lines):
+        """The type of an object is the key of its first attribute. Matches
+        the top_type that _make_labeled finds, without parsing the rest."""
+        for l in lines:
+            if l[0] == " " or l[0] == "+":
+                continue
+            if l.find(":", 0) != -1:
+                type_ = l.split(":", 1)[0].strip()
+                if type_:
+                    return type_
+        return None
+
+    def _make_labeled(self, lines, keys=None):
         """Takes an ordered set of raw lines that describe a single entity and
-        parse them into a sane dict that represents the object"""
-        retv = {}
+        parse them into a sane dict that represents the object. Values that
+        span several lines are collected as fragments and joined once at the
+        end. Ignored keys are dropped as they are seen, ignored values once the
+        full value is known. With keys (a KeyTable), the dict is built in
+        standard form instead."""
+        parts = {}
+        ignored_keys = self._cruft.ignored_keys
         top_type = None
-        def append(t, v):
-            if t in retv:
-                retv[t] = "\n".join([retv[t], v])
-            else:
-                retv[t] = v
         last_type = None
         last_value = None
         for l in lines:
             if l[0] == " ":
-                append(last_type, l.strip())
+                if last_type not in ignored_keys:
+                    v = l.strip()
+                    if last_type in parts:
+                        parts[last_type].append(v)
+                    else:
+                        parts[last_type] = [v]
             # It looks like RIPE uses a '+' to indicate a newline within a
             # record since actual empty newlines delimit records themselves
             elif l[0] == "+":
-                append(last_type, "\n")
+                if last_type not in ignored_keys:
+                    if last_type in parts:
+                        parts[last_type].append("\n")
+                    else:
+                        parts[last_type] = ["\n"]
             else:
                 if (l.find(":", 0)) == -1:
                     value = last_value + " " + l.strip()
-                    del(retv[last_type])
-                    append(last_type, value)
+                    if last_type not in ignored_keys:
+                        # replaces everything collected for the key so far, and
+                        # moves it to the end
+                        del(parts[last_type])
+                        parts[last_type] = [value]
                 else:
-                    type_, value = map(lambda x: x.strip(), l.split(":", 1))
-                    append(type_, value)
+                    type_, value = l.split(":", 1)
+                    type_ = type_.strip()
+                    value = value.strip()
+                    if type_ not in ignored_keys:
+                        if type_ in parts:
+                            parts[type_].append(value)
+                        else:
+                            parts[type_] = [value]
                     last_type = type_
                     last_value = value
                     if not top_type:
                         top_type = type_
 
-        self._remove_cruft(retv)
+        retv = {}
+        clean = self._cruft.clean
+        if keys is None:
+            for k, fragments in parts.items():
+                v = clean(fragments[0] if len(fragments) == 1 else "\n".join(fragments))
+                if v is not None:
+                    retv[k] = v
+            return top_type, retv
+        # Keys are translated in the same order the labeled dict would have
+        # been walked, so where several map to one standard key the last
+        # value wins at the position of the first, as it does there.
+        lookup = keys.lookup
+        for k, fragments in parts.items():
+            translated = lookup(k)
+            if translated is None:
+                continue
+            v = clean(fragments[0] if len(fragments) == 1 else "\n".join(fragments))
+            if v is not None:
+                new_k, fixup = translated
+                retv[new_k] = v if fixup is None else fixup(v)
         return top_type, retv
 
     @property
     def type(self):
         return self._type
 
+    @property
+    def labeled(self):
+        if self._labeled is None:
+            _, self._labeled = self._make_labeled(self._lines)
+            self._lines = None
+        return self._labeled
+
+    def standard(self, keys):
+        """The entry in standard form, parsed straight from its lines with an
+        RIR's KeyTable rather than by building labeled and converting it."""
+        if self._labeled is not None:
+            # Already parsed, e.g. by someone looking at labeled
+            return self._standard_from(self._labeled, keys)
+        _, retv = self._make_labeled(self._lines, keys)
+        return retv
+
+    @staticmethod
+    def _standard_from(labeled, keys):
+        retv = {}
+        for k, v in labeled.items():
+            translated = keys.lookup(k)
+            if translated is not None:
+                new_k, fixup = translated
+                retv[new_k] = v if fixup is None else fixup(v)
+        return retv
@@ -0,0 +1,32 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlsplit
+
+
+async def fetch_concurrently(rir, names, per_host=4, on_done=None):
+    '''
+    Download (rir.download) every file in names at once from an asyncio event
+    loop, with at most per_host downloads running against any one host. The
+    blocking downloads run in threads on the rir's transport, so they share its
+    connection pools and bandwidth cap. on_done(name) is called, in its own
+    thread, as soon as each file is on disk; calls to it don't overlap, so
+    one file can be parsed while the rest keep downloading. The rir must
+    have a remote_url(name) (see FTPRIR, ARIN and LACNIC).
+    '''
+    semaphores = {}
+    parse_lock = asyncio.Lock()
+    start = time.time()
+
+    async def fetch_one(name):
+        host = urlsplit(rir.remote_url(name)).netloc
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(per_host)
+        async with semaphores[host]:
+            await asyncio.to_thread(rir.download, name)
+        logging.debug("%s %s downloaded after %.2fs", rir.NAME, name, time.time() - start)
+        if on_done is not None:
+            async with parse_lock:
+                await asyncio.to_thread(on_done, name)
+
+    await asyncio.gather(*(fetch_one(name) for name in names))
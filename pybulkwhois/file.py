@@ -1,26 +1,125 @@
-from .entry import BulkWHOISEntry
+import re
+
+from .entry import BulkWHOISEntry, CruftFilter
+
+# How much of the file the chunked scanner reads at a time
+BUFFER_SIZE = 16 * 1024 * 1024
+
+# Comments and rate limit notices, which can be dropped from a chunk in one go
+SKIPPED_LINES = re.compile(rb"^(?:#|%|Query rate limit)[^\n]*\n?", re.M)
+
+
+def scan_records(f, encoding='latin-1', buffer_size=BUFFER_SIZE, limit=None):
+    '''
+    Split a binary file into records without looking at it line by line.
+    Reads large buffers, cuts them at the last blank line, strips comment lines
+    out of the whole chunk at once and decodes it once. Yields the list of
+    non-empty lines of each record, the same lines that the line based scanner
+    collects (minus their trailing newlines, which the entry parser ignores).
+    If limit is given, stops after reading that many bytes from the current
+    position.
+    '''
+    rest = b""
+    while limit is None or limit > 0:
+        if limit is None:
+            buf = f.read(buffer_size)
+        else:
+            buf = f.read(min(buffer_size, limit))
+            limit -= len(buf)
+        if not buf:
+            break
+        if rest:
+            buf = rest + buf
+        end = buf.rfind(b"\n\n")
+        if end == -1:
+            rest = buf
+            continue
+        end += 2
+        rest = buf[end:]
+        chunk = SKIPPED_LINES.sub(b"", buf[:end])
+        for record in chunk.decode(encoding, errors='replace').split("\n\n"):
+            lines = [l for l in record.split("\n") if l.strip()]
+            if lines:
+                yield lines
+    # Like the line based scanner, anything after the last blank line isn't
+    # treated as a complete record.
+
+
+def record_ranges(f, range_size):
+    '''
+    Split a binary file into (start, end) byte ranges of roughly range_size
+    bytes. Every range ends just after a blank line, so each one holds whole
+    records and scanning the ranges one after another gives exactly the
+    records of scanning the whole file.
+    '''
+    f.seek(0, 2)
+    size = f.tell()
+    ranges = []
+    start = 0
+    while start < size:
+        end = _next_boundary(f, start + range_size, size)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _next_boundary(f, pos, size):
+    # Offset just after the first blank line at or after pos, or the end of
+    # the file if there isn't one.
+    if pos >= size:
+        return size
+    f.seek(pos)
+    prev = b""
+    while True:
+        buf = f.read(1024 * 1024)
+        if not buf:
+            return size
+        i = (prev + buf).find(b"\n\n")
+        if i != -1:
+            return pos - len(prev) + i + 2
+        pos += len(buf)
+        prev = buf[-1:]
+
 
 class BulkWHOISFile(object):
-    def __init__(self, path, ignored_keys=[], ignored_values=[]):
+    def __init__(self, path, ignored_keys=[], ignored_values=[], chunked=False, encoding='latin-1'):
         self.f = path
         self.ignored_keys   = ignored_keys
         self.ignored_values = ignored_values
+        # Compiled once and shared by every entry (and every file of the RIR)
+        self.cruft = CruftFilter.get(tuple(ignored_keys), tuple(ignored_values))
+        # chunked selects scan_records over the line based scanner. It needs a
+        # file opened in binary mode.
+        self.chunked  = chunked
+        self.encoding = encoding
 
     def __iter__(self):
+        # Streamed files (e.g. straight off of an HTTP response) can only be
+        # read once
+        if self.f.seekable():
+            self.f.seek(0)
+        if self.chunked:
+            return self.iter_chunked()
+        return self.iter_lines()
+
+    def iter_lines(self):
         lines = []
-        self.f.seek(0)
         for l in self.f:
             # For Lacnic and Apnic Latin American data bases, letters do not fit w/in utf-8 encoding
             if type(l) != str:
-                l = l.decode('latin-1')
+                l = l.decode(self.encoding)
             if l.startswith("#") or l.startswith("%") or l.startswith("Query rate limit"):
                 continue
             if l == "\n" and lines:
-                yield BulkWHOISEntry(lines, self.ignored_keys, self.ignored_values)
+                yield BulkWHOISEntry(lines, self.ignored_keys, self.ignored_values, self.cruft)
                 lines = []
             if l.strip():
                 lines.append(l)
 
+    def iter_chunked(self):
+        for lines in scan_records(self.f, self.encoding):
+            yield BulkWHOISEntry(lines, self.ignored_keys, self.ignored_values, self.cruft)
+
     def iter_filtered(self, etype):
         for entry in self:
             if entry.type == etype:
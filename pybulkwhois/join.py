@@ -0,0 +1,396 @@
+import logging
+import os
+import sqlite3
+
+from .asblocks import MAX_BLOCK_SIZE, ASBlockIndex
+from .serialize import default_serializer
+from .store import PRIMARY_KEYS
+
+ENCODING = 'utf-8'
+
+# Staging tables of the on-disk join. asns keeps the ASes in the order they
+# were first seen (seq), like the keys of the in-memory dict: a later record
+# for the same asn replaces obj in place, and a row copied out of an as-block
+# has no obj of its own, just the seq of the block it came from (src).
+# asn_handles remembers the order each handle was first attached to an asn,
+# contacts the last object attached for each handle.
+SCHEMA = '''
+CREATE TABLE asns (seq INTEGER PRIMARY KEY, asn TEXT UNIQUE NOT NULL, obj TEXT,
+                   asblock TEXT, src INTEGER);
+CREATE TABLE refs (handle TEXT NOT NULL, asn TEXT NOT NULL,
+                   PRIMARY KEY (handle, asn)) WITHOUT ROWID;
+CREATE TABLE asn_handles (seq INTEGER PRIMARY KEY, asn TEXT NOT NULL, handle TEXT NOT NULL,
+                          UNIQUE (asn, handle));
+CREATE TABLE contacts (handle TEXT PRIMARY KEY, obj TEXT NOT NULL) WITHOUT ROWID;
+'''
+
+
+def handle_refs(record):
+    '''
+    The org / contact handles a standard form record refers to. A key can
+    list several of them, joined by '\\n' in the intake process. The
+    objects a full db record has been joined with are skipped.
+    '''
+    for k, v in record.items():
+        if k == 'handles':
+            continue
+        if 'handle' in k or '-c' in k:
+            yield from v.split('\n')
+
+
+def write_asns(asn_objs, full_db_path, expand_blocks=True, serializer=None):
+    '''
+    Append the asn objects to the full db file, as json lines written with
+    serializer. Unless expand_blocks is False, every block is followed by a
+    copy of its object for each asn in the block that we don't have a
+    different entry for, after all of the original objects. The copies are
+    made one at a time as they're written, so the map itself only ever holds
+    the blocks. Returns the number of records written.
+    '''
+    serializer = serializer or default_serializer()
+    count = 0
+    with serializer.writer(open(full_db_path, 'ab')) as db:
+        for out_json in asn_objs.values():
+            db.write(out_json)
+            count += 1
+        if expand_blocks:
+            for out_json in ASBlockIndex.from_asn_objs(asn_objs).expand(asn_objs):
+                db.write(out_json)
+                count += 1
+    return count
+
+
+class MemoryJoin(object):
+    '''
+    The in-memory join of RIR.join_in_memory, one record at a time: every
+    aut-num record goes to add_asn first, then the org / contact records to
+    add_contact, type by type, and write() appends the joined ASes to the
+    full db. Only the ASes and the contacts they refer to are kept.
+    '''
+
+    def __init__(self, rir):
+        self.rir = rir
+        # map from asns to their objects
+        self.asn_objs = {}
+        # map from org/contact handles to a list of asns that contain them
+        self.handles_to_asns = {}
+        # the handles an object was found for
+        self.resolved = set()
+        # a person without a pochandle is attached under the handle of the
+        # record before it
+        self.handle = None
+
+    def add_asn(self, out_json):
+        # Make sure not to add duplicates.
+        if self.rir.is_other_org_entry(out_json):
+            return
+
+        handles_to_asns = self.handles_to_asns
+        # Check for contact / org object references
+        for k, v in out_json.items():
+            if 'handle' in k or '-c' in k:
+                # There can be multiple contacts listed! They were joined
+                # by '\n' in the intake process
+                cs = v.split('\n')
+                for v in cs:
+                    if not v in handles_to_asns:
+                        handles_to_asns[v] = set()
+                    handles_to_asns[v].add(out_json['asn'])
+
+        # add space for the eventual contact/org objects
+        out_json['handles'] = {}
+
+        # add to our list to eventually write out
+        self.asn_objs[out_json['asn']] = out_json
+
+    def add_contact(self, t, out_json):
+        handles_to_asns = self.handles_to_asns
+        org_pocs = set()
+
+        if t == 'organisation':
+            self.handle = out_json['orghandle']
+
+            # Check for contact / org object references in the orgs
+            # so that we can catch them when we go through the people/roles
+            for k, v in out_json.items():
+                if 'handle' in k or '-c' in k:
+                    for v in v.split('\n'):
+                        org_pocs.add(v)
+
+        elif t == 'person' or t == 'role':
+            if 'pochandle' in out_json:
+                self.handle = out_json['pochandle']
+
+        # If we noted that we cared about this handle, then loop over
+        # all the asns it was relevant to and add this object to their set
+        # of handles.
+        handle = self.handle
+        if handle in handles_to_asns:
+            self.resolved.add(handle)
+            for asn in handles_to_asns[handle]:
+                self.asn_objs[asn]['handles'][handle] = out_json
+                # Add this asn to the to process list for any nested contacts we discovered
+                for p in org_pocs:
+                    if p not in handles_to_asns:
+                        handles_to_asns[p] = set()
+                    handles_to_asns[p].add(asn)
+
+    def write(self, full_db_path, expand_blocks=True):
+        '''
+        Write out all of the asn objects to the full db file, duplicating the
+        ones that represent blocks as we go. Returns the number of handles
+        resolved and missing.
+        '''
+        rir = self.rir
+        with rir.get_metrics().timer("write", rir=rir.NAME) as stage:
+            stage.add(records=write_asns(self.asn_objs, full_db_path, expand_blocks, rir.get_serializer()))
+        return {"resolved": len(self.resolved), "missing": len(self.handles_to_asns) - len(self.resolved)}
+
+
+def sqlite_join(rir, out_folder, full_db, types, memory_mb=256, expand_blocks=True):
+    '''
+    Same as RIR.add_to_full_db, but with the ASes, the handle references and
+    the contact objects staged in a temporary sqlite database in out_folder
+    instead of in dicts. At most memory_mb of its pages are cached, so the
+    memory used no longer grows with the size of the RIR. The lines written to
+    full_db are identical to the in-memory join's, blocks included (they're
+    left unexpanded if expand_blocks is False).
+
+    Returns the number of handles resolved and missing.
+    '''
+    full_db_path = "%s/%s" % (out_folder, full_db)
+    db_path = "%s/%s_join.sqlite" % (out_folder, rir.NAME)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # Nothing here needs to survive a crash, it's rebuilt on every run
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA temp_store = FILE")
+        conn.execute("PRAGMA cache_size = %d" % -(memory_mb * 1024))
+        conn.executescript(SCHEMA)
+        conn.execute("BEGIN")
+        _stage(rir, conn, out_folder, types)
+        if expand_blocks:
+            _expand_blocks(conn)
+        conn.execute("COMMIT")
+        resolved = conn.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+        referenced = conn.execute("SELECT COUNT(DISTINCT handle) FROM refs").fetchone()[0]
+        with rir.get_metrics().timer("write", rir=rir.NAME) as stage:
+            stage.add(records=_write(conn, full_db_path, rir.get_serializer()))
+    finally:
+        conn.close()
+        os.remove(db_path)
+    logging.debug("Added as#s to full db.")
+    return {"resolved": resolved, "missing": referenced - resolved}
+
+
+def _stage(rir, conn, out_folder, types):
+    execute = conn.execute
+    pack = rir.get_serializer().pack
+    for out_json in rir.read_intermediate(out_folder, 'aut-num'):
+        if rir.is_other_org_entry(out_json):
+            continue
+        asn = out_json['asn']
+        conn.executemany("INSERT OR IGNORE INTO refs VALUES (?, ?)",
+                         [(h, asn) for h in handle_refs(out_json)])
+        out_json['handles'] = {}
+        execute("INSERT INTO asns (asn, obj, asblock) VALUES (?, ?, ?) "
+                "ON CONFLICT (asn) DO UPDATE SET obj = excluded.obj, asblock = excluded.asblock",
+                (asn, pack(out_json), out_json.get('asblock')))
+
+    # As in add_to_full_db, a person without a pochandle is attached under the
+    # handle of the record before it
+    handle = None
+    for t in types:
+        if t == 'aut-num':
+            continue
+        for out_json in rir.read_intermediate(out_folder, t):
+            org_pocs = set()
+            if t == 'organisation':
+                handle = out_json['orghandle']
+                org_pocs.update(handle_refs(out_json))
+            elif t == 'person' or t == 'role':
+                if 'pochandle' in out_json:
+                    handle = out_json['pochandle']
+            if handle is None:
+                continue
+            asns = [r[0] for r in execute("SELECT asn FROM refs WHERE handle = ?", (handle,))]
+            if not asns:
+                continue
+            # Every asn that has this handle gets this object, so only the
+            # last one for each handle needs keeping
+            execute("INSERT OR REPLACE INTO contacts VALUES (?, ?)",
+                    (handle, pack(out_json)))
+            conn.executemany("INSERT OR IGNORE INTO asn_handles (asn, handle) VALUES (?, ?)",
+                             [(asn, handle) for asn in asns])
+            conn.executemany("INSERT OR IGNORE INTO refs VALUES (?, ?)",
+                             [(p, asn) for p in org_pocs for asn in asns])
+
+
+def _expand_blocks(conn):
+    # Only the blocks themselves (not their copies) are expanded, each into
+    # the asns not already taken by an earlier row
+    blocks = conn.execute("SELECT seq, asblock FROM asns WHERE asblock IS NOT NULL ORDER BY seq").fetchall()
+    for seq, asblock in blocks:
+        parts = asblock.split('-')
+        if len(parts) != 2:
+            continue
+        first, last = int(parts[0]), int(parts[1])
+        if last - first + 1 > MAX_BLOCK_SIZE:
+            continue
+        conn.executemany("INSERT OR IGNORE INTO asns (asn, src) VALUES (?, ?)",
+                         [("AS" + str(i), seq) for i in range(first, last + 1)])
+
+
+def _handles(conn, asn, loads):
+    return {h: loads(obj) for h, obj in conn.execute(
+        "SELECT asn_handles.handle, contacts.obj FROM asn_handles JOIN contacts USING (handle) "
+        "WHERE asn_handles.asn = ? ORDER BY asn_handles.seq", (asn,))}
+
+
+def _write(conn, full_db_path, serializer):
+    # Copies of a block share its object, so decode it once per block
+    block = None
+    count = 0
+    loads = serializer.loads
+    rows = conn.execute("SELECT a.asn, a.obj, a.src, b.asn, b.obj FROM asns a "
+                        "LEFT JOIN asns b ON b.seq = a.src ORDER BY a.seq")
+    with serializer.writer(open(full_db_path, 'ab')) as db:
+        for asn, obj, src, src_asn, src_obj in rows:
+            if src is None:
+                out_json = loads(obj)
+                out_json['handles'] = _handles(conn, asn, loads)
+            else:
+                if block is None or block[0] != src:
+                    base = loads(src_obj)
+                    base['handles'] = _handles(conn, src_asn, loads)
+                    block = (src, base)
+                out_json = block[1].copy()
+                out_json['asn'] = asn
+            db.write(out_json)
+            count += 1
+    return count
+
+
+class HandleIndex(object):
+    '''
+    Where to find the org / contact object for every handle, over the
+    intermediate files of several types. Building it is one sequential read
+    per type (none at all for binary files, which carry their index), and
+    looking a handle up reads just that one record. When a handle has records
+    in several types, the one in the type listed last wins, as it does in the
+    in-memory join.
+    '''
+
+    def __init__(self, rir, out_folder, types):
+        self.readers = []
+        self.offsets = {}
+        for t in types:
+            primary_key = PRIMARY_KEYS.get(t)
+            if t == 'aut-num' or primary_key is None:
+                continue
+            reader = rir.read_intermediate(out_folder, t)
+            i = len(self.readers)
+            self.readers.append(reader)
+            for handle, offset in reader.handle_index(primary_key).items():
+                self.offsets[handle] = (i, offset)
+
+    def __contains__(self, handle):
+        return handle in self.offsets
+
+    def get(self, handle):
+        '''
+        Return the object for handle, or None.
+        '''
+        location = self.offsets.get(handle)
+        if location is None:
+            return None
+        return self.readers[location[0]].read_at(location[1])
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+
+def resolve_handles(index, handles):
+    '''
+    Look up handles, then the handles referenced by what was found, and so on
+    until nothing new turns up. Returns the objects found, the handles each of
+    them refers to, the handles that don't exist and the number of levels it
+    took.
+    '''
+    objs = {}
+    refs = {}
+    missing = set()
+    depth = 0
+    level = list(dict.fromkeys(handles))
+    while level:
+        depth += 1
+        next_level = []
+        for handle in level:
+            obj = index.get(handle)
+            if obj is None:
+                missing.add(handle)
+                continue
+            objs[handle] = obj
+            refs[handle] = [h for h in dict.fromkeys(handle_refs(obj)) if h != handle]
+            for h in refs[handle]:
+                if h not in objs and h not in missing:
+                    next_level.append(h)
+        level = [h for h in dict.fromkeys(next_level) if h not in objs and h not in missing]
+    return objs, refs, missing, depth
+
+
+def indexed_join(rir, out_folder, full_db, types, expand_blocks=True):
+    '''
+    A variant of RIR.add_to_full_db that follows references all the way: an
+    AS gets every object reachable from its handles, including the contacts
+    listed in those objects and theirs in turn, whatever order the types come
+    in. The ASes are read in one pass, then their handles are resolved level
+    by level through point lookups in a HandleIndex. Objects are attached
+    under their own handle (not under the handle of the record before, for
+    contacts that lack one).
+
+    Returns (and logs) the number of handles resolved and missing and how
+    many levels of references there were.
+    '''
+    full_db_path = "%s/%s" % (out_folder, full_db)
+
+    asn_objs = {}
+    for out_json in rir.read_intermediate(out_folder, 'aut-num'):
+        if rir.is_other_org_entry(out_json):
+            continue
+        asn_objs[out_json['asn']] = out_json
+    asn_refs = {asn: list(dict.fromkeys(handle_refs(obj))) for asn, obj in asn_objs.items()}
+
+    index = HandleIndex(rir, out_folder, types)
+    try:
+        objs, refs, missing, depth = resolve_handles(
+            index, (h for hs in asn_refs.values() for h in hs))
+    finally:
+        index.close()
+
+    for asn, obj in asn_objs.items():
+        # breadth first, so an AS's own contacts come before the nested ones
+        handles = {}
+        level = asn_refs[asn]
+        while level:
+            next_level = []
+            for h in level:
+                if h in handles or h not in objs:
+                    continue
+                handles[h] = objs[h]
+                next_level.extend(refs[h])
+            level = next_level
+        obj['handles'] = handles
+
+    with rir.get_metrics().timer("write", rir=rir.NAME) as stage:
+        stage.add(records=write_asns(asn_objs, full_db_path, expand_blocks, rir.get_serializer()))
+
+    stats = {"resolved": len(objs), "missing": len(missing), "depth": depth}
+    logging.debug("Added as#s to full db, resolved %(resolved)d handles (%(missing)d missing) "
+                  "in %(depth)d levels.", stats)
+    return stats
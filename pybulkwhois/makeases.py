@@ -1,3 +1,5 @@
+import argparse
+import concurrent.futures
 import logging
 import json
 import os
@@ -10,10 +12,259 @@ from .rirs.afrinic  import AFRINIC
 from .rirs.lacnic   import LACNIC
 from .rirs.arin     import ARIN
 
+from .cache import DownloadCache
+from .dbindex import build_index
 from .file import BulkWHOISFile
+from .metrics import Metrics
+from .nets import NET_TYPES, build_net_index
+from .routes import ROUTE_TYPES, merge_route_tables
+from .search import build_search_index
+from .serialize import BACKENDS, BUFFER_SIZE, Serializer
+from .store import STORES
+from .transport import default_transport, BandwidthLimiter
+
+# The order the RIRs are merged into the full db, regardless of which worker
+# finishes first.
+RIR_ORDER = ["RIPE", "APNIC", "AFRINIC", "LACNIC", "ARIN"]
+
+# These are the types relevant to the full database
+TYPES = ['aut-num', 'organisation', 'person', 'role']
+
+# Netblocks are written to their own db, with --nets
+NETS_DB = 'nets_db.json'
+
+# And route objects to a table of prefixes and their origins, with --routes
+ROUTE_TABLE = 'routes.tbl'
+
+
+def make_rir(name, logins):
+    '''
+    Construct the RIR object for name using the credentials from logins.json.
+    Returns the RIR and the types that should be processed for it.
+    '''
+    if name == "RIPE":
+        return RIPE(), TYPES
+    if name == "APNIC":
+        return APNIC(uid=logins["APNIC_UID"], pwd=logins["APNIC_PWD"]), TYPES
+    if name == "AFRINIC":
+        return AFRINIC(), TYPES
+    if name == "LACNIC":
+        return LACNIC(logins["LACNIC_UID"], logins["LACNIC_PWD"]), TYPES
+    if name == "ARIN":
+        # ARIN wraps roles into person
+        return ARIN(logins["ARIN_API"]), ['aut-num', 'organisation', 'person']
+    raise Exception("unknown RIR %s" % name)
+
+
+def configure(rir, args, metrics=None):
+    '''
+    Apply the command line options that change how an RIR fetches and parses
+    its files.
+    '''
+    rir.metrics = metrics
+    rir.stream = args.stream
+    rir.chunked = args.chunked
+    rir.fused_parse = args.fused_parse
+    rir.parse_workers = args.parse_workers
+    if args.cache:
+        rir.cache = DownloadCache(args.cache)
+    rir.fetch_concurrency = args.fetch_concurrency
+    if args.bandwidth:
+        default_transport().limiter = BandwidthLimiter(args.bandwidth)
+    default_transport().segments = args.segments
+    if isinstance(rir, ARIN):
+        rir.combined = args.arin_combined
+    rir.intermediate_format = args.intermediate_format
+    rir.join_mode = args.join
+    rir.join_memory_mb = args.join_memory
+    rir.expand_blocks = not args.compact_blocks
+    # Exporting json lines needs the intermediate files
+    rir.keep_intermediate = args.keep_intermediate or args.export_jsonl
+    rir.serializer = Serializer(args.json_backend, not args.json_compact, args.json_buffer)
+
+
+def partial_db_name(full_db, name):
+    '''
+    Each worker writes its ASes to its own partial db so that concurrent
+    appends to the full db can't interleave.
+    '''
+    return "%s.%s.part" % (full_db, name.lower())
+
+
+def net_types(name):
+    '''
+    The netblock types to process for an RIR.
+    '''
+    if name == "ARIN":
+        # ARIN has both families in its nets
+        return ['inetnum']
+    return NET_TYPES
+
+
+def route_types(name):
+    '''
+    The route types to process for an RIR. Only RIPE and APNIC publish their
+    route objects in the bulk files.
+    '''
+    if name in ("RIPE", "APNIC"):
+        return ROUTE_TYPES
+    return []
+
+
+def process_rir(name, logins, out_folder, full_db, args):
+    '''
+    Run the full pipeline for a single RIR. Meant to be run in its own worker
+    process. Returns the path of the partial db on success, or None if the RIR
+    failed (the traceback is printed, as before), and the report of the
+    worker's metrics. With --nets, the RIR's netblocks go to the partial of
+    the nets db as well, and with --routes its route objects to a partial
+    route table.
+    '''
+    logging.basicConfig(level=logging.DEBUG)
+    metrics = Metrics(args.profile, rir=name.lower())
+    partial = partial_db_name(full_db, name)
+    partial_path = out_folder + '/' + partial
+    nets_partial = partial_db_name(NETS_DB, name)
+    nets_partial_path = out_folder + '/' + nets_partial
+    routes_partial = partial_db_name(ROUTE_TABLE, name)
+    routes_partial_path = out_folder + '/' + routes_partial
+    try:
+        logging.debug(f"----- Processing {name} -----")
+        # Make sure a retried run doesn't append to a stale partial
+        with open(partial_path, 'w+') as out:
+            out.write("")
+        rir, types = make_rir(name, logins)
+        configure(rir, args, metrics)
+        parsed_types = types
+        if args.nets:
+            with open(nets_partial_path, 'w+') as out:
+                out.write("")
+            parsed_types = parsed_types + net_types(name)
+        if args.routes:
+            parsed_types = parsed_types + route_types(name)
+        if args.streaming:
+            rir.stream_to_full_db(out_folder, partial, types, parsed_types)
+        else:
+            rir.construct_intermediate_jsons(out_folder, parsed_types)
+            rir.add_to_full_db(out_folder, partial, types)
+        if args.nets:
+            rir.add_to_nets_db(out_folder, nets_partial, parsed_types)
+        if args.routes:
+            rir.add_to_route_table(out_folder, routes_partial, parsed_types)
+        if args.export_jsonl:
+            rir.export_intermediate_jsons(out_folder, parsed_types)
+        return partial_path, worker_report(metrics)
+    except Exception as e:
+        print(traceback.format_exc())
+        for path in (partial_path, nets_partial_path, routes_partial_path):
+            if os.path.exists(path):
+                os.remove(path)
+        metrics.count("failed")
+        return None, worker_report(metrics)
+
+
+def worker_report(metrics):
+    '''
+    The report of a worker's metrics, with the totals of its downloads.
+    '''
+    requests, nbytes, seconds = default_transport().totals()
+    metrics.count("http_requests", requests)
+    metrics.count("http_bytes", nbytes)
+    metrics.count("http_seconds", seconds)
+    return metrics.report()
+
+
+def merge_partials(out_folder, full_db, partials):
+    '''
+    Concatenate the partial dbs (in RIR_ORDER) into the full db. The merged
+    file is written next to the full db and then renamed over it, so readers
+    never see a half written full db.
+    '''
+    full_db_path = out_folder + '/' + full_db
+    tmp_path = full_db_path + ".tmp"
+    with open(tmp_path, 'wb') as out:
+        for name in RIR_ORDER:
+            path = partials.get(name)
+            if path is None:
+                logging.debug(f"No output from {name}, skipping in merge.")
+                continue
+            with open(path, 'rb') as part:
+                while True:
+                    buf = part.read(1 << 20)
+                    if not buf:
+                        break
+                    out.write(buf)
+            os.remove(path)
+    os.replace(tmp_path, full_db_path)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m pybulkwhois.makeases")
+    parser.add_argument("out_folder", nargs="?", default="out",
+                        help="output directory (default: out)")
+    parser.add_argument("-j", "--workers", type=int, default=len(RIR_ORDER),
+                        help="number of RIRs to process concurrently (default: %(default)s)")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse files as they download instead of from a local copy")
+    parser.add_argument("--chunked", action="store_true",
+                        help="split records with the buffered byte level scanner")
+    parser.add_argument("--fused-parse", action="store_true",
+                        help="parse records straight into standard form, in one pass")
+    parser.add_argument("--parse-workers", type=int, default=1,
+                        help="processes used to parse each db file (default: %(default)s)")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="keep downloads in DIR, only fetch and parse files that changed")
+    parser.add_argument("--fetch-concurrency", type=int, default=1,
+                        help="download an RIR's split files concurrently, at most N per host")
+    parser.add_argument("--bandwidth", type=int, metavar="BYTES_PER_SEC",
+                        help="cap the download rate of each RIR worker")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="download large files in N parallel ranged requests when the server allows it")
+    parser.add_argument("--arin-combined", action="store_true",
+                        help="read every ARIN type from the single combined bulkwhois archive")
+    parser.add_argument("--intermediate-format", choices=sorted(STORES), default="jsonl",
+                        help="format of the intermediate files in out_folder/intm (default: %(default)s)")
+    parser.add_argument("--export-jsonl", action="store_true",
+                        help="also write binary intermediate files out as json lines")
+    parser.add_argument("--json-backend", choices=BACKENDS, default="auto",
+                        help="json library used to read and write records, auto picks orjson "
+                             "if it's installed (default: %(default)s)")
+    parser.add_argument("--json-compact", action="store_true",
+                        help="write orjson's compact json lines instead of the same bytes as the json module")
+    parser.add_argument("--json-buffer", type=int, default=BUFFER_SIZE, metavar="BYTES",
+                        help="json lines collected before each write (default: %(default)s)")
+    parser.add_argument("--join", choices=["memory", "sqlite", "indexed"], default="memory",
+                        help="join contacts onto ASes in memory, staged on disk in sqlite, "
+                             "or following nested references through a handle index")
+    parser.add_argument("--streaming", action="store_true",
+                        help="parse and join in a single pass, without writing the intermediate files "
+                             "(only --join memory and indexed)")
+    parser.add_argument("--keep-intermediate", action="store_true",
+                        help="with --streaming, write the intermediate files anyway")
+    parser.add_argument("--join-memory", type=int, default=256, metavar="MB",
+                        help="page cache budget of the sqlite join (default: %(default)s)")
+    parser.add_argument("--index", action="store_true",
+                        help="also write an asn / handle index of the full db (see dbindex.DBReader)")
+    parser.add_argument("--search-index", action="store_true",
+                        help="also write a search index of the names, e-mails and handles in the full db")
+    parser.add_argument("--nets", action="store_true",
+                        help="also build a db of netblocks, indexed for longest prefix match (see nets.NetIndex)")
+    parser.add_argument("--routes", action="store_true",
+                        help="also build a table of route prefixes and their origin ASes (see routes.RouteTable)")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write a json report of the time, records and bytes of every stage")
+    parser.add_argument("--prometheus", metavar="PATH",
+                        help="write the same metrics in the Prometheus textfile format")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="profile every stage with cProfile, into DIR")
+    parser.add_argument("--compact-blocks", action="store_true",
+                        help="write AS blocks once instead of copying them for every asn they cover")
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
+    args = parse_args(sys.argv[1:])
 
     # Make sure all the relevant environment keys are present
     rirs_with_logins = ["APNIC", "LACNIC"]
@@ -33,10 +284,7 @@ if __name__ == "__main__":
         exit()
 
     # Configure output directory
-    if (len(sys.argv) > 1):
-        out_folder = sys.argv[1]
-    else:
-        out_folder = "out" # default
+    out_folder = args.out_folder
 
     logging.debug(f"Using {out_folder} as output directory.")
     if not os.path.isdir(out_folder):
@@ -47,60 +295,59 @@ if __name__ == "__main__":
     if not os.path.isdir(intermediate_folder):
         os.mkdir(intermediate_folder)
 
-
     # full_db is where we'll eventually write out all of the processed entries
     full_db = 'full_db.json'
-    # If the file already exists, clear it
-    with open(out_folder + '/' + full_db, 'w+') as out:
-        out.write("")
-
-    # These are the types relevant to the full database
-    types = ['aut-num', 'organisation', 'person', 'role']
 
-    # RIPE
-    try:
-        logging.debug("----- Processing RIPE -----")
-        ripe = RIPE()
-        ripe.construct_intermediate_jsons(out_folder, types)
-        ripe.add_to_full_db(out_folder, full_db, types)
-    except Exception as e:
-        print(traceback.format_exc())
+    # Each RIR runs in its own process. Failures stay isolated to the RIR:
+    # the worker prints its traceback and we simply leave it out of the merge.
+    partials = {}
+    metrics = Metrics(args.profile)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {
+            pool.submit(process_rir, name, logins, out_folder, full_db, args): name
+            for name in RIR_ORDER
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                partials[name], report = future.result()
+                metrics.merge(report)
+            except Exception as e:
+                # e.g. the worker process died outright
+                print(traceback.format_exc())
+                partials[name] = None
+                metrics.count("failed", rir=name.lower())
 
-    # APNIC
-    try:
-        logging.debug("----- Processing APNIC -----")
-        apnic = APNIC(uid=logins["APNIC_UID"], pwd=logins["APNIC_PWD"])
-        apnic.construct_intermediate_jsons(out_folder, types)
-        apnic.add_to_full_db(out_folder, full_db, types)
-    except Exception as e:
-        print(traceback.format_exc())
+    with metrics.timer("merge") as stage:
+        merge_partials(out_folder, full_db, partials)
+        stage.add(nbytes=os.path.getsize(out_folder + '/' + full_db))
+    logging.debug(f"All AS objects written out to {out_folder}/{full_db}.")
 
-    # AFRINIC
-    try:
-        logging.debug("----- Processing AFRINIC -----")
-        afrinic = AFRINIC()
-        afrinic.construct_intermediate_jsons(out_folder, types)
-        afrinic.add_to_full_db(out_folder, full_db, types)
-    except Exception as e:
-        print(traceback.format_exc())
+    if args.index:
+        with metrics.timer("index"):
+            build_index(out_folder + '/' + full_db)
+    if args.search_index:
+        with metrics.timer("search_index"):
+            build_search_index(out_folder + '/' + full_db)
 
-    # LACNIC
-    try:
-        logging.debug("----- Processing LACNIC -----")
-        lacnic = LACNIC(logins["LACNIC_UID"], logins["LACNIC_PWD"])
-        lacnic.construct_intermediate_jsons(out_folder, types)
-        lacnic.add_to_full_db(out_folder, full_db, types)
-    except Exception as e:
-        print(traceback.format_exc())
+    if args.nets:
+        with metrics.timer("nets"):
+            nets_partials = {name: out_folder + '/' + partial_db_name(NETS_DB, name)
+                             for name, path in partials.items() if path is not None}
+            merge_partials(out_folder, NETS_DB, nets_partials)
+            build_net_index(out_folder + '/' + NETS_DB)
+        logging.debug(f"All netblocks written out to {out_folder}/{NETS_DB}.")
 
-    # ARIN
-    try:
-        logging.debug("----- Processing ARIN -----")
-        types = ['aut-num', 'organisation', 'person'] # ARIN wraps roles into person
-        arin = ARIN(logins["ARIN_API"])
-        arin.construct_intermediate_jsons(out_folder, types)
-        arin.add_to_full_db(out_folder, full_db, types)
-    except Exception as e:
-        print(traceback.format_exc())
+    if args.routes:
+        with metrics.timer("routes"):
+            route_tables = [out_folder + '/' + partial_db_name(ROUTE_TABLE, name)
+                            for name in RIR_ORDER if partials.get(name) is not None]
+            merge_route_tables(out_folder + '/' + ROUTE_TABLE, route_tables)
+            for path in route_tables:
+                os.remove(path)
+        logging.debug(f"All routes written out to {out_folder}/{ROUTE_TABLE}.")
 
-    logging.debug(f"All AS objects written out to {out_folder}/{full_db}.")
+    if args.metrics:
+        metrics.write_json(args.metrics)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
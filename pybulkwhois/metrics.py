@@ -0,0 +1,256 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Prefix of every metric in the Prometheus textfile
+PROMETHEUS_PREFIX = "pybulkwhois"
+
+
+def peak_rss():
+    '''
+    The peak resident set size of this process, in bytes.
+    '''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Stage(object):
+    '''
+    The totals of one stage (for one set of labels): time spent in it, how
+    often it ran and the records and bytes it went through.
+    '''
+
+    __slots__ = ("seconds", "calls", "records", "bytes")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.records = 0
+        self.bytes = 0
+
+    def add(self, records=0, nbytes=0):
+        self.records += records
+        self.bytes += nbytes
+
+
+class Metrics(object):
+    '''
+    Timers and counters of a makeases run, labelled by e.g. rir and type.
+    Each worker process keeps its own and returns report(), which the main
+    process merge()s into its own before writing the run report (as json, or
+    as a Prometheus textfile).
+
+    Stages nest: intermediate (construct_intermediate_jsons) includes the
+    download, decompress and parse stages it runs, join (add_to_full_db) the
+    final write.
+
+    With profile_dir set, every outermost stage also runs under a profiler
+    (profiler_factory, cProfile by default; anything with enable, disable and
+    dump_stats will do, e.g. a sampling profiler), dumped to
+    <profile_dir>/<stage>-<labels>.prof.
+    '''
+
+    profiler_factory = cProfile.Profile
+
+    def __init__(self, profile_dir=None, **labels):
+        self.labels = labels
+        self.profile_dir = profile_dir
+        self.stages = {}
+        self.counters = {}
+        self.processes = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._profiling = False
+
+    def __getstate__(self):
+        # Pickled along with an RIR for its parse workers, which can't share
+        # the lock (or report back through it)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stage(self, name, **labels):
+        '''
+        The Stage for name and labels, created on first use.
+        '''
+        key = _key(name, dict(self.labels, **labels))
+        with self._lock:
+            if key not in self.stages:
+                self.stages[key] = Stage()
+            return self.stages[key]
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        '''
+        Time the body of a with statement as stage name. Yields the Stage, to
+        add the records and bytes it handled to.
+        '''
+        stage = self.stage(name, **labels)
+        profiler = None
+        if self.profile_dir is not None and not self._profiling:
+            self._profiling = True
+            profiler = self.profiler_factory()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage.seconds += elapsed
+                stage.calls += 1
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                self._dump_profile(profiler, name, dict(self.labels, **labels))
+
+    def _dump_profile(self, profiler, name, labels):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        parts = [name] + ["%s" % labels[k] for k in sorted(labels)]
+        filename = "-".join(p.replace("/", "_") for p in parts) + ".prof"
+        profiler.dump_stats(os.path.join(self.profile_dir, filename))
+
+    def count(self, name, value=1, **labels):
+        '''
+        Add value to the counter name.
+        '''
+        key = _key(name, dict(self.labels, **labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def report(self):
+        '''
+        Everything recorded so far, including this process's peak RSS, as a
+        json-able dict.
+        '''
+        stages = []
+        for (name, labels), s in sorted(self.stages.items()):
+            stages.append({
+                "stage": name,
+                "labels": dict(labels),
+                "seconds": s.seconds,
+                "calls": s.calls,
+                "records": s.records,
+                "bytes": s.bytes,
+                "records_per_sec": s.records / s.seconds if s.seconds else None,
+            })
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())]
+        process = {"labels": dict((k, str(v)) for k, v in self.labels.items()), "pid": os.getpid(),
+                   "seconds": time.time() - self.started, "peak_rss_bytes": peak_rss()}
+        return {
+            "started": datetime.datetime.fromtimestamp(self.started, datetime.timezone.utc).isoformat(),
+            "seconds": time.time() - self.started,
+            "stages": stages,
+            "counters": counters,
+            "processes": self.processes + [process],
+        }
+
+    def merge(self, report):
+        '''
+        Add the stages, counters and processes of another report (e.g. a
+        worker's) to these.
+        '''
+        with self._lock:
+            for s in report["stages"]:
+                key = _key(s["stage"], s["labels"])
+                stage = self.stages.setdefault(key, Stage())
+                stage.seconds += s["seconds"]
+                stage.calls += s["calls"]
+                stage.records += s["records"]
+                stage.bytes += s["bytes"]
+            for c in report["counters"]:
+                key = _key(c["name"], c["labels"])
+                self.counters[key] = self.counters.get(key, 0) + c["value"]
+            self.processes.extend(report["processes"])
+
+    def write_json(self, path):
+        _write_atomically(path, json.dumps(self.report(), indent=1) + "\n")
+
+    def write_prometheus(self, path):
+        '''
+        Write the report in the Prometheus text format, for node_exporter's
+        textfile collector. The file is replaced in one go, so the collector
+        never reads half of it.
+        '''
+        _write_atomically(path, prometheus_text(self.report()))
+
+
+def _write_atomically(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_text = ",".join('%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items()))
+        return "%s{%s} %r\n" % (name, label_text, value)
+    return "%s %r\n" % (name, value)
+
+
+def prometheus_text(report):
+    '''
+    Render a report as Prometheus metrics: per stage seconds, calls, records
+    and bytes, every counter, the peak RSS of every process and the length of
+    the run.
+    '''
+    families = {}
+
+    def add(name, help_text, labels, value):
+        name = "%s_%s" % (PROMETHEUS_PREFIX, name.replace("-", "_"))
+        families.setdefault(name, (help_text, []))[1].append(_sample(name, labels, value))
+
+    for s in report["stages"]:
+        labels = dict(s["labels"], stage=s["stage"])
+        add("stage_seconds", "Time spent in each stage", labels, s["seconds"])
+        add("stage_calls", "Number of times each stage ran", labels, s["calls"])
+        add("stage_records", "Records handled by each stage", labels, s["records"])
+        add("stage_bytes", "Bytes handled by each stage", labels, s["bytes"])
+    for c in report["counters"]:
+        add(c["name"], "Counter %s" % c["name"], c["labels"], c["value"])
+    for p in report["processes"]:
+        add("peak_rss_bytes", "Peak resident set size of each process", p["labels"], p["peak_rss_bytes"])
+    add("run_seconds", "Length of the run", {}, report["seconds"])
+    add("run_timestamp_seconds", "When the run started",
+        {}, datetime.datetime.fromisoformat(report["started"]).timestamp())
+
+    lines = []
+    for name in sorted(families):
+        help_text, samples = families[name]
+        lines.append("# HELP %s %s\n" % (name, help_text))
+        lines.append("# TYPE %s gauge\n" % name)
+        lines.extend(samples)
+    return "".join(lines)
+
+
+_default_metrics = None
+
+def default_metrics():
+    '''
+    The metrics shared by every RIR in this process that wasn't given its own.
+    '''
+    global _default_metrics
+    if _default_metrics is None:
+        _default_metrics = Metrics()
+    return _default_metrics
@@ -0,0 +1,323 @@
+import array
+import bisect
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .asblocks import disjoint_intervals
+from .join import HandleIndex
+
+# The standard types of netblock objects. ARIN publishes both families as
+# NetRanges of one kind of object, which are written out as inetnum.
+NET_TYPES = ['inetnum', 'inet6num']
+
+NET_INDEX_MAGIC = b"PBWN\x01" + (b"l" if sys.byteorder == "little" else b"b")
+NET_INDEX_HEADER = struct.Struct("=6s2xQQQ")
+
+
+def net_index_path(nets_db_path):
+    return nets_db_path + ".idx"
+
+
+def parse_range(value):
+    '''
+    Parse the address range of a netblock into (version, first, last), with
+    the addresses as integers. Takes "first - last" ranges, CIDR prefixes and
+    LACNIC's abbreviated IPv4 prefixes ("200.7.84/23"). Returns None if value
+    isn't any of those.
+    '''
+    value = value.split('\n')[0].strip()
+    try:
+        if '-' in value:
+            first, last = value.split('-', 1)
+            first = ipaddress.ip_address(first.strip())
+            last = ipaddress.ip_address(last.strip())
+            if first.version != last.version:
+                return None
+            return first.version, int(first), int(last)
+        if '/' in value:
+            network, length = value.split('/', 1)
+            if ':' not in network:
+                network = '.'.join((network.split('.') + ['0', '0', '0'])[:4])
+            net = ipaddress.ip_network("%s/%s" % (network, length.strip()), strict=False)
+            return net.version, int(net.network_address), int(net.broadcast_address)
+        address = ipaddress.ip_address(value)
+        return address.version, int(address), int(address)
+    except ValueError:
+        return None
+
+
+def net_range(record):
+    '''
+    The (version, first, last) of a standard form netblock record, or None.
+    '''
+    for t in NET_TYPES:
+        if t in record:
+            return parse_range(record[t])
+    return None
+
+
+def write_nets(rir, out_folder, nets_db, types):
+    '''
+    Append the netblocks of an RIR (the NET_TYPES among types) to nets_db in
+    out_folder, each with the organisation objects it refers to under
+    'handles', like the ASes in the full db. Netblocks whose range can't be
+    parsed are left out.
+    '''
+    nets_db_path = "%s/%s" % (out_folder, nets_db)
+    orgs = HandleIndex(rir, out_folder, [t for t in types if t == 'organisation'])
+    count = 0
+    try:
+        with rir.get_serializer().writer(open(nets_db_path, 'ab')) as db:
+            for t in types:
+                if t not in NET_TYPES:
+                    continue
+                for out_json in rir.read_intermediate(out_folder, t):
+                    if net_range(out_json) is None:
+                        continue
+                    handles = {}
+                    for handle in out_json.get('orghandle', '').split('\n'):
+                        org = orgs.get(handle) if handle else None
+                        if org is not None:
+                            handles[handle] = org
+                    out_json['handles'] = handles
+                    db.write(out_json)
+                    count += 1
+    finally:
+        orgs.close()
+    logging.debug("Added %d netblocks to %s.", count, nets_db_path)
+
+
+def _write_section(out, data):
+    out.write(data)
+    out.write(b"\0" * (-len(data) % 8))
+
+
+def build_net_index(nets_db_path, out_path=None):
+    '''
+    Write the longest prefix match index of a nets db next to it
+    (<nets_db>.idx). For each address family it holds sorted, disjoint
+    address intervals, each with the byte offset of the most specific (i.e.
+    smallest, then first) netblock covering it. IPv4 addresses are stored as
+    native uint32s, IPv6 addresses as 16 big endian bytes, so both sort (and
+    can be binary searched) as they are.
+    '''
+    out_path = out_path or net_index_path(nets_db_path)
+    blocks = {4: [], 6: []}
+    offset = 0
+    with open(nets_db_path, 'rb') as f:
+        for l in f:
+            r = net_range(json.loads(l))
+            if r is not None:
+                blocks[r[0]].append((r[1], r[2], offset))
+            offset += len(l)
+    size = offset
+
+    segments = {}
+    for version in (4, 6):
+        # most specific first, so it wins wherever netblocks overlap
+        ordered = sorted(blocks[version], key=lambda b: b[1] - b[0])
+        segments[version] = disjoint_intervals(ordered)
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as out:
+        out.write(NET_INDEX_HEADER.pack(NET_INDEX_MAGIC, size, len(segments[4][0]), len(segments[6][0])))
+        starts, ends, owners = segments[4]
+        _write_section(out, array.array('I', starts).tobytes())
+        _write_section(out, array.array('I', ends).tobytes())
+        _write_section(out, array.array('Q', owners).tobytes())
+        starts, ends, owners = segments[6]
+        _write_section(out, b"".join(a.to_bytes(16, 'big') for a in starts))
+        _write_section(out, b"".join(a.to_bytes(16, 'big') for a in ends))
+        _write_section(out, array.array('Q', owners).tobytes())
+    os.replace(tmp_path, out_path)
+    logging.debug("Indexed %d IPv4 and %d IPv6 netblocks of %s into %d and %d intervals.",
+                  len(blocks[4]), len(blocks[6]), nets_db_path, len(segments[4][0]), len(segments[6][0]))
+    return out_path
+
+
+class _Addresses16(object):
+    # A sequence of 16 byte addresses in a buffer, for bisect
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // 16
+
+    def __getitem__(self, i):
+        return bytes(self.view[16 * i:16 * i + 16])
+
+
+class NetIndex(object):
+    '''
+    Resolves addresses to the most specific netblock (and its organisation)
+    that covers them, from a nets db and the index written by
+    build_net_index, both memory mapped.
+
+    lookup() finds a single address by binary search. The batch lookups
+    resolve whole arrays of addresses at once with numpy's searchsorted when
+    numpy is installed, and fall back to bisect when it isn't.
+    '''
+
+    def __init__(self, nets_db_path, idx_path=None):
+        self.path = nets_db_path
+        self.index_path = idx_path or net_index_path(nets_db_path)
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.db = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        with open(self.index_path, 'rb') as f:
+            self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, built_size, n4, n6 = NET_INDEX_HEADER.unpack_from(self.idx)
+        if magic != NET_INDEX_MAGIC:
+            raise Exception("%s isn't a net index for this machine" % self.index_path)
+        if built_size != size:
+            raise Exception("%s is out of date, rebuild it" % self.index_path)
+        self.n4 = n4
+        self.n6 = n6
+
+        self._view = memoryview(self.idx)
+        pos = NET_INDEX_HEADER.size
+        self._sections = []
+        for length in (4 * n4, 4 * n4, 8 * n4, 16 * n6, 16 * n6, 8 * n6):
+            self._sections.append((pos, length))
+            pos += length + (-length % 8)
+
+        v4_starts, v4_ends, v4_owners, v6_starts, v6_ends, v6_owners = [
+            self._view[start:start + length] for start, length in self._sections]
+        self.v4 = (v4_starts.cast('I'), v4_ends.cast('I'), v4_owners.cast('Q'))
+        self.v6 = (_Addresses16(v6_starts), _Addresses16(v6_ends), v6_owners.cast('Q'))
+        self._views = [v4_starts, v4_ends, v4_owners, v6_starts, v6_ends, v6_owners,
+                       self.v6[2]] + list(self.v4)
+
+        self._arrays = None
+        if np is not None:
+            dtypes = [np.uint32, np.uint32, np.uint64, 'S16', 'S16', np.uint64]
+            self._arrays = [np.frombuffer(self.idx, dtype=dtype, count=length // np.dtype(dtype).itemsize,
+                                          offset=start)
+                            for dtype, (start, length) in zip(dtypes, self._sections)]
+
+    def read_at(self, offset):
+        '''
+        Decode the netblock whose line starts at offset.
+        '''
+        end = self.db.find(b"\n", offset)
+        if end == -1:
+            end = len(self.db)
+        return json.loads(self.db[offset:end])
+
+    def offset_of(self, address):
+        '''
+        Return the offset of the most specific netblock covering address (a
+        string, an ipaddress address or an IPv4 integer), or None.
+        '''
+        if not isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            address = ipaddress.ip_address(address)
+        if address.version == 4:
+            starts, ends, owners = self.v4
+            key = int(address)
+        else:
+            starts, ends, owners = self.v6
+            key = address.packed
+        i = bisect.bisect_right(starts, key) - 1
+        if i >= 0 and key <= ends[i]:
+            return owners[i]
+        return None
+
+    def lookup(self, address):
+        '''
+        Return the most specific netblock covering address, or None.
+        '''
+        offset = self.offset_of(address)
+        if offset is None:
+            return None
+        return self.read_at(offset)
+
+    def lookup_ipv4(self, addresses):
+        '''
+        Resolve a sequence of IPv4 addresses given as integers (ideally a
+        numpy uint32 array) to the offsets of their netblocks, -1 where none
+        covers them.
+        '''
+        if self._arrays is None:
+            return [self._offset_or_missing(ipaddress.IPv4Address(a)) for a in addresses]
+        starts, ends, owners = self._arrays[:3]
+        return self._search(starts, ends, owners, np.asarray(addresses, dtype=np.uint32))
+
+    def lookup_ipv6(self, addresses):
+        '''
+        Like lookup_ipv4, for IPv6 addresses given as 16 byte big endian
+        strings (ideally a numpy 'S16' array).
+        '''
+        if self._arrays is None:
+            return [self._offset_or_missing(ipaddress.IPv6Address(bytes(a))) for a in addresses]
+        starts, ends, owners = self._arrays[3:]
+        return self._search(starts, ends, owners, np.asarray(addresses, dtype='S16'))
+
+    def _offset_or_missing(self, address):
+        offset = self.offset_of(address)
+        return -1 if offset is None else offset
+
+    def _search(self, starts, ends, owners, keys):
+        if len(starts) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        i = np.searchsorted(starts, keys, side='right') - 1
+        found = i >= 0
+        i[~found] = 0
+        found &= keys <= ends[i]
+        return np.where(found, owners[i].astype(np.int64), -1)
+
+    def lookup_many(self, addresses):
+        '''
+        Return the most specific netblock (or None) for each of a list of
+        address strings, mixing families as needed. Every netblock is only
+        decoded once however many of the addresses it covers.
+        '''
+        v4 = []
+        v6 = []
+        parsed = [ipaddress.ip_address(a) for a in addresses]
+        for n, address in enumerate(parsed):
+            if address.version == 4:
+                v4.append(n)
+            else:
+                v6.append(n)
+        offsets = [None] * len(parsed)
+        for positions, lookup, key in ((v4, self.lookup_ipv4, int),
+                                       (v6, self.lookup_ipv6, lambda a: a.packed)):
+            if positions:
+                found = lookup([key(parsed[n]) for n in positions])
+                for n, offset in zip(positions, found):
+                    offsets[n] = int(offset)
+        records = {}
+        result = []
+        for offset in offsets:
+            if offset == -1:
+                result.append(None)
+                continue
+            if offset not in records:
+                records[offset] = self.read_at(offset)
+            result.append(records[offset])
+        return result
+
+    def close(self):
+        self._arrays = None
+        for view in self._views:
+            view.release()
+        self._view.release()
+        self.idx.close()
+        if isinstance(self.db, mmap.mmap):
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
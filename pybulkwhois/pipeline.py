@@ -0,0 +1,386 @@
+import asyncio
+import logging
+import marshal
+import os
+import shutil
+
+from .asblocks import ASBlockIndex, block_range
+from .fetch import fetch_concurrently
+from .join import HandleIndex, MemoryJoin, handle_refs
+from .store import RecordBuffer
+
+
+class TypeSink(object):
+    '''
+    What write_intermediate writes the records of one type to in the
+    streaming pipeline: the intermediate file, if it's kept, and then the
+    join. Parse workers hand over the records themselves rather than
+    serialized ones (see RIR.write_intermediate_parallel).
+    '''
+
+    buffer = RecordBuffer
+
+    def __init__(self, join, t, side=None):
+        self.join = join
+        self.t = t
+        # The join can hold on to the records (and add to them), so the side
+        # output gets them first
+        self.side = side
+
+    def write(self, record):
+        if self.side is not None:
+            self.side.write(record)
+        self.join.add(self.t, record)
+
+    def write_buffered(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        if self.side is not None:
+            self.side.close()
+        self.join.seal(self.t)
+
+
+class StreamingJoin(object):
+    '''
+    join.MemoryJoin fed straight from the parser, so the full db is identical
+    to the staged pipeline's. That join takes every aut-num record before any
+    org / contact record, and those type by type in the order of types, so
+    records that arrive before their turn (the contacts of the RIRs that
+    publish everything in one file, or of files downloaded concurrently) are
+    held until then, in the order they came in. They're kept marshalled, which
+    takes a fraction of the memory of the records themselves. A contact can
+    still be attached to an AS up until the last record of the last type, so
+    the ASes are written out at the end. StreamingIndexedJoin writes them as
+    they come instead.
+    '''
+
+    def __init__(self, rir, out_folder, full_db, types, keep_intermediate=False):
+        self.rir = rir
+        self.out_folder = out_folder
+        self.full_db_path = "%s/%s" % (out_folder, full_db)
+        self.keep_intermediate = keep_intermediate
+        self.join = MemoryJoin(rir)
+        self.order = ['aut-num'] + [t for t in types if t != 'aut-num']
+        self.current = 0
+        self.sealed = set()
+        # the marshalled records of the types whose turn hasn't come yet
+        self.held = {}
+
+    def parse_order(self):
+        return self.order
+
+    def writer(self, t):
+        side = None
+        if self.keep_intermediate:
+            side = self.rir.intermediate_store().writer(self.rir.intm_path(self.out_folder, t), t)
+        return TypeSink(self, t, side)
+
+    def load(self, t):
+        '''
+        Feed the join the records of t from its (cached) intermediate file.
+        '''
+        for record in self.rir.read_intermediate(self.out_folder, t):
+            self.add(t, record)
+        self.seal(t)
+
+    def add(self, t, record):
+        if self.current < len(self.order) and t == self.order[self.current]:
+            self._feed(t, record)
+        else:
+            self.held.setdefault(t, []).append(marshal.dumps(record))
+
+    def _feed(self, t, record):
+        if t == 'aut-num':
+            self.join.add_asn(record)
+        else:
+            self.join.add_contact(t, record)
+
+    def seal(self, t):
+        '''
+        All of the records of t are in. Moves the join on to the types whose
+        turn it now is, starting with what was held of them.
+        '''
+        self.sealed.add(t)
+        while self.current < len(self.order) and self.order[self.current] in self.sealed:
+            self.current += 1
+            if self.current < len(self.order):
+                self._replay(self.order[self.current])
+
+    def _replay(self, t):
+        for data in self.held.pop(t, ()):
+            self._feed(t, marshal.loads(data))
+
+    def finish(self):
+        '''
+        Write the ASes out, once every type is in. Returns the number of
+        handles resolved and missing.
+        '''
+        for t in self.order:
+            if t not in self.sealed:
+                self.seal(t)
+        stats = self.join.write(self.full_db_path, self.rir.expand_blocks)
+        logging.debug("Added as#s to full db.")
+        return stats
+
+
+class StreamingIndexedJoin(object):
+    '''
+    join.indexed_join fed straight from the parser. The org / contact records
+    go to their intermediate files, which serve as the handle index (and are
+    removed again at the end unless they're kept). Once they're all in, every
+    aut-num record is joined and appended to the full db as soon as it
+    arrives. The RIRs that publish a file per type parse their aut-nums last,
+    so all of their ASes are written out as they're parsed; for the others
+    (and with concurrent downloads) the ASes that come first wait for the
+    contacts.
+
+    The full db is identical to indexed_join's. The rare AS that turns up
+    twice is rewritten in place at the end, with its last record.
+    '''
+
+    def __init__(self, rir, out_folder, full_db, types, keep_intermediate=False):
+        self.rir = rir
+        self.out_folder = out_folder
+        self.full_db_path = "%s/%s" % (out_folder, full_db)
+        self.keep_intermediate = keep_intermediate
+        self.contact_types = [t for t in types if t != 'aut-num']
+        self.sealed = set()
+        self.written = set()
+        self.index = None
+        # AS records that arrived before the contacts were all in
+        self.pending = {}
+        # every asn written, with its (joined) object if it's a block
+        self.asns = {}
+        # the last record of each asn that turned up again after being written
+        self.replaced = {}
+        self.serializer = rir.get_serializer()
+        self.db = open(self.full_db_path, 'a+b')
+        self.start = self.db.tell()
+        self.out = self.serializer.writer(self.db)
+        self.count = 0
+        self._reset_lookups()
+
+    def _reset_lookups(self):
+        # What was found for each handle looked up so far (None if missing),
+        # the handles each found object refers to, and the fewest references
+        # between a handle and any AS, as resolve_handles counts its levels
+        self.objs = {}
+        self.refs = {}
+        self.depths = {}
+
+    def parse_order(self):
+        return self.contact_types + ['aut-num']
+
+    def writer(self, t):
+        if t == 'aut-num':
+            side = None
+            if self.keep_intermediate:
+                side = self.rir.intermediate_store().writer(self.rir.intm_path(self.out_folder, t), t)
+            return TypeSink(self, t, side)
+        self.written.add(t)
+        return TypeSink(self, t, self.rir.intermediate_store().writer(self.rir.intm_path(self.out_folder, t), t))
+
+    def load(self, t):
+        # A contact type's intermediate file already is what the index needs
+        if t == 'aut-num':
+            for record in self.rir.read_intermediate(self.out_folder, t):
+                self.add(t, record)
+        self.seal(t)
+
+    def add(self, t, record):
+        # The contacts only go to their files (see writer)
+        if t != 'aut-num':
+            return
+        if self.rir.is_other_org_entry(record):
+            return
+        if self.index is None:
+            self.pending[record['asn']] = record
+        else:
+            self._emit(record)
+
+    def seal(self, t):
+        self.sealed.add(t)
+        if self.index is None and all(c in self.sealed for c in self.contact_types):
+            self.index = HandleIndex(self.rir, self.out_folder, self.contact_types)
+            pending, self.pending = self.pending, {}
+            for record in pending.values():
+                self._emit(record)
+
+    def _lookup(self, handle):
+        if handle not in self.objs:
+            obj = self.index.get(handle)
+            self.objs[handle] = obj
+            if obj is not None:
+                self.refs[handle] = [h for h in dict.fromkeys(handle_refs(obj)) if h != handle]
+        return self.objs[handle]
+
+    def _handles(self, record):
+        '''
+        The objects reachable from the handles of record, breadth first as in
+        indexed_join, so an AS's own contacts come before the nested ones.
+        '''
+        handles = {}
+        seen = set()
+        depths = self.depths
+        level = list(dict.fromkeys(handle_refs(record)))
+        depth = 0
+        while level:
+            next_level = []
+            for h in level:
+                if h in seen:
+                    continue
+                seen.add(h)
+                if depth < depths.get(h, depth + 1):
+                    depths[h] = depth
+                obj = self._lookup(h)
+                if obj is None:
+                    continue
+                handles[h] = obj
+                next_level.extend(self.refs[h])
+            level = next_level
+            depth += 1
+        return handles
+
+    def _emit(self, record):
+        asn = record['asn']
+        if asn in self.asns:
+            # Already written; the last record wins, in the place of the first
+            self.replaced[asn] = record
+            return
+        record['handles'] = self._handles(record)
+        self.asns[asn] = record if block_range(record) is not None else None
+        self.out.write(record)
+        self.count += 1
+
+    def _rewrite(self):
+        # Swap the replaced ASes for their last records, working out which
+        # handles were reached all over again as those of the first records
+        # no longer count
+        self._reset_lookups()
+        self.out.flush()
+        self.db.flush()
+        self.db.seek(self.start)
+        tmp_path = self.full_db_path + ".rewrite"
+        loads = self.serializer.loads
+        with open(tmp_path, 'wb') as tmp:
+            for line in self.db:
+                record = loads(line)
+                asn = record['asn']
+                if asn in self.replaced:
+                    record = self.replaced[asn]
+                    record['handles'] = self._handles(record)
+                    self.asns[asn] = record if block_range(record) is not None else None
+                    line = self.serializer.encode(record)
+                else:
+                    self._handles(record)
+                tmp.write(line)
+        self.db.seek(self.start)
+        self.db.truncate()
+        with open(tmp_path, 'rb') as tmp:
+            shutil.copyfileobj(tmp, self.db)
+        os.remove(tmp_path)
+
+    def finish(self):
+        '''
+        Write out the ASes still waiting (if any) and the copies of the
+        blocks. Returns the number of handles resolved and missing, and how
+        many levels of references there were.
+        '''
+        for t in self.contact_types:
+            if t not in self.sealed:
+                self.seal(t)
+        rir = self.rir
+        try:
+            with rir.get_metrics().timer("write", rir=rir.NAME) as stage:
+                if self.replaced:
+                    self._rewrite()
+                if rir.expand_blocks:
+                    blocks = [r + (asn,) for asn, r in
+                              ((asn, block_range(obj)) for asn, obj in self.asns.items() if obj is not None)]
+                    for record in ASBlockIndex(blocks).expand(self.asns):
+                        self.out.write(record)
+                        self.count += 1
+                stage.add(records=self.count)
+        finally:
+            self.out.close()
+            if self.index is not None:
+                self.index.close()
+        if not self.keep_intermediate:
+            for t in self.written:
+                path = rir.intm_path(self.out_folder, t)
+                for p in (path, path + ".keys", path + ".idx"):
+                    if os.path.exists(p):
+                        os.remove(p)
+
+        found = sum(1 for obj in self.objs.values() if obj is not None)
+        stats = {"resolved": found, "missing": len(self.objs) - found,
+                 "depth": max(self.depths.values()) + 1 if self.depths else 0}
+        logging.debug("Added as#s to full db, resolved %(resolved)d handles (%(missing)d missing) "
+                      "in %(depth)d levels.", stats)
+        return stats
+
+
+JOINS = {
+    'memory': StreamingJoin,
+    'indexed': StreamingIndexedJoin,
+}
+
+
+def stream_to_full_db(rir, out_folder, full_db, types, other_types=()):
+    '''
+    See RIR.stream_to_full_db. Files are parsed in the order the join wants
+    its types in, and as construct_intermediate_jsons would (concurrently
+    downloaded, and with the types whose files haven't changed since their
+    intermediate file was kept taken from it instead).
+    '''
+    if rir.join_mode not in JOINS:
+        raise Exception("the streaming pipeline can't join in %s mode" % rir.join_mode)
+    join = JOINS[rir.join_mode](rir, out_folder, full_db, types, rir.keep_intermediate)
+    parsed = list(types) + [t for t in other_types if t not in types]
+
+    def kept(t):
+        # whether t's intermediate file is written (and so can be reused)
+        return rir.keep_intermediate or t not in types
+
+    def output(t):
+        if t in types:
+            return join.writer(t)
+        return rir.intermediate_store().writer(rir.intm_path(out_folder, t), t)
+
+    if rir.single_file():
+        out_paths = [rir.intm_path(out_folder, t) for t in parsed]
+        if all(kept(t) and rir.parse_is_cached(None, p) for t, p in zip(parsed, out_paths)):
+            logging.debug('db file is unchanged, keeping ' + ', '.join(out_paths))
+            for t in join.parse_order():
+                join.load(t)
+        else:
+            out_files = dict((t, output(t)) for t in parsed)
+            rir.write_intermediate(None, rir.wanted_types(parsed), out_files)
+            for f in out_files.values():
+                f.close()
+            for t, out_path in zip(parsed, out_paths):
+                if kept(t):
+                    rir.mark_parsed(None, out_path)
+    else:
+        def parse(t):
+            out_path = rir.intm_path(out_folder, t)
+            if kept(t) and rir.parse_is_cached(t, out_path):
+                logging.debug(t + ' is unchanged, keeping ' + out_path)
+                if t in types:
+                    join.load(t)
+                return
+            out = output(t)
+            rir.write_intermediate(t, rir.wanted_types([t]), {t: out})
+            out.close()
+            if kept(t):
+                rir.mark_parsed(t, out_path)
+
+        order = join.parse_order() + [t for t in parsed if t not in types]
+        if rir.fetch_concurrency > 1:
+            asyncio.run(fetch_concurrently(rir, order, rir.fetch_concurrency, parse))
+        else:
+            for t in order:
+                parse(t)
+    return join.finish()
@@ -32,10 +32,7 @@ class APNIC(FTPRIR):
         "rtr-set",
     }
 
-    def get_raw(self, name):
+    def remote_name(self, name):
         if name not in self.SUPPORTED_TYPES:
             raise Exception("invalid file type requested")
-        full_name = "%s.db.%s.gz" % (self.NAME, name)
-        return super(APNIC, self).get_raw(full_name)
-
-
+        return "%s.db.%s.gz" % (self.NAME, name)
@@ -31,21 +31,24 @@ class ARIN(RIR):
     SUPPORTED_TYPES = {
         "aut-num": "asns.txt",
         "organisation": "orgs.txt",
-        "person": "pocs.txt"
+        "person": "pocs.txt",
+        "inetnum": "nets.txt"
     }
 
     # Map the standard types to the ARIN record to request
     TYPE_TO_ARIN_RECORD = {
         "aut-num": "asns",
         "organisation": "orgs",
-        "person": "pocs"
+        "person": "pocs",
+        "inetnum": "nets"
     }
 
     # Map the standard types to ARIN's special names for them
     TYPE_MAP = {
         "aut-num": "ASHandle",
         "organisation": "OrgID",
-        "person": "POCHandle"
+        "person": "POCHandle",
+        "inetnum": "NetHandle"
     }
 
     # Maps the labels used by the individual RIR to a final standardized representation
@@ -54,6 +57,7 @@ class ARIN(RIR):
         "ASHandle": "asn",
         "POCHandle": "pochandle",
         "OrgID": "orghandle",
+        "NetHandle": "nethandle",
         # Assorted
         "ASName": "name",
         "ASNumber": "asblock",
@@ -75,45 +79,103 @@ class ARIN(RIR):
         "Mailbox": "e-mail",
         "OfficePhone": "phone",
         "Street": "address",
+        # Netblocks, of both address families
+        "NetRange": "inetnum",
+        "NetName": "netname",
+        "NetType": "status",
+        "Parent": "parent",
     }
 
     def __init__(self, api_key=None):
         self.api_key = api_key
 
-    def get_raw(self, name=None):
+    # When set, every type is read from the single combined bulkwhois archive
+    # (get_url(None)), which is only downloaded once, instead of from one
+    # archive per type
+    combined = False
+
+    def remote_url(self, name=None):
+        '''
+        Return the url of the zip for name, or of the combined archive for
+        None. fetch_concurrently groups the downloads by its host.
+        '''
+        if name is None:
+            return self.get_url(None)
         if name not in self.SUPPORTED_TYPES:
             raise Exception("invalid file type requested")
-         # Create a temporary directory
-        temp_dir = tempfile.mkdtemp()
-        zip_path = os.path.join(temp_dir, "arin_bulkwhois.zip")
+        return self.get_url(self.TYPE_TO_ARIN_RECORD[name])
 
-        url = self.get_url(self.TYPE_TO_ARIN_RECORD[name])
+    def fetch(self, name, dest, headers):
+        '''
+        Download the zip for name (the combined archive for None) to dest,
+        for RIR.download. Returns the response headers, or None when headers
+        made it a conditional request and the zip hasn't changed.
+        '''
+        url = self.remote_url(name)
         print(f"Downloading from {url} ...")
-        response = requests.get(url)
-        response.raise_for_status()  # raise exception if download failed
-
-        with open(zip_path, "wb") as f:
-            f.write(response.content)
-        # we'll need to download the zip file for the type, then extract it, and return the arin_db.txt
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(temp_dir)
-
-        extracted_path = os.path.join(temp_dir, "arin_db.txt")
-        renamed_path = os.path.join(temp_dir, f"{self.TYPE_TO_ARIN_RECORD[name]}.txt")
-
-        # Rename the extracted file
-        if os.path.exists(extracted_path):
-            os.rename(extracted_path, renamed_path)
-            print(f"Extracted and renamed file saved at: {renamed_path}")
-        else:
-            raise FileNotFoundError("arin_db.txt not found in the downloaded ZIP file")
+        # raises if the download failed. The zip is streamed to dest in chunks,
+        # so it's never held in memory.
+        return self.get_transport().download(url, dest, headers)
 
-        retv = tempfile.NamedTemporaryFile(delete=False)
-        with open(renamed_path, "rb") as f:
-            shutil.copyfileobj(f, retv)
-            retv.seek(0)
+    def db_member(self, zip_ref):
+        '''
+        The name of the db file inside a downloaded archive. The per type
+        archives hold a single arin_db.txt; otherwise take the largest file.
+        '''
+        names = zip_ref.namelist()
+        if "arin_db.txt" in names:
+            return "arin_db.txt"
+        return max(zip_ref.infolist(), key=lambda i: i.file_size).filename
+
+    def use_stream(self, name):
+        # ARIN's zips are always downloaded in full first (and may be kept in
+        # the cache), so "streaming" just reads the member straight out of the
+        # zip on disk. That's never worse than extracting and copying it, so
+        # it's done whether or not stream is set.
+        return True
+
+    def get_stream(self, name=None):
+        '''
+        Read the db file straight out of the downloaded archive, without
+        extracting or copying it.
+        '''
+        zip_ref = zipfile.ZipFile(self.download(name), "r")
+        return zip_ref.open(self.db_member(zip_ref))
+
+    def get_raw(self, name=None):
+        if name is not None and name not in self.SUPPORTED_TYPES:
+            raise Exception("invalid file type requested")
+         # Create a temporary directory
+        temp_dir = tempfile.mkdtemp()
+        zip_path = self.download(name)
+
+        with self.get_metrics().timer("decompress", rir=self.NAME, type=name or "all") as stage:
+            # we'll need to download the zip file for the type, then extract it, and return the arin_db.txt
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                member = self.db_member(zip_ref)
+                zip_ref.extract(member, temp_dir)
+
+            extracted_path = os.path.join(temp_dir, member)
+            renamed_path = os.path.join(temp_dir, f"{self.TYPE_TO_ARIN_RECORD.get(name, 'bulkwhois')}.txt")
+
+            # Rename the extracted file
+            if os.path.exists(extracted_path):
+                os.rename(extracted_path, renamed_path)
+                print(f"Extracted and renamed file saved at: {renamed_path}")
+            else:
+                raise FileNotFoundError(f"{member} not found in the downloaded ZIP file")
+
+            retv = tempfile.NamedTemporaryFile(delete=False)
+            with open(renamed_path, "rb") as f:
+                shutil.copyfileobj(f, retv)
+                stage.add(nbytes=retv.tell())
+                retv.seek(0)
         return retv
 
+    def single_file(self):
+        # With combined, everything is in one archive, so it's parsed once for
+        # all the types
+        return self.combined
 
     def is_other_org_entry(self, in_json):
         '''
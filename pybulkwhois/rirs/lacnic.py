@@ -25,9 +25,9 @@ class LACNIC(RIR):
         self.uid = uid
         self.pwd = pwd
 
-    def get_raw(self, name=None):
-        # we need a session
-        session = requests.session()
+    def get_download_url(self):
+        # we need a session (the transport's keeps the login cookies)
+        session = self.get_transport().session
         raw_login_page = session.get(self.BASE_URL)
         parsed_login_page = BeautifulSoup(raw_login_page.text, "html.parser")
         action = parsed_login_page.find('form').get('action')
@@ -38,16 +38,35 @@ class LACNIC(RIR):
         })
         logged_in_parsed = BeautifulSoup(logged_in_raw.text, "html.parser")
         dl_url = logged_in_parsed(text=re.compile('Bulk Whois'))[0].parent.get("href")
-        full_dl_url = "https://lacnic.net" + dl_url
-        retv = tempfile.NamedTemporaryFile(delete=False)
-        with closing(urllib2.urlopen(full_dl_url)) as f:
-            shutil.copyfileobj(f, retv)
-        retv.seek(0)
-        return retv
-
-    def construct_intermediate_jsons(self, out_folder, types):
-        # Overridden to call the one-file version of construct_intermediate_jsons.
-        super(LACNIC, self).construct_intermediate_jsons_one_file(out_folder, types)
+        return "https://lacnic.net" + dl_url
+
+    def remote_url(self, name=None):
+        '''
+        Return the host's url, which is all fetch_concurrently needs: the
+        actual download url is only known after logging in, but it's on the
+        same host.
+        '''
+        return self.BASE_URL
+
+    def get_stream(self, name=None):
+        # LACNIC's bulk file isn't compressed, so we can parse the response as is
+        return self.get_transport().open(self.get_download_url())
+
+    def fetch(self, name, dest, headers):
+        '''
+        Log in and download the bulk file to dest, for RIR.download. There's
+        only the one file, whatever name is. Returns the response headers,
+        or None if the server answered 304 to the conditional headers.
+        '''
+        return self.get_transport().download(self.get_download_url(), dest, headers)
+
+    def get_raw(self, name=None):
+        return open(self.download(name), 'rb')
+
+    def single_file(self):
+        # Everything is in the one file, so it's parsed once for all the types
+        # (see construct_intermediate_jsons_one_file)
+        return True
 
 if __name__ == '__main__':
     print("Running lacnic.py")
@@ -35,8 +35,7 @@ class RIPE(FTPRIR):
     RIPE_CRUFT     = "****************************\n* THIS OBJECT IS MODIFIED\n* Please note that all data that is generally regarded as personal\n* data has been removed from this object.\n* To view the original object, please query the RIPE Database at:\n* http://www.ripe.net/whois\n****************************"
     IGNORED_VALUES = ["DUMY-RIPE", RIPE_CRUFT]
 
-    def get_raw(self, name):
+    def remote_name(self, name):
         if name not in self.SUPPORTED_TYPES:
             raise Exception("invalid file type requested")
-        full_name = "ripe.db.%s.gz" % name
-        return super(RIPE, self).get_raw(full_name)
+        return "ripe.db.%s.gz" % name
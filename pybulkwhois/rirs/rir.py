@@ -1,15 +1,40 @@
+import asyncio
+import collections
+import concurrent.futures
+import io
 import logging
-import urllib.request as request
+import os
 import shutil
 import tempfile
 import gzip
-import json
-from contextlib import closing
 
-from ..file import BulkWHOISFile
+from ..entry import BulkWHOISEntry, CruftFilter, KeyTable
+from ..fetch import fetch_concurrently
+from ..join import MemoryJoin, indexed_join, sqlite_join
+from ..metrics import default_metrics
+from ..nets import write_nets
+from ..pipeline import stream_to_full_db
+from ..routes import write_routes
+from ..serialize import default_serializer
+from ..file import BulkWHOISFile, record_ranges, scan_records
+from ..store import STORES, export_jsonl
+from ..transport import default_transport
 
 ENCODING = 'utf-8'
 
+# Upper bound on the size of the byte ranges handed to each parse worker
+PARSE_RANGE_SIZE = 64 * 1024 * 1024
+
+
+def standard_asn(asn):
+    # If the "as" is lowercase, convert it to uppercase. Otherwise, if it
+    # isn't there add it on
+    asn = asn.upper()
+    if not asn.startswith('AS'):
+        asn = 'AS' + asn
+    return asn
+
+
 class RIR(object):
     IGNORED_KEYS   = []
     IGNORED_VALUES = []
@@ -22,8 +47,178 @@ class RIR(object):
     # representation
     STANDARD_KEY_MAP  = {}
 
+    # Applied to the values of these standard keys, to handle some weird case
+    # nonsense
+    VALUE_FIXUPS = {
+        "asn": standard_asn,
+        "source": str.upper,
+    }
+
+    # The encoding of the RIR's db files. Several of them contain Latin American
+    # names which aren't valid utf-8, so by default everything is read as latin-1.
+    FILE_ENCODING = 'latin-1'
+
+    # When set, get() splits records with the buffered byte level scanner
+    # rather than line by line
+    chunked = False
+
+    # When set, entries are parsed straight into standard form with the RIR's
+    # KeyTable (see key_table), instead of into labeled dicts that
+    # convert_to_standard_form then walks again. The result is the same.
+    fused_parse = False
+
+    # Format of the intermediate files, a key of store.STORES
+    intermediate_format = 'jsonl'
+
+    # How add_to_full_db joins the contacts onto the ASes: 'memory' keeps
+    # everything in dicts, 'sqlite' stages it in an on-disk database whose page
+    # cache is capped at join_memory_mb (see join.sqlite_join), 'indexed'
+    # follows references between contacts as well (see join.indexed_join)
+    join_mode = 'memory'
+    join_memory_mb = 256
+
+    # When False, an AS block is written to the full db once, as its own
+    # object, rather than also once for every asn in it (asblocks.ASBlockIndex
+    # resolves the asns inside blocks)
+    expand_blocks = True
+
+    # Number of processes used to parse a single db file. Above 1, the file is
+    # downloaded and split into record aligned byte ranges (see
+    # write_intermediate_parallel).
+    parse_workers = 1
+
+    # When set, get() parses straight from the download rather than from a
+    # local copy of it (see get_stream)
+    stream = False
+
+    # A DownloadCache. When set, files are only downloaded again if the RIR has
+    # published a new version, and intermediate jsons built from a file that
+    # hasn't changed are reused. Downloads then always go to disk, so stream
+    # is ignored.
+    cache = None
+
+    # The Transport used for downloads. Shares the process wide default (and so
+    # its connection pools) unless set.
+    transport = None
+
+    # Above 1, construct_intermediate_jsons downloads all of the requested
+    # types at once (at most this many per host) and parses each as it arrives
+    fetch_concurrency = 1
+
+    # The metrics.Metrics the stages are timed and counted in. Shares the
+    # process wide default unless set.
+    metrics = None
+
+    # The serialize.Serializer that intermediate files and the full db are
+    # written and read with. Shares the process wide default unless set.
+    serializer = None
+
+    # Whether stream_to_full_db (the single pass pipeline, see pipeline.py)
+    # also writes the intermediate files of the types it joins. The other
+    # types it parses (e.g. netblocks) always get theirs.
+    keep_intermediate = False
+
+    def get_transport(self):
+        return self.transport or default_transport()
+
+    def get_metrics(self):
+        return self.metrics or default_metrics()
+
+    def get_serializer(self):
+        return self.serializer or default_serializer()
+
+    @property
+    def _downloads(self):
+        # The local copies download has made, by name. Created on first use,
+        # as the RIRs' constructors don't call this class's.
+        try:
+            return self._download_paths
+        except AttributeError:
+            self._download_paths = {}
+            return self._download_paths
+
+    def use_stream(self, name):
+        '''
+        Whether get() should parse name from get_stream rather than get_raw.
+        '''
+        # Stream unless we already have (or are keeping) a local copy of the file
+        return self.stream and self.cache is None and name not in self._downloads
+
     def get(self, name=None):
-        return BulkWHOISFile(self.get_raw(name), self.IGNORED_KEYS, self.IGNORED_VALUES)
+        if self.use_stream(name):
+            raw = self.get_stream(name)
+        else:
+            raw = self.get_raw(name)
+        return BulkWHOISFile(raw, self.IGNORED_KEYS, self.IGNORED_VALUES,
+                             chunked=self.chunked, encoding=self.FILE_ENCODING)
+
+    def get_stream(self, name=None):
+        '''
+        Return a readable, possibly unseekable, file object over the
+        uncompressed db file so that it can be parsed while it downloads.
+        RIRs that can't stream fall back to the temporary file from get_raw.
+        '''
+        return self.get_raw(name)
+
+    def download(self, name=None):
+        '''
+        Return the path of a local copy of the file the RIR publishes for name.
+        Each file is only fetched once per RIR object, and with a cache only if
+        it changed since the last run. The download itself is the subclass's
+        fetch(name, dest, headers) (see FTPRIR, ARIN and LACNIC).
+        '''
+        downloads = self._downloads
+        if name in downloads:
+            return downloads[name]
+        metrics = self.get_metrics()
+        with metrics.timer("download", rir=self.NAME, type=name or "all") as stage:
+            if self.cache is None:
+                dest = tempfile.NamedTemporaryFile(delete=False)
+                dest.close()
+                self.fetch(name, dest.name, {})
+                downloads[name] = dest.name
+                stage.add(nbytes=os.path.getsize(dest.name))
+                return dest.name
+            key = self.cache.key(self.NAME, name)
+            partial = self.cache.partial_path(key)
+            headers = self.fetch(name, partial, self.cache.conditional_headers(key))
+            if headers is None:
+                logging.debug("%s hasn't changed, using the cached copy", key)
+                downloads[name] = self.cache.path(key)
+                metrics.count("cache_hits", rir=self.NAME)
+            else:
+                downloads[name] = self.cache.store(key, partial, headers)
+                stage.add(nbytes=os.path.getsize(downloads[name]))
+            return downloads[name]
+
+    def parse_is_cached(self, name, out_path):
+        '''
+        True if out_path was already built from the current version of the
+        file for name. Downloads the file (conditionally) if necessary.
+        '''
+        if self.cache is None:
+            return False
+        self.download(name)
+        return self.cache.is_parsed(self.cache.key(self.NAME, name), out_path, self.parse_settings(),
+                                    self.intermediate_store().SIDECARS)
+
+    def mark_parsed(self, name, out_path):
+        if self.cache is not None:
+            self.cache.mark_parsed(self.cache.key(self.NAME, name), out_path, self.parse_settings())
+
+    def parse_settings(self):
+        '''
+        The options that change what an intermediate file holds or how it's
+        encoded. They're recorded with it in the cache, so a file written
+        with different ones isn't reused.
+        '''
+        serializer = self.get_serializer()
+        settings = {"format": self.intermediate_format, "fused_parse": self.fused_parse,
+                    "json_compat": serializer.compat}
+        # With compat, every backend writes the same bytes
+        if not serializer.compat:
+            settings["json_backend"] = serializer.backend
+        return settings
 
     def intm_json_path(self, out_folder, t):
         '''
@@ -31,24 +226,71 @@ class RIR(object):
         '''
         return "%s/intm/%s_%s.json" % (out_folder, self.NAME, t)
 
+    def intermediate_store(self):
+        return STORES[self.intermediate_format](self.get_serializer())
+
+    def intm_path(self, out_folder, t):
+        '''
+        Return the path of the intermediate file for this type, in the
+        configured intermediate format.
+        '''
+        return "%s/intm/%s_%s%s" % (out_folder, self.NAME, t, self.intermediate_store().EXTENSION)
+
+    def read_intermediate(self, out_folder, t):
+        '''
+        Return a reader over the intermediate records of this type.
+        '''
+        return self.intermediate_store().reader(self.intm_path(out_folder, t))
+
+    def export_intermediate_jsons(self, out_folder, types):
+        '''
+        Write binary intermediate files out as json lines as well, next to them.
+        '''
+        if self.intermediate_format == 'jsonl':
+            return
+        for t in types:
+            export_jsonl(self.intm_path(out_folder, t), self.intm_json_path(out_folder, t), self.get_serializer())
+
+    def single_file(self):
+        '''
+        Whether the RIR publishes all of its records in a single db file,
+        rather than one file per type.
+        '''
+        return False
+
     def construct_intermediate_jsons(self, out_folder, types):
         '''
         Fetch the db files from the RIR and parse them into well-structured json
         files in the out_folder. types specifies which files to grab. Constructs
         one json file per type in the types list.
         '''
-        for t in types:
-            t_file = self.get(t)
-            out_path = self.intm_json_path(out_folder, t)
-            with open(out_path, 'w+', encoding=ENCODING) as out:
-                for entry in t_file:
-                    # Only write out objects with matching types - some of the RIRs
-                    # include dummy objects/other info in these files.
-                    if entry.type == t or (t in self.TYPE_MAP and entry.type == self.TYPE_MAP[t]):
-                        # Convert to standard form before writing out.
-                        out_json = self.convert_to_standard_form(entry.labeled)
-                        out.write(json.dumps(out_json, ensure_ascii = False) + "\n")
-            logging.debug('Wrote out ' + t + ' objects to ' + out_path)
+        if self.single_file():
+            self.construct_intermediate_jsons_one_file(out_folder, types)
+            return
+        with self.get_metrics().timer("intermediate", rir=self.NAME):
+            if self.fetch_concurrency > 1:
+                # Download every type at once, and parse each as soon as it lands
+                asyncio.run(fetch_concurrently(
+                    self, types, self.fetch_concurrency,
+                    lambda t: self.construct_intermediate_json(out_folder, t)))
+                return
+            for t in types:
+                self.construct_intermediate_json(out_folder, t)
+
+    def construct_intermediate_json(self, out_folder, t):
+        '''
+        Fetch and parse the db file for the single type t.
+        '''
+        out_path = self.intm_path(out_folder, t)
+        if self.parse_is_cached(t, out_path):
+            logging.debug(t + ' is unchanged, keeping ' + out_path)
+            return
+        # Only write out objects with matching types - some of the RIRs
+        # include dummy objects/other info in these files.
+        with self.intermediate_store().writer(out_path, t) as out:
+            self.write_intermediate(t, self.wanted_types([t]), {t: out})
+        self.mark_parsed(t, out_path)
+        logging.debug('Wrote out ' + t + ' objects to ' + out_path)
 
     def construct_intermediate_jsons_one_file(self, out_folder, types):
         '''
@@ -57,19 +299,113 @@ class RIR(object):
         well-structured json files in the out_folder. Constructs one json file per type in
         the types list.
         '''
-        out_files = {}
+        with self.get_metrics().timer("intermediate", rir=self.NAME):
+            out_paths = [self.intm_path(out_folder, t) for t in types]
+            if all(self.parse_is_cached(None, p) for p in out_paths):
+                logging.debug('db file is unchanged, keeping ' + ', '.join(out_paths))
+                return
+            out_files = {}
+            for t, out_path in zip(types, out_paths):
+                out_files[t] = self.intermediate_store().writer(out_path, t)
+            # afrinic and lacnic put all their data in one file, so we don't need to give it a specific type
+            self.write_intermediate(None, self.wanted_types(types), out_files)
+            for t, f in out_files.items():
+                f.close()
+            for out_path in out_paths:
+                self.mark_parsed(None, out_path)
+
+    def wanted_types(self, types):
+        '''
+        Map the entry types to keep (including the RIR's own names for them,
+        see TYPE_MAP) to the type they should be written out as.
+        '''
+        wanted = {}
         for t in types:
-            out_path = self.intm_json_path(out_folder, t)
-            out_files[t] = open(out_path, 'w+', encoding=ENCODING)
-        # afrinic and lacnic put all their data in one file, so we don't need to give it a specific type
-        db_file = self.get()
-        for entry in db_file:
-            if entry.type in types:
-                # convert to standard form
-                out_json = self.convert_to_standard_form(entry.labeled)
-                out_files[entry.type].write(json.dumps(out_json, ensure_ascii = False) + "\n")
-        for t, f in out_files.items():
-            f.close()
+            wanted[t] = t
+            if t in self.TYPE_MAP:
+                wanted[self.TYPE_MAP[t]] = t
+        return wanted
+
+    def write_intermediate(self, name, wanted, out_files):
+        '''
+        Parse the db file for name and write every entry whose type is a key of
+        wanted, in standard form, to out_files[wanted[entry.type]].
+        '''
+        metrics = self.get_metrics()
+        if self.parse_workers > 1:
+            seen, written = self.write_intermediate_parallel(name, wanted, out_files)
+        else:
+            db_file = self.get(name)
+            with metrics.timer("parse", rir=self.NAME, type=name or "all") as stage:
+                seen, written = self.write_entries(db_file, wanted, out_files)
+                stage.add(seen, _position(db_file.f))
+        for t, n in written.items():
+            metrics.count("records_written", n, rir=self.NAME, type=t)
+
+    def write_entries(self, entries, wanted, out_files):
+        '''
+        Write the wanted entries out. Returns the number of entries seen and
+        the number written of each type.
+        '''
+        seen = 0
+        written = collections.Counter()
+        keys = self.key_table() if self.fused_parse else None
+        for entry in entries:
+            seen += 1
+            t = wanted.get(entry.type)
+            if t is not None:
+                # Convert to standard form before writing out.
+                if keys is not None:
+                    out_json = entry.standard(keys)
+                else:
+                    out_json = self.convert_to_standard_form(entry.labeled)
+                out_files[t].write(out_json)
+                written[t] += 1
+        return seen, written
+
+    def write_intermediate_parallel(self, name, wanted, out_files):
+        '''
+        Parallel version of write_intermediate. The uncompressed db file is split
+        into byte ranges on record boundaries, each range is parsed and converted
+        in a worker process, and the per range output is written out in order,
+        so the result is identical to the serial path. Returns the number of
+        entries seen and written, as write_entries does.
+        '''
+        raw = self.get_raw(name)
+        raw.seek(0, 2)
+        size = raw.tell()
+        range_size = max(1, min(PARSE_RANGE_SIZE, -(-size // self.parse_workers)))
+        ranges = record_ranges(raw, range_size)
+        raw.close()
+        logging.debug("parsing %s in %d ranges with %d workers", raw.name, len(ranges), self.parse_workers)
+
+        # What the workers collect each type's output in: serialized for the
+        # intermediate files, but outputs that want the records themselves
+        # (e.g. the streaming join) say so with a buffer of their own
+        store = self.intermediate_store()
+        buffers = dict((t, getattr(out, 'buffer', store.buffer)) for t, out in out_files.items())
+
+        counts = [0, collections.Counter()]
+        with self.get_metrics().timer("parse", rir=self.NAME, type=name or "all") as stage, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            # Keep a bounded number of ranges in flight so finished output
+            # doesn't pile up in memory waiting for an earlier range.
+            pending = collections.deque()
+            for start, end in ranges:
+                pending.append(pool.submit(_parse_range, self, raw.name, start, end, wanted, buffers))
+                if len(pending) >= 2 * self.parse_workers:
+                    self._write_parsed_range(pending.popleft().result(), out_files, counts)
+            while pending:
+                self._write_parsed_range(pending.popleft().result(), out_files, counts)
+            stage.add(counts[0], size)
+        return counts[0], counts[1]
+
+    def _write_parsed_range(self, parsed, out_files, counts):
+        out, seen, written = parsed
+        for t, value in out.items():
+            out_files[t].write_buffered(value)
+        counts[0] += seen
+        counts[1].update(written)
 
     def is_other_org_entry(self, in_json):
         '''
@@ -78,6 +414,15 @@ class RIR(object):
         '''
         return False
 
+    def key_table(self):
+        '''
+        The entry.KeyTable that does what convert_to_standard_form does, for
+        parsing entries straight into standard form. Compiled once per RIR
+        class (and process).
+        '''
+        return KeyTable.get(tuple(self.IGNORED_KEYS), tuple(self.STANDARD_KEY_MAP.items()),
+                            tuple(self.VALUE_FIXUPS.items()))
+
     def convert_to_standard_form(self, in_json):
         '''
         Takes in one of the intermediate jsons and converts it to our standardized
@@ -99,57 +444,58 @@ class RIR(object):
 
             out_json[new_k] = v
 
-        # Handle some weird case nonsense
-        if 'asn' in out_json:
-            # If the "as" is lowercase, convert it to uppercase
-            out_json['asn'] = out_json['asn'].upper()
-            if not out_json['asn'].startswith('AS'):
-            # Otherwise, if it isn't there add it on
-                out_json['asn'] = 'AS' + out_json['asn']
-                
-        if 'source' in out_json:
-            out_json['source'] = out_json['source'].upper()
+        for k, fixup in self.VALUE_FIXUPS.items():
+            if k in out_json:
+                out_json[k] = fixup(out_json[k])
 
         return out_json
 
     def add_to_full_db(self, out_folder, full_db, types):
+        '''
+        Join the org / contact objects onto the ASes and append them to the
+        full db file, in the configured join_mode. Returns the number of
+        handles the join resolved and the number missing.
+        '''
+        metrics = self.get_metrics()
+        with metrics.timer("join", rir=self.NAME):
+            if self.join_mode == 'sqlite':
+                stats = sqlite_join(self, out_folder, full_db, types, self.join_memory_mb, self.expand_blocks)
+            elif self.join_mode == 'indexed':
+                stats = indexed_join(self, out_folder, full_db, types, self.expand_blocks)
+            else:
+                stats = self.join_in_memory(out_folder, full_db, types)
+        metrics.count("handles_resolved", stats["resolved"], rir=self.NAME)
+        metrics.count("handles_unresolved", stats["missing"], rir=self.NAME)
+        return stats
+
+    def stream_to_full_db(self, out_folder, full_db, types, other_types=()):
+        '''
+        construct_intermediate_jsons and add_to_full_db in a single pass: the
+        records of types go straight from the parser into the join, in the
+        configured join_mode ('memory' or 'indexed'), and the joined ASes into
+        full_db, without the intermediate files in between (unless
+        keep_intermediate is set). other_types only get their intermediate
+        files, as construct_intermediate_jsons would write them. Returns the
+        number of handles resolved and missing.
+        '''
+        metrics = self.get_metrics()
+        with metrics.timer("pipeline", rir=self.NAME):
+            stats = stream_to_full_db(self, out_folder, full_db, types, other_types)
+        metrics.count("handles_resolved", stats["resolved"], rir=self.NAME)
+        metrics.count("handles_unresolved", stats["missing"], rir=self.NAME)
+        return stats
+
+    def join_in_memory(self, out_folder, full_db, types):
         '''
         Iterate over the parsed jsons in RIR_aut-num.json and convert them to a
         standardized format, then append them (if they aren't duplicates) to the
         full db file.
         '''
         full_db_path = "%s/%s" % (out_folder, full_db)
-        as_path = self.intm_json_path(out_folder, 'aut-num')
-
-        # map from asns to their objects
-        asn_objs = {}
-        # map from org/contact handles to a list of asns that contain them
-        handles_to_asns = {}
-
-        with open(as_path, 'r', encoding=ENCODING) as ans:
-            for l in ans:
-                out_json = json.loads(l)
-
-                # Make sure not to add duplicates.
-                if self.is_other_org_entry(out_json):
-                    continue
-
-                # Check for contact / org object references
-                for k, v in out_json.items():
-                    if 'handle' in k or '-c' in k:
-                        # There can be multiple contacts listed! They were joined
-                        # by '\n' in the intake process
-                        cs = v.split('\n')
-                        for v in cs:
-                            if not v in handles_to_asns:
-                                handles_to_asns[v] = set()
-                            handles_to_asns[v].add(out_json['asn'])
-
-                # add space for the eventual contact/org objects
-                out_json['handles'] = {}
-
-                # add to our list to eventually write out
-                asn_objs[out_json['asn']] = out_json
+        join = MemoryJoin(self)
+
+        for out_json in self.read_intermediate(out_folder, 'aut-num'):
+            join.add_asn(out_json)
 
         # Now we'll loop over the other intermediate jsons for this RIR to see if
         # any of the orgs/contacts are relevant
@@ -157,61 +503,26 @@ class RIR(object):
             # no need to process aut-num again
             if t == 'aut-num':
                 continue
-            int_path = self.intm_json_path(out_folder, t)
-            with open(int_path, 'r', encoding=ENCODING) as ij:
-                for l in ij:
-                    out_json = json.loads(l)
-                    org_pocs = set()
-
-                    if t == 'organisation':
-                        handle = out_json['orghandle']
-
-                        # Check for contact / org object references in the orgs
-                        # so that we can catch them when we go through the people/roles
-                        for k, v in out_json.items():
-                            if 'handle' in k or '-c' in k:
-                                for v in v.split('\n'):
-                                    org_pocs.add(v)
-
-                    elif t == 'person' or t == 'role':
-                        if 'pochandle' in out_json:
-                            handle = out_json['pochandle']
-
-                    # If we noted that we cared about this handle, then loop over
-                    # all the asns it was relevant to and add this object to their set
-                    # of handles.
-                    if handle in handles_to_asns:
-                        for asn in handles_to_asns[handle]:
-                            asn_objs[asn]['handles'][handle] = out_json
-                            # Add this asn to the to process list for any nested contacts we discovered
-                            for p in org_pocs:
-                                if p not in handles_to_asns:
-                                    handles_to_asns[p] = set()
-                                handles_to_asns[p].add(asn)
-
-        # If any of these ASes represent blocks, duplicate them.
-        for asn in list(asn_objs.keys()).copy():
-            obj = asn_objs[asn]
-            if 'asblock' in obj:
-                parts = obj['asblock'].split('-')
-                # If the asnumber was a range, duplicate this object for each as in the range
-                # that we don't have a different entry for. 
-                if len(parts) == 2:
-                    as_range = ["AS" + str(i) for i in range(int(parts[0]), int(parts[1]) + 1)]
-                    # If there are more than 10,000 ASes in this block, it's probably not a real 
-                    # block of ASes. 
-                    if len(as_range) > 10000:
-                        continue
-                    for new_asn in as_range:
-                        if not new_asn in asn_objs:
-                            asn_objs[new_asn] = obj.copy()
-                            asn_objs[new_asn]["asn"] = new_asn
-
-        # Finally, write out all of the asn objects to the full db file.
-        with open(full_db_path, 'a+', encoding=ENCODING) as db:
-            for out_json in asn_objs.values():
-                db.write(json.dumps(out_json, ensure_ascii=False) + "\n")
+            for out_json in self.read_intermediate(out_folder, t):
+                join.add_contact(t, out_json)
+
+        stats = join.write(full_db_path, self.expand_blocks)
         logging.debug("Added as#s to full db.")
+        return stats
+
+    def add_to_nets_db(self, out_folder, nets_db, types):
+        '''
+        Append the netblocks among types (see nets.NET_TYPES) to the nets db
+        file, with the organisations they refer to.
+        '''
+        write_nets(self, out_folder, nets_db, types)
+
+    def add_to_route_table(self, out_folder, table, types):
+        '''
+        Write the route objects among types (see routes.ROUTE_TYPES) to a
+        route table file.
+        '''
+        write_routes(self, out_folder, table, types)
 
 class FTPRIR(RIR):
     BASE_URL        = None
@@ -240,29 +551,82 @@ class FTPRIR(RIR):
     def make_path(self, name):
         return "%s/%s" % (self._base_url, name)
 
-    def get_raw(self, name):
-        retv = tempfile.NamedTemporaryFile(delete=False)
-        gzipped = tempfile.NamedTemporaryFile(delete=False)
-        path = self.make_path(name)
+    def remote_name(self, name):
+        '''
+        Overridden by each FTP RIR to map a type to the name of the gzipped
+        file it publishes it in.
+        '''
+        return name
 
-        # Some of the FTP RIR systems require a login, so we'll open them all through
-        # a password manager
-        pwd_mgr = request.HTTPPasswordMgrWithDefaultRealm()
+    def auth(self):
+        # Some of the FTP RIR systems require a login
         if self._uid:
-            pwd_mgr.add_password(None, self._base_url, self._uid, self._pwd)
-        handler = request.HTTPBasicAuthHandler(pwd_mgr)
-        opener = request.build_opener(handler)
-        opener.open(path)
-        request.install_opener(opener)
+            return (self._uid, self._pwd)
+        return None
 
+    def remote_url(self, name=None):
+        '''
+        Return the url the file for name is published at.
+        fetch_concurrently groups the downloads by its host.
+        '''
+        return self.make_path(self.remote_name(name))
+
+    def get_stream(self, name=None):
+        '''
+        Decompress the db file straight off of the HTTP response, so that the
+        download, gunzip and parse all happen in a single pass with nothing
+        written to disk.
+        '''
+        path = self.remote_url(name)
+        logging.debug("will attempt to stream %s", path)
+        return gzip.GzipFile(fileobj=self.get_transport().open(path, auth=self.auth()))
+
+    def fetch(self, name, dest, headers):
+        '''
+        Download the gzipped file for name, as is, to the path dest, sending
+        the extra request headers (e.g. the cache's conditional ones). Returns
+        the response headers, or None if the server answered 304 Not
+        Modified. RIR.download relies on this.
+        '''
+        path = self.remote_url(name)
         logging.debug("will attempt to download %s", path)
-        with closing(request.urlopen(path)) as f:
-            shutil.copyfileobj(f, gzipped)
-        gzipped.close()
-        logging.debug("gzipped content downloaded to %s", gzipped.name)
-        with gzip.open(gzipped.name) as g:
-            shutil.copyfileobj(g, retv)
+        retv = self.get_transport().download(path, dest, headers, auth=self.auth())
+        logging.debug("gzipped content downloaded to %s", dest)
+        return retv
+
+    def get_raw(self, name=None):
+        retv = tempfile.NamedTemporaryFile(delete=False)
+        gzipped = self.download(name)
+        with self.get_metrics().timer("decompress", rir=self.NAME, type=name or "all") as stage:
+            with gzip.open(gzipped) as g:
+                shutil.copyfileobj(g, retv)
+            stage.add(nbytes=retv.tell())
         logging.debug("uncompressed content saved to %s", retv.name)
         return retv
 
 
+def _parse_range(rir, path, start, end, wanted, buffers):
+    '''
+    Worker for RIR.write_intermediate_parallel: parse the records in
+    [start, end) of path and return the output for each type, collected in a
+    buffer made by buffers[type].
+    '''
+    out_files = {t: buffers[t]() for t in set(wanted.values())}
+    cruft = CruftFilter.get(tuple(rir.IGNORED_KEYS), tuple(rir.IGNORED_VALUES))
+    with open(path, 'rb') as f:
+        f.seek(start)
+        entries = (BulkWHOISEntry(lines, rir.IGNORED_KEYS, rir.IGNORED_VALUES, cruft)
+                   for lines in scan_records(f, rir.FILE_ENCODING, limit=end - start))
+        seen, written = rir.write_entries(entries, wanted, out_files)
+    return {t: out.getvalue() for t, out in out_files.items()}, seen, written
+
+
+def _position(f):
+    '''
+    How far into f parsing got (the size of the db file, once it's all been
+    parsed), or 0 for streams that can't tell.
+    '''
+    try:
+        return f.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return 0
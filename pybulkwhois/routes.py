@@ -0,0 +1,317 @@
+import argparse
+import array
+import bisect
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .dbindex import DBReader, asn_number
+
+ENCODING = 'utf-8'
+
+# The standard types of route objects, and the key holding the prefix
+ROUTE_TYPES = ['route', 'route6']
+
+ROUTE_MAGIC = b"PBWR\x01" + (b"l" if sys.byteorder == "little" else b"b")
+ROUTE_HEADER = struct.Struct("=6s2xQQQ")
+
+# The columns of each address family, in the order they're stored: name,
+# array typecode (or the width of the big endian addresses) and numpy dtype
+V4_COLUMNS = [("network", 'I', 'u4'), ("origin", 'I', 'u4'), ("source", 'H', 'u2'), ("length", 'B', 'u1')]
+V6_COLUMNS = [("network", 16, 'S16'), ("origin", 'I', 'u4'), ("source", 'H', 'u2'), ("length", 'B', 'u1')]
+
+
+def parse_prefix(value):
+    '''
+    Parse a route prefix into (version, network, length), with the network
+    as an integer. Takes LACNIC's abbreviated IPv4 prefixes too. Returns None
+    if value isn't a prefix.
+    '''
+    value = value.split('\n')[0].strip()
+    network, sep, length = value.partition('/')
+    if not sep:
+        return None
+    if ':' not in network:
+        network = '.'.join((network.split('.') + ['0', '0', '0'])[:4])
+    try:
+        net = ipaddress.ip_network("%s/%s" % (network, length.strip()), strict=False)
+    except ValueError:
+        return None
+    return net.version, int(net.network_address), net.prefixlen
+
+
+def route_rows(records):
+    '''
+    Generate the (version, network, length, origin, source) of every route
+    object among records whose prefix and origin can be parsed.
+    '''
+    for record in records:
+        prefix = record.get('route', record.get('route6'))
+        if prefix is None:
+            continue
+        parsed = parse_prefix(prefix)
+        origin = asn_number(record.get('origin', '').split('\n')[0].strip())
+        if parsed is None or origin is None:
+            continue
+        yield parsed + (origin, record.get('source', ''))
+
+
+def _pad(out, n):
+    out.write(b"\0" * (-n % 8))
+
+
+def _column_size(typecode, n):
+    # The bytes a column of n values takes up, padding included
+    size = n * (16 if typecode == 16 else array.array(typecode).itemsize)
+    return size + (-size % 8)
+
+
+def write_route_table(path, rows):
+    '''
+    Write rows (see route_rows) out as a route table: per address family,
+    column arrays sorted by (network, length), then a json trailer with the
+    names of the sources (stored in the rows as indexes into it) and the
+    prefix lengths in use. Returns the number of routes written.
+    '''
+    sources = []
+    source_ids = {}
+    families = {4: [], 6: []}
+    for version, network, length, origin, source in rows:
+        i = source_ids.get(source)
+        if i is None:
+            i = source_ids[source] = len(sources)
+            sources.append(source)
+        families[version].append((network, length, origin, i))
+    for routes in families.values():
+        routes.sort()
+
+    trailer = json.dumps({
+        "sources": sources,
+        "lengths": {str(v): sorted(set(r[1] for r in routes)) for v, routes in families.items()},
+    }).encode(ENCODING)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as out:
+        out.write(ROUTE_HEADER.pack(ROUTE_MAGIC, len(families[4]), len(families[6]), len(trailer)))
+        for version, columns in ((4, V4_COLUMNS), (6, V6_COLUMNS)):
+            routes = families[version]
+            values = {
+                "network": [r[0] for r in routes],
+                "length": [r[1] for r in routes],
+                "origin": [r[2] for r in routes],
+                "source": [r[3] for r in routes],
+            }
+            for name, typecode, _ in columns:
+                if typecode == 16:
+                    data = b"".join(n.to_bytes(16, 'big') for n in values[name])
+                else:
+                    data = array.array(typecode, values[name]).tobytes()
+                out.write(data)
+                _pad(out, len(data))
+        out.write(trailer)
+    os.replace(tmp_path, path)
+    return len(families[4]) + len(families[6])
+
+
+def write_routes(rir, out_folder, table, types):
+    '''
+    Write the route objects of an RIR (the ROUTE_TYPES among types) to the
+    route table file table in out_folder.
+    '''
+    records = (record for t in types if t in ROUTE_TYPES
+               for record in rir.read_intermediate(out_folder, t))
+    count = write_route_table("%s/%s" % (out_folder, table), route_rows(records))
+    logging.debug("Added %d routes to %s.", count, table)
+
+
+def merge_route_tables(out_path, paths):
+    '''
+    Combine route tables (e.g. one per RIR) into one.
+    '''
+    def rows():
+        for path in paths:
+            with RouteTable(path) as table:
+                yield from table.rows()
+    count = write_route_table(out_path, rows())
+    logging.debug("Merged %d routes into %s.", count, out_path)
+
+
+class _Addresses16(object):
+    # A sequence of 16 byte addresses in a buffer, for bisect
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // 16
+
+    def __getitem__(self, i):
+        return int.from_bytes(self.view[16 * i:16 * i + 16], 'big')
+
+
+class RouteTable(object):
+    '''
+    A route table written by write_route_table, memory mapped. Each address
+    family is a set of columns (network, length, origin and source of every
+    route) sorted by prefix, so the routes for a prefix, or the most specific
+    ones covering an address, are found by binary search. columns() exposes
+    them as numpy arrays, without copying, for bulk analysis.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n4, n6, trailer_len = ROUTE_HEADER.unpack_from(self.mm)
+        if magic != ROUTE_MAGIC:
+            raise Exception("%s isn't a route table for this machine" % path)
+        self.counts = {4: n4, 6: n6}
+        size = ROUTE_HEADER.size + trailer_len + sum(
+            _column_size(typecode, self.counts[version])
+            for version, columns in ((4, V4_COLUMNS), (6, V6_COLUMNS)) for _, typecode, _ in columns)
+        if len(self.mm) != size:
+            raise Exception("%s isn't the size its header says, rebuild it" % path)
+        self._view = memoryview(self.mm)
+        self._views = []
+        self._sections = {}
+        pos = ROUTE_HEADER.size
+        self.families = {}
+        for version, columns in ((4, V4_COLUMNS), (6, V6_COLUMNS)):
+            n = self.counts[version]
+            family = {}
+            for name, typecode, dtype in columns:
+                size = 16 if typecode == 16 else array.array(typecode).itemsize
+                view = self._view[pos:pos + n * size]
+                self._views.append(view)
+                self._sections[version, name] = (pos, n, dtype)
+                if typecode == 16:
+                    family[name] = _Addresses16(view)
+                else:
+                    family[name] = view.cast(typecode)
+                    self._views.append(family[name])
+                pos += _column_size(typecode, n)
+            self.families[version] = family
+        trailer = json.loads(bytes(self._view[pos:pos + trailer_len]))
+        self.sources = trailer["sources"]
+        self.lengths = {int(v): lengths for v, lengths in trailer["lengths"].items()}
+
+    def __len__(self):
+        return self.counts[4] + self.counts[6]
+
+    def _route(self, version, i):
+        family = self.families[version]
+        network = family["network"][i]
+        length = family["length"][i]
+        address = ipaddress.IPv4Address(network) if version == 4 else ipaddress.IPv6Address(network)
+        return {
+            "route": "%s/%d" % (address, length),
+            "origin": "AS%d" % family["origin"][i],
+            "source": self.sources[family["source"][i]],
+        }
+
+    def rows(self):
+        '''
+        Generate every route as a (version, network, length, origin, source)
+        row.
+        '''
+        for version in (4, 6):
+            family = self.families[version]
+            for i in range(self.counts[version]):
+                yield (version, family["network"][i], family["length"][i], family["origin"][i],
+                       self.sources[family["source"][i]])
+
+    def __iter__(self):
+        for version in (4, 6):
+            for i in range(self.counts[version]):
+                yield self._route(version, i)
+
+    def _exact(self, version, network, length):
+        family = self.families[version]
+        networks = family["network"]
+        i = bisect.bisect_left(networks, network)
+        found = []
+        while i < self.counts[version] and networks[i] == network:
+            if family["length"][i] == length:
+                found.append(i)
+            i += 1
+        return found
+
+    def origins(self, prefix):
+        '''
+        Return the routes (there can be several origins) for exactly prefix.
+        '''
+        parsed = parse_prefix(prefix)
+        if parsed is None:
+            raise ValueError("%s isn't a prefix" % prefix)
+        version, network, length = parsed
+        return [self._route(version, i) for i in self._exact(version, network, length)]
+
+    def covering(self, address):
+        '''
+        Return the routes of the most specific prefix covering address, or an
+        empty list. Only the prefix lengths that occur are tried, longest
+        first.
+        '''
+        address = ipaddress.ip_address(address)
+        version = address.version
+        bits = 32 if version == 4 else 128
+        for length in reversed(self.lengths.get(version, [])):
+            network = int(address) & (((1 << length) - 1) << (bits - length))
+            found = self._exact(version, network, length)
+            if found:
+                return [self._route(version, i) for i in found]
+        return []
+
+    def columns(self, version=4):
+        '''
+        The columns of an address family as numpy arrays over the mapped file.
+        '''
+        if np is None:
+            raise Exception("columns() needs numpy")
+        return {name: np.frombuffer(self.mm, dtype=dtype, count=n, offset=pos)
+                for (v, name), (pos, n, dtype) in self._sections.items() if v == version}
+
+    def annotate(self, db):
+        '''
+        Generate every route with the full db record of its origin AS (or
+        None) under 'as', looked up in db, a dbindex.DBReader. Each origin is
+        only looked up once.
+        '''
+        records = {}
+        for route in self:
+            origin = route["origin"]
+            if origin not in records:
+                records[origin] = db.get(origin)
+            route["as"] = records[origin]
+            yield route
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m pybulkwhois.routes",
+                                     description="Write every route, joined with its origin AS, as json lines.")
+    parser.add_argument("table", help="route table, e.g. out/routes.tbl")
+    parser.add_argument("full_db", help="full db indexed with makeases --index")
+    args = parser.parse_args()
+    with RouteTable(args.table) as table, DBReader(args.full_db) as db:
+        for route in table.annotate(db):
+            sys.stdout.write(json.dumps(route, ensure_ascii=False) + "\n")
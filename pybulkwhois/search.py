@@ -0,0 +1,287 @@
+import argparse
+import array
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+
+from .asblocks import ASBlockIndex, block_range
+from .dbindex import asn_number
+from .join import handle_refs
+
+ENCODING = 'utf-8'
+
+# The text fields that are tokenized into words, from the AS record and the
+# org / contact objects attached to it
+TEXT_FIELDS = ['org-name', 'name', 'descr']
+
+WORD = re.compile(r"\w+")
+
+SEARCH_MAGIC = b"PBWS\x01" + (b"l" if sys.byteorder == "little" else b"b")
+SEARCH_HEADER = struct.Struct("=6s2xQQQQ")
+
+
+def search_index_path(full_db_path):
+    return full_db_path + ".search"
+
+
+def record_terms(record):
+    '''
+    The set of field:token terms an AS record is found by: the words of its
+    text fields, its e-mail addresses (whole, and their user and domain
+    parts) and every handle it refers to, directly or through the objects
+    attached to it. Tokens are lower case.
+    '''
+    terms = set()
+    objs = [record] + list(record.get('handles', {}).values())
+    for obj in objs:
+        for field in TEXT_FIELDS:
+            if field in obj:
+                for word in WORD.findall(obj[field].lower()):
+                    terms.add(field + ":" + word)
+        if 'e-mail' in obj:
+            for addr in obj['e-mail'].lower().split('\n'):
+                addr = addr.strip()
+                if not addr:
+                    continue
+                terms.add("e-mail:" + addr)
+                for part in addr.split('@'):
+                    if part:
+                        terms.add("e-mail:" + part)
+        for handle in handle_refs(obj):
+            terms.add("handle:" + handle.lower())
+    for handle in record.get('handles', {}):
+        terms.add("handle:" + handle.lower())
+    return terms
+
+
+def encode_postings(asns):
+    '''
+    Delta encode a sorted list of AS numbers as LEB128 varints.
+    '''
+    out = bytearray()
+    prev = 0
+    for asn in asns:
+        delta = asn - prev
+        prev = asn
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(buf):
+    asns = []
+    asn = 0
+    delta = 0
+    shift = 0
+    for b in buf:
+        delta |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            asn += delta
+            asns.append(asn)
+            delta = 0
+            shift = 0
+    return asns
+
+
+def build_search_index(full_db_path, out_path=None):
+    '''
+    Write the inverted index of a full db file next to it (<full_db>.search):
+    the sorted terms of record_terms, each with the sorted, delta encoded AS
+    numbers of the records that have it. The handle: postings are the
+    handles_to_asns map of the joins, kept for every RIR at once.
+
+    The terms of a block left unexpanded (compact blocks) are posted for every
+    AS number it covers that has no record of its own, earlier blocks winning
+    where they overlap, as DBReader.get resolves them. So the postings are the
+    same as for the expanded db.
+    '''
+    out_path = out_path or search_index_path(full_db_path)
+    postings = {}
+    numbers = set()
+    blocks = []
+    block_terms = []
+    size = 0
+    with open(full_db_path, 'rb') as f:
+        for l in f:
+            size += len(l)
+            record = json.loads(l)
+            number = asn_number(record.get('asn', ''))
+            if number is None:
+                continue
+            numbers.add(number)
+            terms = record_terms(record)
+            for term in terms:
+                postings.setdefault(term, set()).add(number)
+            r = block_range(record)
+            if r is not None:
+                blocks.append((r[0], r[1], len(block_terms)))
+                block_terms.append(terms)
+
+    block_index = ASBlockIndex(blocks)
+    for first, last, owner in zip(block_index.starts, block_index.ends, block_index.owners):
+        covered = [n for n in range(first, last + 1) if n not in numbers]
+        for term in block_terms[owner]:
+            postings.setdefault(term, set()).update(covered)
+
+    key_ends = array.array('Q')
+    post_ends = array.array('Q')
+    keys = bytearray()
+    posts = bytearray()
+    for term in sorted(postings, key=lambda t: t.encode(ENCODING)):
+        keys += term.encode(ENCODING)
+        key_ends.append(len(keys))
+        posts += encode_postings(sorted(postings[term]))
+        post_ends.append(len(posts))
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as out:
+        out.write(SEARCH_HEADER.pack(SEARCH_MAGIC, size, len(postings), len(keys), len(posts)))
+        key_ends.tofile(out)
+        post_ends.tofile(out)
+        out.write(keys)
+        out.write(posts)
+    os.replace(tmp_path, out_path)
+    logging.debug("Indexed %d search terms of %s.", len(postings), full_db_path)
+    return out_path
+
+
+class SearchIndex(object):
+    '''
+    Answers "which ASes reference this" from an index written by
+    build_search_index. The index is memory mapped, and a term is found by
+    binary search over the sorted terms.
+
+    A query is a list of terms, all of which must match (the result is the
+    intersection). A term is field:token, or a bare token to match in any
+    field; a token ending in * matches every token with that prefix.
+    '''
+
+    FIELDS = TEXT_FIELDS + ['e-mail', 'handle']
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.db_size, n, keys_len, posts_len = SEARCH_HEADER.unpack_from(self.mm)
+        if magic != SEARCH_MAGIC:
+            raise Exception("%s isn't a search index for this machine" % path)
+        self._view = memoryview(self.mm)
+        pos = SEARCH_HEADER.size
+        self.key_ends = self._view[pos:pos + 8 * n].cast('Q')
+        pos += 8 * n
+        self.post_ends = self._view[pos:pos + 8 * n].cast('Q')
+        pos += 8 * n
+        self.keys_start = pos
+        self.posts_start = pos + keys_len
+
+    def __len__(self):
+        return len(self.key_ends)
+
+    def _key(self, i):
+        start = self.keys_start + (self.key_ends[i - 1] if i else 0)
+        return self.mm[start:self.keys_start + self.key_ends[i]]
+
+    def _postings(self, i):
+        start = self.posts_start + (self.post_ends[i - 1] if i else 0)
+        return decode_postings(self.mm[start:self.posts_start + self.post_ends[i]])
+
+    def _lower_bound(self, key):
+        lo, hi = 0, len(self.key_ends)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def terms(self, prefix):
+        '''
+        Generate the (term, index) of every term starting with prefix.
+        '''
+        key = prefix.encode(ENCODING)
+        i = self._lower_bound(key)
+        while i < len(self.key_ends):
+            k = self._key(i)
+            if not k.startswith(key):
+                break
+            yield k.decode(ENCODING), i
+            i += 1
+
+    def postings(self, term):
+        '''
+        Return the sorted AS numbers of the records with exactly this term.
+        '''
+        key = term.encode(ENCODING)
+        i = self._lower_bound(key)
+        if i < len(self.key_ends) and self._key(i) == key:
+            return self._postings(i)
+        return []
+
+    def match(self, term):
+        '''
+        Return the set of AS numbers matching a single query term.
+        '''
+        term = term.lower()
+        field, sep, token = term.partition(":")
+        if not sep or field not in self.FIELDS:
+            fields, token = self.FIELDS, term
+        else:
+            fields = [field]
+        asns = set()
+        for field in fields:
+            if token.endswith("*"):
+                for _, i in self.terms(field + ":" + token[:-1]):
+                    asns.update(self._postings(i))
+            else:
+                asns.update(self.postings(field + ":" + token))
+        return asns
+
+    def search(self, query):
+        '''
+        Return the sorted AS numbers matching every term of query (a string of
+        whitespace separated terms, or a list of them).
+        '''
+        if isinstance(query, str):
+            query = query.split()
+        result = None
+        for term in query:
+            asns = self.match(term)
+            result = asns if result is None else result & asns
+            if not result:
+                return []
+        return sorted(result or [])
+
+    def close(self):
+        self.key_ends.release()
+        self.post_ends.release()
+        self._view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m pybulkwhois.search")
+    parser.add_argument("full_db", help="full db file the index was built from")
+    parser.add_argument("query", nargs="*", help="terms to search for, e.g. e-mail:abuse@example.com")
+    parser.add_argument("--build", action="store_true", help="(re)build the index first")
+    args = parser.parse_args()
+    path = search_index_path(args.full_db)
+    if args.build or not os.path.exists(path):
+        build_search_index(args.full_db)
+    with SearchIndex(path) as index:
+        for asn in index.search(args.query):
+            print("AS%d" % asn)
@@ -0,0 +1,143 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODING = 'utf-8'
+
+# How many bytes of json lines are collected before they're written out
+BUFFER_SIZE = 1024 * 1024
+
+BACKENDS = ['auto', 'json', 'orjson']
+
+
+class Serializer(object):
+    '''
+    Turns records into json lines and back, with orjson if it's installed
+    (backend 'auto', or asked for by name) and the stdlib json module
+    otherwise.
+
+    With compat (the default) the lines written are byte for byte those of
+    json.dumps(record, ensure_ascii=False), whatever the backend: orjson
+    writes compact json, so the stdlib's encoder (made once, rather than on
+    every call) does the writing and the faster backend only the reading.
+    Without it, orjson does both.
+    '''
+
+    def __init__(self, backend='auto', compat=True, buffer_size=BUFFER_SIZE):
+        if backend == 'auto':
+            backend = 'json' if orjson is None else 'orjson'
+        if backend not in BACKENDS:
+            raise Exception("unknown json backend %s" % backend)
+        if backend == 'orjson' and orjson is None:
+            raise Exception("the orjson backend needs orjson installed")
+        self.backend = backend
+        self.compat = compat
+        self.buffer_size = buffer_size
+        self._setup()
+
+    def _setup(self):
+        if self.backend == 'orjson':
+            self.loads = orjson.loads
+            # For records only read back by loads (e.g. staged in the sqlite
+            # join), where the formatting doesn't matter
+            self.pack = orjson.dumps
+        else:
+            self.loads = json.loads
+            self.pack = json.JSONEncoder(ensure_ascii=False).encode
+        if self.backend == 'orjson' and not self.compat:
+            self.dumps = orjson.dumps
+            self.join_lines = _join_bytes
+        else:
+            self.dumps = json.JSONEncoder(ensure_ascii=False).encode
+            self.join_lines = _join_str
+
+    # Sent to parse workers along with an RIR; the functions are set up again
+    # on the other side
+    def __getstate__(self):
+        return {"backend": self.backend, "compat": self.compat, "buffer_size": self.buffer_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    def encode(self, record):
+        '''
+        The json line (newline included) of a single record, as bytes.
+        '''
+        return self.join_lines([self.dumps(record)])
+
+    def writer(self, f):
+        '''
+        A LineWriter over the binary file f.
+        '''
+        return LineWriter(f, self)
+
+
+def _join_str(lines):
+    return ("\n".join(lines) + "\n").encode(ENCODING)
+
+
+def _join_bytes(lines):
+    return b"\n".join(lines) + b"\n"
+
+
+class LineWriter(object):
+    '''
+    Writes records to a binary file as json lines. Each record is serialized
+    as it's written (so it can be changed afterwards), but the lines are only
+    joined, encoded and written out once there's buffer_size bytes of them.
+    '''
+
+    def __init__(self, f, serializer):
+        self.f = f
+        self.dumps = serializer.dumps
+        self.join_lines = serializer.join_lines
+        self.buffer_size = serializer.buffer_size
+        self.lines = []
+        self.size = 0
+
+    def write(self, record):
+        line = self.dumps(record)
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_lines(self, data):
+        '''
+        Write already serialized json lines (bytes) out after the records.
+        '''
+        self.flush()
+        self.f.write(data)
+
+    def flush(self):
+        if self.lines:
+            self.f.write(self.join_lines(self.lines))
+            self.lines = []
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_serializer = None
+
+def default_serializer():
+    '''
+    The serializer used by every RIR in this process that wasn't given its
+    own.
+    '''
+    global _default_serializer
+    if _default_serializer is None:
+        _default_serializer = Serializer()
+    return _default_serializer
@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+import urllib.parse
+
+from .dbindex import DBReader, index_path
+from .search import SearchIndex, search_index_path
+
+ENCODING = 'utf-8'
+
+# What LRUCache.get returns for keys it doesn't have (None is a valid answer)
+MISSING = object()
+
+# Latencies kept per kind of query for the percentiles in the stats
+LATENCY_SAMPLES = 10000
+
+
+class LRUCache(object):
+    '''
+    The maxsize most recently used responses.
+    '''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class LatencyStats(object):
+    '''
+    Count, total and recent latencies of every kind of query.
+    '''
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.totals = collections.Counter()
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+
+    def record(self, kind, seconds):
+        self.counts[kind] += 1
+        self.totals[kind] += seconds
+        self.samples[kind].append(seconds)
+
+    def summary(self):
+        summary = {}
+        for kind, count in self.counts.items():
+            samples = sorted(self.samples[kind])
+            summary[kind] = {
+                "count": count,
+                "mean_ms": 1000 * self.totals[kind] / count,
+                "p50_ms": 1000 * samples[len(samples) // 2],
+                "p99_ms": 1000 * samples[min(len(samples) - 1, len(samples) * 99 // 100)],
+                "max_ms": 1000 * samples[-1],
+            }
+        return summary
+
+
+def format_whois(record):
+    '''
+    Render a full db record as WHOIS text: the AS object, then every object
+    joined onto it, separated by blank lines.
+    '''
+    objs = [record] + list(record.get('handles', {}).values())
+    lines = []
+    for obj in objs:
+        for k, v in obj.items():
+            if k == 'handles':
+                continue
+            for l in str(v).split('\n'):
+                lines.append("%s: %s" % (k, l))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+class QueryServer(object):
+    '''
+    Answers lookups in a full db over WHOIS (port 43) and a small JSON HTTP
+    API, all on one asyncio event loop. Records come from the db's index
+    (dbindex.DBReader) and search index (search.SearchIndex, if built), with
+    the most asked for responses kept in an LRU cache.
+
+    When a new db and index are written over the old ones, the server swaps
+    to them on its next check (every reload_interval seconds). Lookups don't
+    yield to the event loop, so none is ever in the middle of using the old
+    files when they're closed.
+    '''
+
+    # Room for bursts of new connections, WHOIS clients make one per query
+    backlog = 4096
+
+    # Seconds a client gets to send its WHOIS query, or the request line and
+    # headers of an HTTP request (including the wait for the next request on a
+    # kept alive connection), before it's disconnected
+    read_timeout = 30
+
+    # Most headers an HTTP request may have
+    max_headers = 100
+
+    def __init__(self, full_db_path, cache_size=10000, reload_interval=5):
+        self.path = full_db_path
+        self.cache = LRUCache(cache_size)
+        self.stats = LatencyStats()
+        self.reload_interval = reload_interval
+        self.db = None
+        self.search = None
+        self.generation = 0
+        self._version = None
+        self.load()
+
+    def _current_version(self):
+        paths = [index_path(self.path), search_index_path(self.path)]
+        return tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) if os.path.exists(p) else None
+                     for p in paths)
+
+    def load(self):
+        '''
+        Open the db (again) if its index changed since it was last opened.
+        Returns True if it did. A new db that can't be opened (e.g. its index
+        isn't rebuilt yet) is skipped, the old one keeps being served.
+        '''
+        version = self._current_version()
+        if version == self._version:
+            return False
+        try:
+            db = DBReader(self.path)
+        except Exception as e:
+            if self.db is None:
+                raise
+            logging.debug("not reloading %s: %s", self.path, e)
+            return False
+        search = None
+        if os.path.exists(search_index_path(self.path)):
+            search = SearchIndex(search_index_path(self.path))
+            if search.db_size != os.path.getsize(self.path):
+                search.close()
+                search = None
+        old = (self.db, self.search)
+        self.db, self.search = db, search
+        self._version = version
+        self.generation += 1
+        self.cache.clear()
+        for f in old:
+            if f is not None:
+                f.close()
+        logging.debug("serving %s (generation %d, %d asns)", self.path, self.generation, len(db))
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            self.load()
+
+    def _timed(self, kind, f, *args):
+        start = time.perf_counter()
+        try:
+            return f(*args)
+        finally:
+            self.stats.record(kind, time.perf_counter() - start)
+
+    def lookup_asn(self, asn):
+        key = ("asn", asn.upper())
+        value = self.cache.get(key)
+        if value is MISSING:
+            value = self.db.get(asn)
+            self.cache.put(key, value)
+        return value
+
+    def lookup_handle(self, handle):
+        key = ("handle", handle)
+        value = self.cache.get(key)
+        if value is MISSING:
+            value = [r['asn'] for r in self.db.by_handle(handle)]
+            self.cache.put(key, value)
+        return value
+
+    def search_asns(self, query):
+        if self.search is None:
+            return None
+        return ["AS%d" % asn for asn in self.search.search(query)]
+
+    def whois_answer(self, query):
+        '''
+        The WHOIS response to one query line: an AS number, "-s terms" to
+        search or anything else as a handle.
+        '''
+        query = query.strip()
+        if query.startswith("-s "):
+            asns = self._timed("search", self.search_asns, query[3:])
+            if asns is None:
+                return "% no search index\n"
+            return "".join(a + "\n" for a in asns) or "% no entries found\n"
+        if query.upper().startswith("AS") or query.isdigit():
+            record = self._timed("asn", self.lookup_asn, query)
+            if record is None:
+                return "% no entries found\n"
+            return format_whois(record)
+        asns = self._timed("handle", self.lookup_handle, query)
+        return "".join(a + "\n" for a in asns) or "% no entries found\n"
+
+    async def handle_whois(self, reader, writer):
+        try:
+            query = await asyncio.wait_for(reader.readline(), self.read_timeout)
+            writer.write(self.whois_answer(query.decode(ENCODING, errors='replace')).encode(ENCODING))
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    def http_answer(self, target):
+        '''
+        Return (status, json body) for a GET of target.
+        '''
+        url = urllib.parse.urlsplit(target)
+        parts = [urllib.parse.unquote(p) for p in url.path.split('/') if p]
+        if len(parts) == 2 and parts[0] == 'asn':
+            record = self._timed("asn", self.lookup_asn, parts[1])
+            if record is None:
+                return 404, {"error": "not found"}
+            return 200, record
+        if len(parts) == 2 and parts[0] == 'handle':
+            return 200, {"asns": self._timed("handle", self.lookup_handle, parts[1])}
+        if parts == ['search']:
+            query = urllib.parse.parse_qs(url.query).get('q', [''])[0]
+            asns = self._timed("search", self.search_asns, query)
+            if asns is None:
+                return 404, {"error": "no search index"}
+            return 200, {"asns": asns}
+        if parts == ['stats']:
+            return 200, {"generation": self.generation, "asns": len(self.db),
+                         "cache": {"size": len(self.cache.entries), "hits": self.cache.hits,
+                                   "misses": self.cache.misses},
+                         "queries": self.stats.summary()}
+        return 404, {"error": "unknown path"}
+
+    async def read_request(self, reader):
+        '''
+        Read the request line and headers of the next HTTP request. Returns
+        the request line (empty at the end of the connection) and the headers
+        by lower case name, or None for them if there are more than
+        max_headers.
+        '''
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return request_line, {}
+        headers = {}
+        count = 0
+        while True:
+            l = await reader.readline()
+            if not l.strip():
+                return request_line, headers
+            count += 1
+            if count > self.max_headers:
+                return request_line, None
+            k, _, v = l.decode('latin-1').partition(":")
+            headers[k.strip().lower()] = v.strip()
+
+    async def handle_http(self, reader, writer):
+        try:
+            # Connections are kept alive until the client closes them or asks
+            # us to
+            while True:
+                request_line, headers = await asyncio.wait_for(self.read_request(reader),
+                                                               self.read_timeout)
+                if not request_line.strip():
+                    break
+                parts = request_line.decode('latin-1').split()
+                if headers is None:
+                    status, body = 431, {"error": "too many headers"}
+                    headers = {'connection': 'close'}
+                elif len(parts) != 3 or parts[0] not in ('GET', 'HEAD'):
+                    status, body = 405, {"error": "only GET is supported"}
+                    headers['connection'] = 'close'
+                else:
+                    status, body = self.http_answer(parts[1])
+                payload = json.dumps(body, ensure_ascii=False).encode(ENCODING)
+                close = headers.get('connection', '').lower() == 'close' or parts[-1] == 'HTTP/1.0'
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n"
+                              "Content-Length: %d\r\n%s\r\n" % (
+                                  status, "OK" if status == 200 else "Error", len(payload),
+                                  "Connection: close\r\n" if close else "")).encode('latin-1'))
+                if parts[0] != 'HEAD':
+                    writer.write(payload)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="", whois_port=43, http_port=8080):
+        servers = []
+        if whois_port is not None:
+            servers.append(await asyncio.start_server(self.handle_whois, host or None, whois_port,
+                                                      backlog=self.backlog))
+        if http_port is not None:
+            servers.append(await asyncio.start_server(self.handle_http, host or None, http_port,
+                                                      backlog=self.backlog))
+        for server in servers:
+            for sock in server.sockets:
+                logging.debug("listening on %s", sock.getsockname())
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            await asyncio.gather(*[server.serve_forever() for server in servers])
+        finally:
+            watcher.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m pybulkwhois.server")
+    parser.add_argument("full_db", nargs="?", default="out/full_db.json",
+                        help="full db to serve, indexed with makeases --index (default: %(default)s)")
+    parser.add_argument("--host", default="", help="address to listen on (default: all)")
+    parser.add_argument("--whois-port", type=int, default=43)
+    parser.add_argument("--http-port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=10000,
+                        help="number of responses kept in the LRU cache (default: %(default)s)")
+    parser.add_argument("--reload-interval", type=float, default=5,
+                        help="seconds between checks for a rebuilt db (default: %(default)s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    server = QueryServer(args.full_db, args.cache_size, args.reload_interval)
+    asyncio.run(server.serve(args.host, args.whois_port, args.http_port))
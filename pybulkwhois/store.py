@@ -0,0 +1,305 @@
+import io
+import json
+import marshal
+import os
+import struct
+
+from .serialize import default_serializer
+
+ENCODING = 'utf-8'
+
+# The key that identifies a record of each type once it's in standard form
+PRIMARY_KEYS = {
+    'aut-num': 'asn',
+    'organisation': 'orghandle',
+    'person': 'pochandle',
+    'role': 'pochandle',
+}
+
+
+class JSONLStore(object):
+    '''
+    Intermediate records as one json object per line. The original format,
+    and still the one to export when other tools need to read the records.
+    Lines are written and read with serializer (a serialize.Serializer).
+    '''
+    EXTENSION = ".json"
+    # Files written next to each intermediate file, as suffixes of its path
+    SIDECARS = ()
+
+    def __init__(self, serializer=None):
+        self.serializer = serializer or default_serializer()
+
+    # Workers parsing part of a file (RIR.write_intermediate_parallel) can
+    # serialize records themselves, the output is just concatenated
+    def buffer(self):
+        return JSONLWriter(io.BytesIO(), self.serializer)
+
+    def writer(self, path, t):
+        return JSONLWriter(open(path, 'wb'), self.serializer)
+
+    def reader(self, path):
+        return JSONLReader(path, self.serializer)
+
+
+class JSONLWriter(object):
+    def __init__(self, f, serializer):
+        self.f = f
+        self.out = serializer.writer(f)
+
+    def write(self, record):
+        self.out.write(record)
+
+    def getvalue(self):
+        self.out.flush()
+        return self.f.getvalue()
+
+    def write_buffered(self, value):
+        self.out.write_lines(value)
+
+    def close(self):
+        self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JSONLReader(object):
+    def __init__(self, path, serializer):
+        self.path = path
+        self.loads = serializer.loads
+        self._f = None
+
+    def __iter__(self):
+        loads = self.loads
+        with open(self.path, 'rb') as f:
+            for l in f:
+                yield loads(l)
+
+    def handle_index(self, primary_key):
+        '''
+        Map from the primary handle of every record to the offset of its line,
+        built with one pass over the file.
+        '''
+        index = {}
+        offset = 0
+        loads = self.loads
+        with open(self.path, 'rb') as f:
+            for l in f:
+                handle = loads(l).get(primary_key)
+                if handle is not None:
+                    index[handle] = offset
+                offset += len(l)
+        return index
+
+    def read_at(self, offset):
+        '''
+        Decode the record whose line starts at offset.
+        '''
+        if self._f is None:
+            self._f = open(self.path, 'rb')
+        self._f.seek(offset)
+        return self.loads(self._f.readline())
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+# Header of a binary intermediate file. marshal's format can change between
+# Python versions, so its version is part of the header.
+BINARY_MAGIC = b"PBWI\x01" + bytes([marshal.version])
+FRAME_HEADER = struct.Struct("<I")
+
+
+class BinaryStore(object):
+    '''
+    Intermediate records as length prefixed binary frames. Each frame is a
+    marshalled (key ids, values) pair: keys are interned in a per file table
+    (<path>.keys) so each is only stored once, and decoding a record is two C
+    calls rather than a json parse. A sidecar index (<path>.idx) maps the
+    primary handle of every record to the offset of its frame, so single
+    records can be looked up without reading the file. Both sidecars record
+    the size of the file they were written with, so ones left over from an
+    earlier file are caught.
+    '''
+    EXTENSION = ".bin"
+    SIDECARS = (".keys", ".idx")
+
+    def __init__(self, serializer=None):
+        # Only json lines need one
+        self.serializer = serializer
+
+    def buffer(self):
+        return RecordBuffer()
+
+    def writer(self, path, t):
+        return BinaryWriter(path, PRIMARY_KEYS.get(t))
+
+    def reader(self, path):
+        return BinaryReader(path)
+
+
+class RecordBuffer(object):
+    '''
+    Collects records in a worker process. The binary key table belongs to the
+    output file, so the records are only encoded once they're written there.
+    '''
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def getvalue(self):
+        return self.records
+
+
+class BinaryWriter(object):
+    def __init__(self, path, primary_key=None):
+        self.path = path
+        self.primary_key = primary_key
+        self.f = open(path, 'wb')
+        self.f.write(BINARY_MAGIC)
+        self.offset = len(BINARY_MAGIC)
+        self.key_ids = {}
+        self.keys = []
+        self.index = {}
+
+    def write(self, record):
+        ids = []
+        for k in record:
+            i = self.key_ids.get(k)
+            if i is None:
+                i = self.key_ids[k] = len(self.keys)
+                self.keys.append(k)
+            ids.append(i)
+        payload = marshal.dumps((tuple(ids), tuple(record.values())))
+        if self.primary_key is not None and self.primary_key in record:
+            # later records with the same handle win, as they do in add_to_full_db
+            self.index[record[self.primary_key]] = self.offset
+        self.f.write(FRAME_HEADER.pack(len(payload)))
+        self.f.write(payload)
+        self.offset += FRAME_HEADER.size + len(payload)
+
+    def write_buffered(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self.f.close()
+        with open(self.path + ".keys", 'w', encoding=ENCODING) as f:
+            json.dump({"size": self.offset, "keys": self.keys}, f, ensure_ascii=False)
+        with open(self.path + ".idx", 'w', encoding=ENCODING) as f:
+            json.dump({"size": self.offset, "index": self.index}, f, ensure_ascii=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BinaryReader(object):
+    def __init__(self, path):
+        self.path = path
+        self.keys = self._sidecar(".keys", "keys")
+        self._index = None
+        self._f = None
+
+    def _sidecar(self, suffix, field):
+        with open(self.path + suffix, 'r', encoding=ENCODING) as f:
+            sidecar = json.load(f)
+        if not isinstance(sidecar, dict) or sidecar.get("size") != os.path.getsize(self.path):
+            raise Exception("%s is out of date, rebuild it" % (self.path + suffix))
+        return sidecar[field]
+
+    def _decode(self, payload):
+        ids, values = marshal.loads(payload)
+        keys = self.keys
+        return dict(zip([keys[i] for i in ids], values))
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise Exception("%s isn't a binary intermediate file for this python" % self.path)
+            keys = self.keys
+            unpack_from = FRAME_HEADER.unpack_from
+            header_size = FRAME_HEADER.size
+            loads = marshal.loads
+            rest = b""
+            while True:
+                buf = f.read(16 * 1024 * 1024)
+                if not buf:
+                    break
+                buf = rest + buf
+                size = len(buf)
+                pos = 0
+                while pos + header_size <= size:
+                    n, = unpack_from(buf, pos)
+                    end = pos + header_size + n
+                    if end > size:
+                        break
+                    # same as _decode, inlined for speed
+                    ids, values = loads(buf[pos + header_size:end])
+                    yield dict(zip([keys[i] for i in ids], values))
+                    pos = end
+                rest = buf[pos:]
+            if rest:
+                raise Exception("%s is truncated" % self.path)
+
+    @property
+    def index(self):
+        '''
+        Map from primary handle to frame offset.
+        '''
+        if self._index is None:
+            self._index = self._sidecar(".idx", "index")
+        return self._index
+
+    def handle_index(self, primary_key):
+        # Already built when the file was written
+        return self.index
+
+    def read_at(self, offset):
+        '''
+        Decode the record whose frame starts at offset.
+        '''
+        if self._f is None:
+            self._f = open(self.path, 'rb')
+        self._f.seek(offset)
+        n, = FRAME_HEADER.unpack(self._f.read(FRAME_HEADER.size))
+        return self._decode(self._f.read(n))
+
+    def get(self, handle):
+        '''
+        Return the record with primary handle handle, or None.
+        '''
+        offset = self.index.get(handle)
+        if offset is None:
+            return None
+        return self.read_at(offset)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+STORES = {
+    'jsonl': JSONLStore,
+    'binary': BinaryStore,
+}
+
+
+def export_jsonl(path, out_path, serializer=None):
+    '''
+    Write the records of a binary intermediate file out as json lines.
+    '''
+    with JSONLStore(serializer).writer(out_path, None) as out:
+        for record in BinaryReader(path):
+            out.write(record)
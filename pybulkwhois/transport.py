@@ -0,0 +1,418 @@
+import collections
+import concurrent.futures
+import json
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.request as request
+from contextlib import closing
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Size of the pieces downloads are streamed to disk in
+CHUNK_SIZE = 1024 * 1024
+
+# A download's checkpoint is brought up to date once this many more bytes of
+# a segment are in, or this many seconds have passed, whichever comes first
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+CHECKPOINT_SECONDS = 5
+
+# What we record about every request the transport makes
+RequestStats = collections.namedtuple("RequestStats", ["url", "status", "bytes", "seconds"])
+
+# How many of the latest requests' stats a transport keeps. The totals cover
+# all of them.
+RECENT_REQUESTS = 100
+
+
+class CountingReader(io.RawIOBase):
+    '''
+    Wraps a streamed response body, counting the bytes read from it so that
+    the request's stats can be recorded once the body has been consumed.
+    '''
+
+    def __init__(self, raw, on_done):
+        self.raw = raw
+        self.bytes = 0
+        self._on_done = on_done
+
+    def read(self, size=-1):
+        buf = self.raw.read(size)
+        self.bytes += len(buf)
+        if not buf or size is None or size < 0:
+            self._done()
+        return buf
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        self.bytes += n
+        if not n:
+            self._done()
+        return n
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    # closed is our own, not raw.closed: urllib3 closes the response itself
+    # once the body has been read, which readers would take for a closed
+    # file rather than the end of it
+    def close(self):
+        self._done()
+        self.raw.close()
+        super().close()
+
+    def _done(self):
+        if self._on_done is not None:
+            self._on_done(self.bytes)
+            self._on_done = None
+
+
+class BandwidthLimiter(object):
+    '''
+    A token bucket shared by every download of a transport, capping their
+    combined rate at bytes_per_second. Safe to use from several threads.
+    '''
+
+    def __init__(self, bytes_per_second, burst=None):
+        self.rate = float(bytes_per_second)
+        self.burst = float(burst or bytes_per_second)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        '''
+        Block until nbytes may be transferred.
+        '''
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+class FileChanged(Exception):
+    pass
+
+
+class RangeDownload(object):
+    '''
+    One (possibly resumed, possibly segmented) download of url to dest. The
+    state is checkpointed to dest.checkpoint as a list of [start, end,
+    written] segments, along with the validators of the version being fetched.
+    '''
+
+    def __init__(self, transport, url, dest, headers, auth):
+        self.transport = transport
+        self.url = url
+        self.dest = dest
+        self.headers = headers or {}
+        self.auth = auth
+        self.checkpoint_path = dest + ".checkpoint"
+        self.status = None
+        self.transferred = 0
+        self.state = None
+        self._lock = threading.Lock()
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != self.url or not os.path.exists(self.dest):
+            return None
+        return state
+
+    def _save_checkpoint(self):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _validators(self, response):
+        return {"etag": response.headers.get("ETag"),
+                "last-modified": response.headers.get("Last-Modified")}
+
+    def run(self):
+        if self.state is None:
+            self.state = self._load_checkpoint()
+        if self.state is None:
+            return self._start()
+        logging.debug("resuming download of %s", self.url)
+        try:
+            return self._resume()
+        except FileChanged:
+            # Everything we have is from an older version of the file
+            logging.debug("%s changed since the download started, restarting", self.url)
+            self.state = None
+            os.remove(self.checkpoint_path)
+            return self._start()
+
+    def _start(self):
+        response = self.transport.request(self.url, self.headers, self.auth)
+        with closing(response):
+            self.status = response.status_code
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            size = response.headers.get("Content-Length")
+            if response.headers.get("Content-Encoding") or size is None:
+                size = None
+            else:
+                size = int(size)
+            self.state = dict(self._validators(response), url=self.url, size=size)
+            segments = self.transport.segments
+            if (segments > 1 and size and response.headers.get("Accept-Ranges") == "bytes"
+                    and size > segments * self.transport.chunk_size):
+                # Don't read this response, fetch the file in parallel ranges instead
+                step = -(-size // segments)
+                self.state["segments"] = [[i, min(i + step, size), 0] for i in range(0, size, step)]
+                with open(self.dest, 'wb') as out:
+                    out.truncate(size)
+                self._save_checkpoint()
+            else:
+                self.state["segments"] = [[0, size, 0]]
+                self._save_checkpoint()
+                with open(self.dest, 'wb') as out:
+                    self._fetch_body(response, out, 0)
+                return self._finish()
+        return self._resume()
+
+    def _resume(self):
+        todo = [i for i, (start, end, written) in enumerate(self.state["segments"])
+                if end is None or start + written < end]
+        if len(todo) == 1:
+            self._fetch_segment(todo[0])
+        elif todo:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(todo)) as pool:
+                for f in [pool.submit(self._fetch_segment, i) for i in todo]:
+                    f.result()
+        return self._finish()
+
+    def _fetch_segment(self, i):
+        start, end, written = self.state["segments"][i]
+        headers = {"Range": "bytes=%d-%s" % (start + written, "" if end is None else end - 1)}
+        # Only continue if it's still the same version of the file
+        validator = self.state.get("etag") or self.state.get("last-modified")
+        if validator:
+            headers["If-Range"] = validator
+        response = self.transport.request(self.url, headers, self.auth)
+        with closing(response):
+            self.status = response.status_code
+            if response.status_code == 200:
+                # The file changed (or ranges aren't supported after all)
+                raise FileChanged(self.url)
+            if response.status_code == 416 and end is None:
+                # Nothing left after what we already have
+                self.state["segments"][i][1] = start + written
+                return
+            response.raise_for_status()
+            with open(self.dest, 'r+b') as out:
+                out.seek(start + written)
+                self._fetch_body(response, out, i)
+
+    def _fetch_body(self, response, out, i):
+        # The checkpoint only counts what has been flushed to dest. It isn't
+        # rewritten after every chunk, but every CHECKPOINT_BYTES or
+        # CHECKPOINT_SECONDS and once more when the body ends, cleanly or not.
+        unsaved = 0
+        last_save = time.monotonic()
+
+        def save():
+            nonlocal unsaved, last_save
+            out.flush()
+            with self._lock:
+                self.state["segments"][i][2] += unsaved
+                self._save_checkpoint()
+            unsaved = 0
+            last_save = time.monotonic()
+
+        def on_chunk(n):
+            nonlocal unsaved
+            unsaved += n
+            with self._lock:
+                self.transferred += n
+            if unsaved >= CHECKPOINT_BYTES or time.monotonic() - last_save >= CHECKPOINT_SECONDS:
+                save()
+
+        try:
+            self.transport.write_chunks(response, out, on_chunk)
+        finally:
+            save()
+        segment = self.state["segments"][i]
+        if segment[1] is None:
+            # Unknown length, so we only know it's done once the body ended cleanly
+            segment[1] = segment[0] + segment[2]
+            out.truncate(segment[1])
+            with self._lock:
+                self._save_checkpoint()
+
+    def _finish(self):
+        size = self.state["size"]
+        for start, end, written in self.state["segments"]:
+            if start + written != end:
+                raise IncompleteDownload("segment %d-%s incomplete" % (start, end))
+        if size is not None and os.path.getsize(self.dest) != size:
+            raise IncompleteDownload("expected %d bytes, have %d" % (size, os.path.getsize(self.dest)))
+        os.remove(self.checkpoint_path)
+        headers = requests.structures.CaseInsensitiveDict()
+        if self.state["etag"]:
+            headers["ETag"] = self.state["etag"]
+        if self.state["last-modified"]:
+            headers["Last-Modified"] = self.state["last-modified"]
+        return headers
+
+
+class Transport(object):
+    '''
+    The HTTP layer shared by all of the RIR fetchers: a single requests
+    session with a keep-alive connection pool per host, retries with backoff
+    and per request byte / latency counters. Non-HTTP urls (AFRINIC is still
+    served over ftp://) fall back to urllib.
+    '''
+
+    def __init__(self, pool_size=8, retries=3, backoff_factor=1.0, chunk_size=CHUNK_SIZE, timeout=60,
+                 max_bandwidth=None, resume_attempts=5, segments=1):
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.backoff_factor = backoff_factor
+        # How many times an interrupted download is resumed before giving up
+        self.resume_attempts = resume_attempts
+        # Number of parallel ranged requests for servers that support them
+        self.segments = segments
+        # Caps the combined rate of all downloads (bytes/sec) when set
+        self.limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth else None
+        # The latest requests, and running totals of all of them, so a long
+        # lived transport doesn't grow with every request
+        self.stats = collections.deque(maxlen=RECENT_REQUESTS)
+        self.requests = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._stats_lock = threading.Lock()
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET", "HEAD"]))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _record(self, url, status, nbytes, start):
+        stats = RequestStats(url, status, nbytes, time.time() - start)
+        with self._stats_lock:
+            self.stats.append(stats)
+            self.requests += 1
+            self.bytes += nbytes
+            self.seconds += stats.seconds
+        logging.debug("GET %s -> %s, %d bytes in %.2fs", url, status, nbytes, stats.seconds)
+
+    def write_chunks(self, response, out, on_chunk=None):
+        '''
+        Copy the body of response to the file out. Returns the number of bytes.
+        '''
+        nbytes = 0
+        for chunk in response.iter_content(self.chunk_size):
+            if self.limiter is not None:
+                self.limiter.consume(len(chunk))
+            out.write(chunk)
+            nbytes += len(chunk)
+            if on_chunk is not None:
+                on_chunk(len(chunk))
+        return nbytes
+
+    def request(self, url, headers=None, auth=None):
+        '''
+        Send a GET for url and return the response with its body not yet read.
+        '''
+        return self.session.get(url, headers=headers, auth=auth, stream=True, timeout=self.timeout)
+
+    def download(self, url, dest, headers=None, auth=None):
+        '''
+        Stream url to the path dest, chunk_size bytes at a time. Returns the
+        response headers, or None if the server answered 304 Not Modified.
+
+        Progress is checkpointed next to dest, so if the connection drops the
+        download picks up where it left off with a Range request, both on the
+        next attempt here and when a later call is given the same dest. With
+        segments > 1, servers that accept ranges are downloaded in that many
+        parallel pieces. The size (and ETag, through If-Range) is checked before
+        returning, so a truncated or mixed up file never reaches the parser.
+        '''
+        start = time.time()
+        if not url.startswith("http"):
+            with closing(request.urlopen(url, timeout=self.timeout)) as f, open(dest, 'wb') as out:
+                shutil.copyfileobj(f, out, self.chunk_size)
+                self._record(url, None, out.tell(), start)
+                return f.headers
+        download = RangeDownload(self, url, dest, headers, auth)
+        attempt = 0
+        while True:
+            try:
+                retv = download.run()
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, IncompleteDownload) as e:
+                if attempt >= self.resume_attempts:
+                    raise
+                delay = self.backoff_factor * (2 ** attempt)
+                attempt += 1
+                logging.debug("download of %s interrupted (%s), resuming in %.1fs", url, e, delay)
+                time.sleep(delay)
+        self._record(url, download.status, download.transferred, start)
+        return retv
+
+    def open(self, url, auth=None):
+        '''
+        Return a readable (unseekable) file object over the body of url, for
+        parsing a file while it downloads.
+        '''
+        start = time.time()
+        if not url.startswith("http"):
+            raw = request.urlopen(url, timeout=self.timeout)
+            status = None
+        else:
+            response = self.request(url, auth=auth)
+            response.raise_for_status()
+            raw = response.raw
+            # Undo any Content-Encoding, as iter_content does for downloads,
+            # so the caller gets the file itself
+            raw.decode_content = True
+            status = response.status_code
+        # Buffered so the body can be iterated over by line, as the parser does
+        return io.BufferedReader(
+            CountingReader(raw, lambda nbytes: self._record(url, status, nbytes, start)))
+
+    def totals(self):
+        '''
+        Return the number of requests, bytes and seconds spent on them so far.
+        '''
+        with self._stats_lock:
+            return self.requests, self.bytes, self.seconds
+
+
+_default_transport = None
+
+def default_transport():
+    '''
+    The transport shared by every RIR in this process that wasn't given its own.
+    '''
+    global _default_transport
+    if _default_transport is None:
+        _default_transport = Transport()
+    return _default_transport
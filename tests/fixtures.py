@@ -0,0 +1,185 @@
+'''
+Local stand-ins for what the tests would otherwise need the network for, and
+the data the index tests build their files from.
+'''
+import functools
+import gzip
+import http.server
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from benchmarks.generate import generate
+
+# Uncompressed size of the synthetic dumps the tests serve
+DUMP_SIZE = 256 * 1024
+
+
+def ripe_dump(out_dir, size=DUMP_SIZE, seed=1):
+    '''
+    Write a synthetic RIPE dump (see benchmarks.generate) to out_dir. The
+    gzipped split files are named as RIPE publishes them, so out_dir can be
+    served as the RIR's base url. Returns the manifest.
+    '''
+    return generate("ripe", out_dir, size, seed)
+
+
+class FixtureServer(object):
+    '''
+    Serves the files in directory over HTTP from a thread of its own, one
+    more thread per request, in place of an RIR's download server. Every
+    response is held back by delay seconds, so downloads that overlap are
+    easy to tell apart from ones that don't: max_in_flight is the most
+    requests that were ever being answered at once. With content_encoding
+    'gzip', files are sent compressed with a Content-Encoding header, as
+    some servers do.
+
+        with FixtureServer(path) as server:
+            RIPE(base_url=server.url) ...
+    '''
+
+    def __init__(self, directory, delay=0, content_encoding=None):
+        self.delay = delay
+        self.content_encoding = content_encoding
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server._enter()
+                try:
+                    time.sleep(server.delay)
+                    if server.content_encoding == 'gzip':
+                        self.send_gzipped()
+                    else:
+                        super().do_GET()
+                finally:
+                    server._leave()
+
+            def send_gzipped(self):
+                path = self.translate_path(self.path)
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                with open(path, 'rb') as f:
+                    body = gzip.compress(f.read())
+                self.send_response(200)
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                     functools.partial(Handler, directory=directory))
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:%d" % self.httpd.server_port
+        self._thread = None
+
+    def _enter(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.max_in_flight = self.in_flight
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+
+def read_tree(folder):
+    '''
+    The bytes of every file under folder, by path relative to it.
+    '''
+    files = {}
+    for parent, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(parent, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, folder)] = f.read()
+    return files
+
+
+def full_db_records():
+    '''
+    Joined AS records like those of a full db: seeded, so always the same,
+    with shared orgs and contacts, one AS that appears twice and a block.
+    '''
+    rng = random.Random(1)
+    records = []
+    for i in range(1, 200):
+        org = "ORG-%d" % rng.randrange(20)
+        poc = "P%d-TEST" % rng.randrange(40)
+        records.append({
+            "asn": "AS%d" % (i * 997 % 65536),
+            "name": "NET-%d" % i,
+            "orghandle": org,
+            "admin-c": poc,
+            "handles": {
+                org: {"orghandle": org, "org-name": "Société %s Transit" % org},
+                poc: {"pochandle": poc, "e-mail": "noc%d@example%d.net" % (i % 7, i % 3)},
+            },
+        })
+    # the same AS again (from another RIR), and an unexpanded block
+    records.append(dict(records[3], name="SECOND"))
+    records.append({"asn": "AS70000", "asblock": "70000-70099", "name": "BLOCK", "handles": {}})
+    return records
+
+
+def write_lines(path, records):
+    # as the full and nets dbs are written
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def append_line(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def corrupt_magic(path):
+    with open(path, 'r+b') as f:
+        f.write(b"XXXX")
+
+
+class TempDirTestCase(unittest.TestCase):
+    '''
+    Gives every test a temporary directory of its own, removed afterwards.
+    '''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="pybulkwhois-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
@@ -0,0 +1,46 @@
+import unittest
+
+from pybulkwhois.dbindex import DBReader, build_index
+
+from .fixtures import TempDirTestCase, append_line, corrupt_magic, full_db_records, write_lines
+
+
+class DBIndexTest(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.records = full_db_records()
+        self.db = self.path("full_db.json")
+        write_lines(self.db, self.records)
+        build_index(self.db)
+
+    def test_round_trip(self):
+        with DBReader(self.db) as db:
+            self.assertEqual(len(db), len(self.records))
+            firsts = {}
+            for record in self.records:
+                firsts.setdefault(record["asn"], record)
+            for asn, record in firsts.items():
+                self.assertEqual(db.get(asn), record)
+                self.assertEqual(db.get_all(asn), [r for r in self.records if r["asn"] == asn])
+            self.assertEqual(db.get("AS70050"), dict(self.records[-1], asn="AS70050"))
+            self.assertIsNone(db.get("AS70100"))
+            self.assertIsNone(db.get("nonsense"))
+            handles = set(h for r in self.records for h in r["handles"])
+            for handle in handles:
+                self.assertEqual(db.by_handle(handle), [r for r in self.records if handle in r["handles"]])
+            self.assertEqual(db.by_handle("NOT-THERE"), [])
+
+    def test_stale(self):
+        append_line(self.db, {"asn": "AS1"})
+        with self.assertRaisesRegex(Exception, "out of date"):
+            DBReader(self.db)
+
+    def test_magic(self):
+        corrupt_magic(self.db + ".idx")
+        with self.assertRaisesRegex(Exception, "isn't an index"):
+            DBReader(self.db)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from benchmarks.generate import STYLES, generate
+from benchmarks.run import offline_rir, read_entries
+
+from .fixtures import DUMP_SIZE, TempDirTestCase
+
+
+def reference_labeled(lines, ignored_keys, ignored_values):
+    '''
+    The labeled dict of an entry as the original parser built it: joining
+    every continuation onto the value so far, then copying the dict to strip
+    the ignored keys and values. Returns (type, labeled).
+    '''
+    retv = {}
+    top_type = None
+
+    def append(t, v):
+        if t in retv:
+            retv[t] = "\n".join([retv[t], v])
+        else:
+            retv[t] = v
+    last_type = None
+    last_value = None
+    for l in lines:
+        if l[0] == " ":
+            append(last_type, l.strip())
+        elif l[0] == "+":
+            append(last_type, "\n")
+        else:
+            if (l.find(":", 0)) == -1:
+                value = last_value + " " + l.strip()
+                del(retv[last_type])
+                append(last_type, value)
+            else:
+                type_, value = map(lambda x: x.strip(), l.split(":", 1))
+                append(type_, value)
+                last_type = type_
+                last_value = value
+                if not top_type:
+                    top_type = type_
+
+    for k, v in list(retv.items()):
+        if k in ignored_keys or v in ignored_values:
+            del retv[k]
+        else:
+            for iv in ignored_values:
+                if iv in v:
+                    iv_start = v.index(iv)
+                    spliced = v[0:iv_start] + v[iv_start + len(iv):]
+                    retv[k] = spliced.strip()
+    return top_type, retv
+
+
+class EntryTest(TempDirTestCase):
+    '''
+    Every entry of every RIR's synthetic dump must parse to exactly what the
+    original parser made of it, key order included.
+    '''
+
+    def test_same_as_reference(self):
+        for style in STYLES:
+            with self.subTest(style=style):
+                manifest = generate(style, self.path(style), DUMP_SIZE)
+                rir = offline_rir(style, manifest, {})
+                count = 0
+                for entry in read_entries(rir, manifest):
+                    lines = list(entry._lines)
+                    type_, labeled = reference_labeled(lines, rir.IGNORED_KEYS, rir.IGNORED_VALUES)
+                    self.assertEqual(entry.type, type_)
+                    self.assertEqual(list(entry.labeled.items()), list(labeled.items()))
+                    count += 1
+                self.assertGreater(count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pybulkwhois.makeases import TYPES
+from pybulkwhois.rirs.ripe import RIPE
+from pybulkwhois.transport import Transport
+
+from .fixtures import FixtureServer, read_tree, ripe_dump
+
+FULL_DB = "full_db.json"
+
+
+class ConcurrentFetchTest(unittest.TestCase):
+    '''
+    RIPE's split files fetched all at once (fetch_concurrency) from a local
+    server must give the same intermediate files and full db as fetching
+    them one after the other.
+    '''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="pybulkwhois-test-")
+        self.dump = os.path.join(self.tmp, "dump")
+        ripe_dump(self.dump)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def build(self, url, concurrency):
+        '''
+        Run a fresh RIPE against url up to the full db. Returns the bytes of
+        every file written, by name.
+        '''
+        out = tempfile.mkdtemp(dir=self.tmp)
+        os.makedirs(os.path.join(out, "intm"))
+        rir = RIPE(base_url=url)
+        rir.fetch_concurrency = concurrency
+        rir.transport = Transport()
+        try:
+            rir.construct_intermediate_jsons(out, TYPES)
+            open(os.path.join(out, FULL_DB), 'w').close()
+            rir.add_to_full_db(out, FULL_DB, TYPES)
+        finally:
+            for path in rir._downloads.values():
+                os.remove(path)
+        return read_tree(out)
+
+    def test_matches_serial(self):
+        with FixtureServer(self.dump, delay=0.2) as server:
+            serial = self.build(server.url, 1)
+            self.assertEqual(server.requests, len(TYPES))
+            self.assertEqual(server.max_in_flight, 1)
+            server.reset()
+            concurrent = self.build(server.url, len(TYPES))
+            self.assertEqual(server.requests, len(TYPES))
+            self.assertGreater(server.max_in_flight, 1)
+        self.assertIn(FULL_DB, serial)
+        self.assertGreater(len(serial[FULL_DB]), 0)
+        self.assertEqual(serial, concurrent)
+
+    def test_per_host_limit(self):
+        with FixtureServer(self.dump, delay=0.2) as server:
+            self.build(server.url, 2)
+            self.assertLessEqual(server.max_in_flight, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.generate import STYLES, generate
+from benchmarks.run import offline_rir, rir_types
+from pybulkwhois.dbindex import DBReader, build_index
+from pybulkwhois.join import HandleIndex, handle_refs
+
+from .fixtures import DUMP_SIZE, TempDirTestCase
+
+FULL_DB = "full_db.json"
+
+# The synthetic dump of every RIR, made once for the whole module
+_dumps = None
+_memory = {}
+
+
+def setUpModule():
+    global _dumps
+    _dumps = tempfile.mkdtemp(prefix="pybulkwhois-dumps-")
+
+
+def tearDownModule():
+    shutil.rmtree(_dumps, ignore_errors=True)
+
+
+def manifest(style):
+    return generate(style, os.path.join(_dumps, style), DUMP_SIZE)
+
+
+class JoinTest(TempDirTestCase):
+    '''
+    The other join modes against the default in-memory join, over the same
+    synthetic dumps.
+    '''
+
+    def build(self, style, options):
+        '''
+        Build an RIR's full db with the options set. Returns the RIR and the
+        folder it was built in.
+        '''
+        out = tempfile.mkdtemp(dir=self.tmp)
+        os.makedirs(os.path.join(out, "intm"))
+        rir = offline_rir(style, manifest(style), options)
+        types = rir_types(style)
+        rir.construct_intermediate_jsons(out, types)
+        open(os.path.join(out, FULL_DB), 'w').close()
+        rir.add_to_full_db(out, FULL_DB, types)
+        return rir, out
+
+    def memory(self, style):
+        '''
+        The bytes of the full db the in-memory join writes.
+        '''
+        if style not in _memory:
+            with open(os.path.join(self.build(style, {})[1], FULL_DB), 'rb') as f:
+                _memory[style] = f.read()
+            self.assertGreater(len(_memory[style]), 0)
+        return _memory[style]
+
+    def test_sqlite(self):
+        for style in STYLES:
+            with self.subTest(style=style):
+                _, out = self.build(style, {"join_mode": "sqlite", "join_memory_mb": 1})
+                with open(os.path.join(out, FULL_DB), 'rb') as f:
+                    self.assertEqual(f.read(), self.memory(style))
+
+    def test_indexed(self):
+        # The indexed join follows references all the way, so the ASes must be
+        # the same, each with every object the in-memory join gave it and more
+        for style in STYLES:
+            with self.subTest(style=style):
+                rir, out = self.build(style, {"join_mode": "indexed"})
+                with open(os.path.join(out, FULL_DB), 'rb') as f:
+                    indexed = [json.loads(line) for line in f]
+                memory = [json.loads(line) for line in self.memory(style).splitlines()]
+                self.assertEqual(len(indexed), len(memory))
+                index = HandleIndex(rir, out, rir_types(style))
+                try:
+                    for expected, record in zip(memory, indexed):
+                        expected_handles = expected.pop('handles')
+                        handles = record.pop('handles')
+                        self.assertEqual(record, expected)
+                        for handle, obj in expected_handles.items():
+                            self.assertEqual(handles.get(handle), obj)
+                        # and nothing the AS or its objects refer to that
+                        # exists was left out
+                        for obj in [record] + list(handles.values()):
+                            for handle in handle_refs(obj):
+                                if handle in index:
+                                    self.assertIn(handle, handles)
+                finally:
+                    index.close()
+
+    def test_compact_blocks(self):
+        # Looking up any AS in the compact db must find what the expanded db
+        # has for it
+        compacted = 0
+        for style in STYLES:
+            with self.subTest(style=style):
+                _, out = self.build(style, {"expand_blocks": False})
+                compact_db = os.path.join(out, FULL_DB)
+                expanded_db = os.path.join(self.tmp, style + ".json")
+                with open(expanded_db, 'wb') as f:
+                    f.write(self.memory(style))
+                build_index(compact_db)
+                build_index(expanded_db)
+                with DBReader(compact_db) as compact, DBReader(expanded_db) as expanded:
+                    compacted += len(expanded) - len(compact)
+                    asns = set(json.loads(line)['asn'] for line in self.memory(style).splitlines())
+                    for asn in asns:
+                        self.assertEqual(compact.get(asn), expanded.get(asn))
+        # some dump must have had a block to leave unexpanded
+        self.assertGreater(compacted, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
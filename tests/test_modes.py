@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.generate import STYLES, generate
+from benchmarks.run import offline_rir, rir_types
+
+from .fixtures import DUMP_SIZE, TempDirTestCase, read_tree
+
+FULL_DB = "full_db.json"
+
+# The synthetic dump of every RIR, made once for the whole module
+_dumps = None
+_defaults = {}
+
+
+def setUpModule():
+    global _dumps
+    _dumps = tempfile.mkdtemp(prefix="pybulkwhois-dumps-")
+
+
+def tearDownModule():
+    shutil.rmtree(_dumps, ignore_errors=True)
+
+
+def manifest(style):
+    return generate(style, os.path.join(_dumps, style), DUMP_SIZE)
+
+
+class ParseModeTest(TempDirTestCase):
+    '''
+    Every way of parsing an RIR's files must give the same intermediate files
+    and full db, byte for byte, as the default one.
+    '''
+
+    def build(self, style, options):
+        out = tempfile.mkdtemp(dir=self.tmp)
+        os.makedirs(os.path.join(out, "intm"))
+        rir = offline_rir(style, manifest(style), options)
+        types = rir_types(style)
+        rir.construct_intermediate_jsons(out, types)
+        open(os.path.join(out, FULL_DB), 'w').close()
+        rir.add_to_full_db(out, FULL_DB, types)
+        return read_tree(out)
+
+    def default(self, style):
+        if style not in _defaults:
+            _defaults[style] = self.build(style, {})
+            self.assertGreater(len(_defaults[style][FULL_DB]), 0)
+        return _defaults[style]
+
+    def check_same(self, options):
+        for style in STYLES:
+            with self.subTest(style=style):
+                self.assertEqual(self.build(style, options), self.default(style))
+
+    def test_chunked(self):
+        self.check_same({"chunked": True})
+
+    def test_parse_workers(self):
+        self.check_same({"parse_workers": 3})
+        self.check_same({"parse_workers": 3, "chunked": True})
+
+    def test_fused_parse(self):
+        self.check_same({"fused_parse": True})
+        self.check_same({"fused_parse": True, "chunked": True, "parse_workers": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
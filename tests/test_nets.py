@@ -0,0 +1,64 @@
+import ipaddress
+import random
+import unittest
+
+from pybulkwhois.nets import NetIndex, build_net_index, parse_range
+
+from .fixtures import TempDirTestCase, append_line, corrupt_magic, write_lines
+
+
+class NetIndexTest(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(3)
+        self.records = []
+        for i in range(300):
+            if rng.random() < 0.7:
+                length = rng.randrange(8, 29)
+                net = ipaddress.ip_network("10.%d.%d.0/%d" % (rng.randrange(4), rng.randrange(256), length),
+                                           strict=False)
+                self.records.append({"inetnum": "%s - %s" % (net[0], net[-1]), "netname": "V4-%d" % i})
+            else:
+                length = rng.randrange(32, 65)
+                net = ipaddress.ip_network("2001:db8:%x::/%d" % (rng.randrange(16), length), strict=False)
+                self.records.append({"inet6num": str(net), "netname": "V6-%d" % i})
+        self.db = self.path("nets_db.json")
+        write_lines(self.db, self.records)
+        build_net_index(self.db)
+
+    def most_specific(self, address):
+        best = None
+        for record in self.records:
+            version, first, last = parse_range(record.get("inetnum", record.get("inet6num")))
+            if version == address.version and first <= int(address) <= last:
+                if best is None or last - first < best[0]:
+                    best = (last - first, record)
+        return best and best[1]
+
+    def test_round_trip(self):
+        rng = random.Random(4)
+        addresses = [ipaddress.IPv4Address("10.%d.%d.%d" % (rng.randrange(5), rng.randrange(256),
+                                                             rng.randrange(256))) for _ in range(500)]
+        addresses += [ipaddress.IPv6Address("2001:db8:%x::%x" % (rng.randrange(18), rng.randrange(1 << 16)))
+                      for _ in range(200)]
+        with NetIndex(self.db) as index:
+            for address in addresses:
+                self.assertEqual(index.lookup(address), self.most_specific(address), str(address))
+            v4 = [int(a) for a in addresses if a.version == 4]
+            self.assertEqual([int(o) for o in index.lookup_ipv4(v4)],
+                             [-1 if o is None else o for o in (index.offset_of(a) for a in v4)])
+
+    def test_stale(self):
+        append_line(self.db, {"inetnum": "192.0.2.0 - 192.0.2.255"})
+        with self.assertRaisesRegex(Exception, "out of date"):
+            NetIndex(self.db)
+
+    def test_magic(self):
+        corrupt_magic(self.db + ".idx")
+        with self.assertRaisesRegex(Exception, "isn't a net index"):
+            NetIndex(self.db)
+
+
+if __name__ == "__main__":
+    unittest.main()
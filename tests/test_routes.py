@@ -0,0 +1,63 @@
+import ipaddress
+import os
+import random
+import unittest
+
+from pybulkwhois.routes import RouteTable, write_route_table
+
+from .fixtures import TempDirTestCase, corrupt_magic
+
+
+class RouteTableTest(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(5)
+        rows = set()
+        for _ in range(400):
+            if rng.random() < 0.7:
+                length = rng.randrange(8, 25)
+                net = ipaddress.ip_network("%d.%d.0.0/%d" % (rng.randrange(1, 5), rng.randrange(256), length),
+                                           strict=False)
+            else:
+                length = rng.randrange(19, 49)
+                net = ipaddress.ip_network("2001:%x::/%d" % (rng.randrange(1 << 16), length), strict=False)
+            rows.add((net.version, int(net.network_address), length, rng.randrange(1, 1 << 32),
+                      rng.choice(["RIPE", "APNIC", "ARIN"])))
+        self.rows = sorted(rows)
+        self.table = self.path("routes.tbl")
+        self.assertEqual(write_route_table(self.table, iter(rng.sample(self.rows, len(self.rows)))),
+                         len(self.rows))
+
+    def test_round_trip(self):
+        with RouteTable(self.table) as table:
+            self.assertEqual(len(table), len(self.rows))
+            self.assertEqual(sorted(table.rows()), self.rows)
+            version, network, length, origin, source = self.rows[0]
+            address = ipaddress.ip_address(network)
+            self.assertIn({"route": "%s/%d" % (address, length), "origin": "AS%d" % origin, "source": source},
+                          table.origins("%s/%d" % (address, length)))
+            self.assertEqual(table.origins("203.0.113.0/24"), [])
+
+    def test_empty(self):
+        path = self.path("empty.tbl")
+        write_route_table(path, iter([]))
+        with RouteTable(path) as table:
+            self.assertEqual(list(table.rows()), [])
+            self.assertEqual(table.covering("1.2.3.4"), [])
+
+    def test_truncated(self):
+        size = os.path.getsize(self.table)
+        with open(self.table, 'r+b') as f:
+            f.truncate(size - 8)
+        with self.assertRaisesRegex(Exception, "size its header says"):
+            RouteTable(self.table)
+
+    def test_magic(self):
+        corrupt_magic(self.table)
+        with self.assertRaisesRegex(Exception, "isn't a route table"):
+            RouteTable(self.table)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import random
+import unittest
+
+from pybulkwhois.asblocks import block_range
+from pybulkwhois.join import write_asns
+from pybulkwhois.search import (SearchIndex, build_search_index, decode_postings, encode_postings,
+                                record_terms)
+
+from .fixtures import TempDirTestCase, append_line, corrupt_magic, full_db_records, write_lines
+
+
+class SearchIndexTest(TempDirTestCase):
+
+    def test_postings_round_trip(self):
+        rng = random.Random(2)
+        for n in (0, 1, 5, 500):
+            asns = sorted(set(rng.randrange(1 << 32) for _ in range(n)))
+            self.assertEqual(decode_postings(encode_postings(asns)), asns)
+        # every varint length, up to the largest AS number
+        asns = [0, 127, 128, 16383, 16384, 2097151, 2097152, (1 << 32) - 1]
+        self.assertEqual(decode_postings(encode_postings(asns)), asns)
+
+    def test_round_trip(self):
+        records = full_db_records()
+        db = self.path("full_db.json")
+        write_lines(db, records)
+        build_search_index(db)
+        expected = {}
+        for record in records:
+            # the block is found by every AS in it (none of which have
+            # records of their own)
+            r = block_range(record) or (int(record["asn"][2:]),) * 2
+            for term in record_terms(record):
+                expected.setdefault(term, set()).update(range(r[0], r[1] + 1))
+        with SearchIndex(db + ".search") as index:
+            self.assertEqual(len(index), len(expected))
+            self.assertEqual(index.db_size, os.path.getsize(db))
+            for term, asns in expected.items():
+                self.assertEqual(index.postings(term), sorted(asns))
+            self.assertEqual(index.postings("name:not-there"), [])
+            self.assertEqual(index.search("e-mail:example1.net e-mail:noc2"),
+                             sorted(expected["e-mail:example1.net"] & expected["e-mail:noc2"]))
+            self.assertEqual(index.search("org-name:soci*"), sorted(expected["org-name:société"]))
+
+    def test_compact_blocks(self):
+        # Overlapping blocks, one with an AS of its own inside it
+        asn_objs = dict((r["asn"], r) for r in full_db_records())
+        asn_objs["AS70050"] = {"asn": "AS70050", "asblock": "70050-70150", "name": "LATER", "handles": {}}
+        asn_objs["AS70010"] = {"asn": "AS70010", "name": "INSIDE", "handles": {}}
+        compact = self.path("compact.json")
+        expanded = self.path("expanded.json")
+        write_asns(asn_objs, compact, expand_blocks=False)
+        write_asns(asn_objs, expanded)
+        build_search_index(compact)
+        build_search_index(expanded)
+        with SearchIndex(compact + ".search") as c, SearchIndex(expanded + ".search") as e:
+            terms = [t for t, _ in e.terms("")]
+            self.assertEqual([t for t, _ in c.terms("")], terms)
+            for term in terms:
+                self.assertEqual(c.postings(term), e.postings(term))
+            self.assertEqual(c.postings("name:block"),
+                             [n for n in range(70000, 70100) if n not in (70010, 70050)])
+            self.assertEqual(c.postings("name:later"), [70050] + list(range(70100, 70151)))
+
+    def test_stale(self):
+        # The server compares db_size with the db before using the index
+        db = self.path("full_db.json")
+        write_lines(db, full_db_records())
+        build_search_index(db)
+        append_line(db, {"asn": "AS1"})
+        with SearchIndex(db + ".search") as index:
+            self.assertNotEqual(index.db_size, os.path.getsize(db))
+
+    def test_magic(self):
+        db = self.path("full_db.json")
+        write_lines(db, full_db_records())
+        build_search_index(db)
+        corrupt_magic(db + ".search")
+        with self.assertRaisesRegex(Exception, "isn't a search index"):
+            SearchIndex(db + ".search")
+
+
+if __name__ == "__main__":
+    unittest.main()
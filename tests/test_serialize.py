@@ -0,0 +1,57 @@
+import json
+import unittest
+
+from pybulkwhois.serialize import Serializer, orjson
+
+from .fixtures import TempDirTestCase, full_db_records
+
+
+def records():
+    '''
+    Records with the text the dumps have in them: UTF-8 names, LACNIC's
+    latin-1, every latin-1 character (control ones included) and what json
+    has to escape.
+    '''
+    yield from full_db_records()
+    yield {"asn": "AS1", "owner": b"Telef\xf3nica de Espa\xf1a S.A.".decode('latin-1'),
+           "address": "São Paulo\nBrasil", "handles": {}}
+    yield {"asn": "AS2", "descr": bytes(range(256)).decode('latin-1'), "handles": {}}
+    yield {"asn": "AS3", "name": "北京   \U0001f310 \"quoted\" back\\slash\ttab",
+           "handles": {"HÉ": {"pochandle": "HÉ", "e-mail": "über@example.de"}}}
+
+
+@unittest.skipIf(orjson is None, "orjson isn't installed")
+class CompatTest(TempDirTestCase):
+    '''
+    With compat, orjson must write exactly the json module's lines, so the
+    full db doesn't depend on which one is installed.
+    '''
+
+    def write(self, serializer, name):
+        path = self.path(name)
+        with serializer.writer(open(path, 'wb')) as out:
+            for record in records():
+                out.write(record)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_same_bytes(self):
+        expected = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records()).encode('utf-8')
+        self.assertEqual(self.write(Serializer('json'), "json"), expected)
+        # a small buffer, so the lines are joined and written out in pieces
+        self.assertEqual(self.write(Serializer('orjson', compat=True, buffer_size=100), "orjson"),
+                         expected)
+        for record in records():
+            self.assertEqual(Serializer('orjson', compat=True).encode(record),
+                             Serializer('json').encode(record))
+
+    def test_round_trip(self):
+        for backend, compat in (('json', True), ('orjson', True), ('orjson', False)):
+            serializer = Serializer(backend, compat)
+            for record in records():
+                self.assertEqual(serializer.loads(serializer.encode(record)), record)
+                self.assertEqual(serializer.loads(serializer.pack(record)), record)
+
+
+if __name__ == "__main__":
+    unittest.main()
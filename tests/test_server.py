@@ -0,0 +1,88 @@
+import asyncio
+import json
+import time
+import unittest
+
+from pybulkwhois.dbindex import build_index
+from pybulkwhois.server import QueryServer
+
+from .fixtures import TempDirTestCase, full_db_records, write_lines
+
+
+class ClientLimitTest(TempDirTestCase):
+    '''
+    Clients that are too slow to send their request, or send too many
+    headers, are disconnected instead of holding on to a connection.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.records = full_db_records()
+        db = self.path("full_db.json")
+        write_lines(db, self.records)
+        build_index(db)
+        self.server = QueryServer(db)
+        self.server.read_timeout = 0.3
+        self.server.max_headers = 5
+
+    def tearDown(self):
+        self.server.db.close()
+        super().tearDown()
+
+    def talk(self, handler, send, pause=0):
+        '''
+        Connect to handler, send the lines of send (waiting pause seconds
+        before each) and read until the server closes the connection. Returns
+        what was read and how long it all took.
+        '''
+        async def client():
+            server = await asyncio.start_server(handler, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            start = time.time()
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                for l in send:
+                    await asyncio.sleep(pause)
+                    writer.write(l)
+                    await writer.drain()
+                response = await asyncio.wait_for(reader.read(), 5)
+            except ConnectionError:
+                response = b""
+            finally:
+                writer.close()
+                server.close()
+                await server.wait_closed()
+            return response, time.time() - start
+        return asyncio.run(client())
+
+    def test_whois(self):
+        response, _ = self.talk(self.server.handle_whois, [self.records[0]["asn"].encode() + b"\r\n"])
+        self.assertIn(self.records[0]["name"].encode(), response)
+        response, seconds = self.talk(self.server.handle_whois, [])
+        self.assertEqual(response, b"")
+        self.assertLess(seconds, 2)
+
+    def test_http_idle(self):
+        # Kept alive after the first request, until the client goes quiet
+        request = b"GET /asn/%s HTTP/1.1\r\nHost: x\r\n\r\n" % self.records[0]["asn"].encode()
+        response, seconds = self.talk(self.server.handle_http, [request])
+        head, _, body = response.partition(b"\r\n\r\n")
+        self.assertTrue(head.startswith(b"HTTP/1.1 200"))
+        self.assertEqual(json.loads(body), self.records[0])
+        self.assertLess(seconds, 2)
+
+    def test_http_trickle(self):
+        # Every line comes in well within the timeout, the request doesn't
+        lines = [b"GET /stats HTTP/1.1\r\n"] + [b"X-%d: y\r\n" % i for i in range(4)] + [b"\r\n"]
+        response, _ = self.talk(self.server.handle_http, lines, pause=0.1)
+        self.assertEqual(response, b"")
+
+    def test_http_headers(self):
+        request = b"GET /stats HTTP/1.1\r\n" + b"".join(b"X-%d: y\r\n" % i for i in range(6)) + b"\r\n"
+        response, _ = self.talk(self.server.handle_http, [request])
+        self.assertTrue(response.startswith(b"HTTP/1.1 431"))
+        self.assertIn(b"Connection: close", response)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pybulkwhois.serialize import Serializer, orjson
+from pybulkwhois.store import BinaryReader, BinaryStore, JSONLStore, export_jsonl
+
+
+def person(i, **extra):
+    record = {"person": "Pérson %d" % i, "pochandle": "P%d-TEST" % i,
+              "address": "Line one\nLine two\næøå 中文", "source": "TEST"}
+    record.update(extra)
+    return record
+
+
+# Records of different shapes (key order, keys only some have, a handle that
+# comes back later with a new object)
+RECORDS = ([person(i) for i in range(50)] +
+           [{"remarks": "no handle at all"}] +
+           [person(7, phone="+31 20 000 0000")] +
+           [dict(reversed(list(person(i).items()))) for i in range(50, 60)])
+
+
+def last_by_handle(records):
+    found = {}
+    for record in records:
+        if "pochandle" in record:
+            found[record["pochandle"]] = record
+    return found
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="pybulkwhois-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def write(self, store, records, name="person"):
+        path = os.path.join(self.tmp, name + store.EXTENSION)
+        with store.writer(path, "person") as out:
+            for record in records:
+                out.write(record)
+        return path
+
+    def check_round_trip(self, store):
+        path = self.write(store, RECORDS)
+        reader = store.reader(path)
+        try:
+            self.assertEqual(list(reader), RECORDS)
+            # later records with the same handle win
+            index = reader.handle_index("pochandle")
+            expected = last_by_handle(RECORDS)
+            self.assertEqual(sorted(index), sorted(expected))
+            for handle, offset in index.items():
+                self.assertEqual(reader.read_at(offset), expected[handle])
+        finally:
+            reader.close()
+        return path
+
+    def test_jsonl_round_trip(self):
+        self.check_round_trip(JSONLStore(Serializer('json')))
+
+    @unittest.skipIf(orjson is None, "orjson isn't installed")
+    def test_jsonl_round_trip_orjson(self):
+        self.check_round_trip(JSONLStore(Serializer('orjson')))
+        self.check_round_trip(JSONLStore(Serializer('orjson', compat=False)))
+
+    def test_jsonl_compat_bytes(self):
+        # Whatever the backend, compat lines are the json module's
+        backends = ['json'] + ([] if orjson is None else ['orjson'])
+        written = set()
+        for backend in backends:
+            path = self.write(JSONLStore(Serializer(backend, buffer_size=100)), RECORDS, backend)
+            with open(path, 'rb') as f:
+                written.add(f.read())
+        self.assertEqual(len(written), 1)
+
+    def test_binary_round_trip(self):
+        path = self.check_round_trip(BinaryStore())
+        reader = BinaryReader(path)
+        try:
+            for handle, record in last_by_handle(RECORDS).items():
+                self.assertEqual(reader.get(handle), record)
+            self.assertIsNone(reader.get("NOT-THERE"))
+        finally:
+            reader.close()
+
+    def test_binary_export(self):
+        path = self.write(BinaryStore(), RECORDS)
+        out_path = os.path.join(self.tmp, "exported.json")
+        export_jsonl(path, out_path, Serializer('json'))
+        self.assertEqual(list(JSONLStore(Serializer('json')).reader(out_path)), RECORDS)
+
+    def test_binary_empty(self):
+        path = self.write(BinaryStore(), [])
+        self.assertEqual(list(BinaryReader(path)), [])
+        self.assertIsNone(BinaryReader(path).get("P1-TEST"))
+
+    def test_binary_stale_sidecars(self):
+        # The sidecars of an earlier version of the file, left next to a new one
+        path = self.write(BinaryStore(), RECORDS[:10])
+        for suffix in BinaryStore.SIDECARS:
+            shutil.copy(path + suffix, path + suffix + ".old")
+        self.write(BinaryStore(), RECORDS)
+        shutil.copy(path + ".idx.old", path + ".idx")
+        reader = BinaryReader(path)
+        with self.assertRaisesRegex(Exception, "out of date"):
+            reader.get("P1-TEST")
+        shutil.copy(path + ".keys.old", path + ".keys")
+        with self.assertRaisesRegex(Exception, "out of date"):
+            BinaryReader(path)
+
+    def test_binary_truncated(self):
+        path = self.write(BinaryStore(), RECORDS)
+        size = os.path.getsize(path)
+        with open(path, 'r+b') as f:
+            f.truncate(size - 3)
+        with self.assertRaisesRegex(Exception, "out of date"):
+            BinaryReader(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
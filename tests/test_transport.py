@@ -0,0 +1,60 @@
+import os
+import unittest
+
+from benchmarks.generate import generate
+from pybulkwhois.file import BulkWHOISFile
+from pybulkwhois.rirs.lacnic import LACNIC
+from pybulkwhois.transport import Transport
+
+from .fixtures import DUMP_SIZE, FixtureServer, TempDirTestCase
+
+
+class ContentEncodingTest(TempDirTestCase):
+    '''
+    A server that sends a file with Content-Encoding: gzip must still give
+    the caller the file itself, whether it's opened as a stream or
+    downloaded.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        # LACNIC's bulk file is published uncompressed
+        manifest = generate("lacnic", self.path("dump"), DUMP_SIZE)
+        self.db = manifest["published"]["db"]
+        with open(self.db, 'rb') as f:
+            self.content = f.read()
+
+    def url(self, server):
+        return "%s/%s" % (server.url, os.path.basename(self.db))
+
+    def entries(self, f):
+        rir = LACNIC()
+        return [e.labeled for e in BulkWHOISFile(f, rir.IGNORED_KEYS, rir.IGNORED_VALUES,
+                                                 encoding=rir.FILE_ENCODING)]
+
+    def test_open(self):
+        with FixtureServer(self.path("dump"), content_encoding='gzip') as server:
+            transport = Transport()
+            f = transport.open(self.url(server))
+            try:
+                self.assertEqual(f.read(), self.content)
+            finally:
+                f.close()
+            # and parsed as it comes in, as LACNIC.get_stream does
+            streamed = self.entries(transport.open(self.url(server)))
+            self.assertEqual(transport.totals()[1], 2 * len(self.content))
+        with open(self.db, 'rb') as f:
+            expected = self.entries(f)
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(streamed, expected)
+
+    def test_download(self):
+        dest = self.path("download")
+        with FixtureServer(self.path("dump"), content_encoding='gzip') as server:
+            Transport().download(self.url(server), dest, {})
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+
+if __name__ == "__main__":
+    unittest.main()